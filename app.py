@@ -1,6 +1,8 @@
 """
 Fun-ASR All-in-One Docker Service
 FastAPI + WebSocket + Gradio UI with Progress
+
+Set UI_MODE=none for a headless API process (Gradio is not imported).
 """
 import os
 import io
@@ -10,19 +12,29 @@ import asyncio
 import tempfile
 import logging
 import uuid
+import math
+import hmac
+import wave
 import threading
 from pathlib import Path
-from typing import Optional, List, Callable, Generator
+from typing import Optional, List, Callable, Generator, Union
 from contextlib import asynccontextmanager
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future
 
 import torch
 import torchaudio
 import numpy as np
-from fastapi import FastAPI, File, UploadFile, WebSocket, WebSocketDisconnect, HTTPException, Form, BackgroundTasks
+from fastapi import FastAPI, File, UploadFile, WebSocket, WebSocketDisconnect, HTTPException, Form, BackgroundTasks, Request
 from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-import gradio as gr
+
+from engine import InferenceEngine, AdmissionRejected, AdmissionTicket, ScheduledJob, parse_frontend_map
+from telemetry import TelemetrySampler
+from capture import TrafficCapture
+from segment_cache import SegmentCache, fingerprint
+from ws_sessions import SessionStore, SessionBufferFull, SessionLimitExceeded, WSSession
+from settings import Setting, SettingsRegistry, SettingError
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -34,10 +46,168 @@ model_path = None
 
 # Task storage for async API
 tasks = {}
-executor = ThreadPoolExecutor(max_workers=2)
 
-# Audio longer than this (seconds) will use VAD segmentation
-VAD_THRESHOLD_SECONDS = 30
+def _frontend_map(cast):
+    def validate(value: str):
+        for frontend, limit in parse_frontend_map(value, cast).items():
+            if cast is not str and limit < 0:
+                raise ValueError(f"negative value for {frontend}")
+    return validate
+
+# Performance knobs: defaults < environment < SETTINGS_FILE (JSON). GET /v1/settings
+# shows the effective values; PATCH /admin/settings changes them at runtime. Hot
+# settings apply to the next request or decode call; reload_required ones are
+# persisted to SETTINGS_FILE (when set) and take effect after a restart.
+settings = SettingsRegistry(os.environ.get("SETTINGS_FILE"))
+for _setting in (
+    Setting("engine_workers", int, 8, "Worker threads, i.e. requests in flight", minimum=1,
+            on_change=lambda v: engine.executor.set_max_workers(v)),
+    Setting("device_slots", int, 2, "Concurrent decode calls on the device", minimum=1,
+            on_change=lambda v: engine.scheduler.set_slots(v)),
+    Setting("scheduler_aging_rate", float, 5.0, "Scheduler credit (audio-seconds) per second a decode call waits",
+            minimum=0, on_change=lambda v: engine.scheduler.set_aging_rate(v)),
+    Setting("scheduler_fair_every", int, 4, "Every Nth device grant goes to the longest-waiting segment (0 = never)",
+            minimum=0, on_change=lambda v: engine.scheduler.set_fair_every(v)),
+    Setting("frontend_max_concurrent", str, "ui=1,mcp=1", "Max running jobs per frontend",
+            validator=_frontend_map(int),
+            on_change=lambda v: engine.executor.set_group_limits(parse_frontend_map(v, int))),
+    Setting("frontend_shares", str, "ui=0.5,mcp=0.5", "Max fraction of its class budget per frontend",
+            validator=_frontend_map(float),
+            on_change=lambda v: engine.admission.set_shares(parse_frontend_map(v))),
+    Setting("admission_max_interactive_seconds", float, 600.0, "Queued audio-seconds cap, interactive class",
+            minimum=0, on_change=lambda v: engine.admission.set_limit("interactive", v)),
+    Setting("admission_max_batch_seconds", float, 3600.0, "Queued audio-seconds cap, batch class",
+            minimum=0, on_change=lambda v: engine.admission.set_limit("batch", v)),
+    Setting("vad_threshold_seconds", float, 30.0, "Audio longer than this uses VAD segmentation", minimum=1),
+    Setting("silence_trim", bool, True, "Trim silence / skip silent clips on the short-audio path"),
+    Setting("silence_threshold_db", float, -50.0, "Silence threshold (dBFS, 20 ms frames)", maximum=0),
+    Setting("silence_pad_ms", int, 200, "Audio kept around speech when trimming", minimum=0),
+    Setting("segment_cache_size", int, 1024, "Cached VAD segment transcripts (0 disables)", minimum=0,
+            on_change=lambda v: segment_cache.resize(v)),
+    Setting("max_length", int, 512, "Max generated tokens per decode call", minimum=16, maximum=4096),
+    Setting("greedy_decoder", bool, False, "Decode with the static-cache greedy loop instead of llm.generate()"),
+    Setting("llm_dtype", str, "", "LLM weight/compute dtype (empty = model config)",
+            choices=("", "fp32", "fp16", "bf16"), reload_required=True),
+    Setting("encoder_backend", str, "torch", "Audio encoder + adaptor backend (see onnx_encoder.py)",
+            choices=("torch", "onnx"), reload_required=True),
+    Setting("fast_load", str, "0", "Meta-device construction + mmap checkpoint load "
+            "(convert: also write a safetensors copy to FAST_LOAD_CACHE_DIR)",
+            choices=("0", "1", "convert"), reload_required=True),
+    Setting("ws_session_ttl_seconds", float, 300.0, "Seconds a disconnected WebSocket session is kept for resume",
+            minimum=0, on_change=lambda v: setattr(ws_sessions, "ttl", v)),
+    Setting("ws_session_max_bytes", int, 256 * 1024 * 1024, "Max audio bytes buffered per WebSocket session",
+            minimum=1024, on_change=lambda v: setattr(ws_sessions, "max_bytes", v)),
+    Setting("ws_sessions_max_total_bytes", int, 2 * 1024 * 1024 * 1024,
+            "Max audio bytes buffered across all WebSocket sessions", minimum=1024,
+            on_change=lambda v: setattr(ws_sessions, "max_total_bytes", v)),
+    Setting("ws_max_sessions", int, 1000, "Max open or resumable WebSocket sessions", minimum=1,
+            on_change=lambda v: setattr(ws_sessions, "max_sessions", v)),
+    Setting("lora_adapters", str, "", "LoRA adapters on the shared base LLM (name=dir,...)",
+            validator=_frontend_map(str), reload_required=True),
+):
+    settings.register(_setting)
+
+# Every frontend submits through one engine: a shared worker pool plus admission control
+# (cap on audio-seconds admitted but not yet finished, per priority class).
+# Interactive = WebSocket/Web UI, batch = REST (sync + async)/SSE/MCP.
+# FRONTEND_MAX_CONCURRENT caps running jobs per frontend; FRONTEND_SHARES caps a
+# frontend's queued audio at a fraction of its class budget.
+# ENGINE_WORKERS requests are in flight at once, but only DEVICE_SLOTS decode calls
+# run on the device; slots go segment by segment to the request with the least
+# remaining audio, with SCHEDULER_AGING_RATE audio-seconds of credit per second waited;
+# every SCHEDULER_FAIR_EVERY-th grant goes to the longest-waiting segment instead.
+engine = InferenceEngine(
+    max_workers=settings["engine_workers"],
+    class_limits={
+        "interactive": settings["admission_max_interactive_seconds"],
+        "batch": settings["admission_max_batch_seconds"],
+    },
+    frontends={"rest": "batch", "sse": "batch", "mcp": "batch", "ws": "interactive", "ui": "interactive"},
+    max_concurrent=parse_frontend_map(settings["frontend_max_concurrent"], int),
+    shares=parse_frontend_map(settings["frontend_shares"]),
+    default_throughput=float(os.environ.get("ADMISSION_DEFAULT_THROUGHPUT", 10)),
+    device_slots=settings["device_slots"],
+    aging_rate=settings["scheduler_aging_rate"],
+    fair_every=settings["scheduler_fair_every"],
+)
+
+# Resource telemetry: sampled in the background so probes never shell out
+telemetry = TelemetrySampler(
+    interval=float(os.environ.get("TELEMETRY_INTERVAL_SECONDS", 5)),
+    history=int(os.environ.get("TELEMETRY_HISTORY", 120)),
+    sources={"executor": engine.executor.stats},
+    # Only the model's device (cuda:0), so the sampler never opens contexts on other GPUs
+    devices=[0],
+)
+
+# Opt-in traffic capture for replay.py: request metadata (and optionally sampled audio)
+capture = TrafficCapture(
+    os.environ.get("CAPTURE_LOG", ""),
+    audio_sample_rate=float(os.environ.get("CAPTURE_AUDIO_SAMPLE_RATE", 0)),
+    audio_dir=os.environ.get("CAPTURE_AUDIO_DIR") or None,
+)
+
+# Transcripts of recurring VAD segments (IVR prompts, hold music), keyed on an audio
+# fingerprint + decode params; SEGMENT_CACHE_SIZE=0 disables it
+segment_cache = SegmentCache(settings["segment_cache_size"])
+
+# Resumable /ws/transcribe sessions: received audio and result events survive a dropped
+# connection for WS_SESSION_TTL_SECONDS (0 = cancel as soon as the client goes away)
+ws_sessions = SessionStore(settings["ws_session_ttl_seconds"], settings["ws_session_max_bytes"],
+                           max_total_bytes=settings["ws_sessions_max_total_bytes"],
+                           max_sessions=settings["ws_max_sessions"])
+
+# Audio longer than VAD_THRESHOLD_SECONDS uses VAD segmentation.
+# Short-audio energy pre-filter: leading/trailing audio quieter than SILENCE_THRESHOLD_DB
+# (dBFS, 20 ms frames) is trimmed, keeping SILENCE_PAD_MS around speech, and
+# all-silent clips return "" without running the model. SILENCE_TRIM=0 disables it.
+
+# Bearer token for PATCH /admin/settings; the admin API is disabled when unset
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# Finished async tasks are dropped after this many seconds
+TASK_TTL_SECONDS = 3600
+
+# Startup warmup: synthetic audio of these lengths (seconds) is decoded before
+# /health reports ready, so kernel selection and allocator growth happen before
+# real traffic. COMPILE_ENCODER=1 also torch.compiles the encoder+adaptor with
+# inputs padded to these buckets.
+WARMUP_ENABLED = os.environ.get("WARMUP", "1") == "1"
+WARMUP_BUCKETS = [float(s) for s in os.environ.get("WARMUP_BUCKETS", "5,15,30").split(",") if s.strip()]
+COMPILE_ENCODER = os.environ.get("COMPILE_ENCODER", "0") == "1"
+COMPILE_MODE = os.environ.get("COMPILE_MODE", "default")
+
+# GREEDY_DECODER=1 decodes with FunASRNano's static-cache greedy loop instead of
+# llm.generate(); ENCODER_BACKEND=onnx runs the audio encoder + adaptor on ONNX
+# Runtime (CPU, see onnx_encoder.py). Both live in the settings registry above.
+
+# FAST_LOAD=convert writes a safetensors copy of the checkpoint here (never into
+# the model cache) so later starts can memory-map it
+FAST_LOAD_CACHE_DIR = os.environ.get("FAST_LOAD_CACHE_DIR", os.path.expanduser("~/.cache/fun-asr/safetensors"))
+
+warmup_state = {"status": "pending", "buckets": {}, "error": None}
+
+class TranscriptionCancelled(Exception):
+    """Raised in the worker when the job's cancel token has been triggered"""
+
+class CancelToken:
+    """Thread-safe cancellation flag shared between a request and its worker"""
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = None
+
+    def cancel(self, reason: str = "cancelled"):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TranscriptionCancelled(self.reason)
 
 def get_model():
     """Get or load the ASR model (singleton, always in GPU memory)"""
@@ -59,17 +229,48 @@ def get_model():
         device = "cuda:0"
         logger.info(f"Loading model on {device}...")
         start = time.time()
+        load_kwargs = {}
+        if settings["fast_load"] != "0":
+            # Meta-device construction + mmap checkpoint load inside FunASRNano;
+            # blank init_param stops funasr from reading the checkpoint a second time
+            load_kwargs = {"fast_load": True, "init_param": ""}
+            if settings["fast_load"] == "convert":
+                load_kwargs["fast_load_convert_dir"] = FAST_LOAD_CACHE_DIR
+        if settings["llm_dtype"]:
+            load_kwargs["llm_dtype"] = settings["llm_dtype"]
         model = AutoModel(
             model=model_dir,
             trust_remote_code=True,
             remote_code="./model.py",
             device=device,
             disable_update=True,
+            **load_kwargs,
         )
         model_path = model.model_path
+        if settings["encoder_backend"] == "onnx":
+            from onnx_encoder import load_encoder
+            model.model.use_onnx_encoder(load_encoder(
+                model.model, model.kwargs["frontend"], model_path,
+                quantize_int8=os.environ.get("ONNX_QUANTIZE", "0") == "1",
+                num_threads=int(os.environ.get("ONNX_THREADS", 0)),
+            ))
+            logger.info("Audio encoder running on ONNX Runtime")
+        if lora_adapters():
+            model.model.load_adapters(lora_adapters())
         logger.info(f"Model loaded in {time.time()-start:.2f}s")
     return model
 
+def lora_adapters() -> dict:
+    """Configured LoRA adapters (name -> adapter dir) as loaded at startup"""
+    return parse_frontend_map(settings["lora_adapters"], str)
+
+def check_adapter(adapter: Optional[str]) -> Optional[str]:
+    """Normalize a request's adapter name; unknown names are rejected with 400"""
+    adapter = (adapter or "").strip() or None
+    if adapter is not None and adapter not in lora_adapters():
+        raise HTTPException(status_code=400, detail=f"Unknown adapter: {adapter} (available: {sorted(lora_adapters())})")
+    return adapter
+
 def get_vad_model():
     """Get or load VAD model for long audio segmentation"""
     global vad_model
@@ -91,6 +292,35 @@ def get_vad_model():
         logger.info(f"VAD model loaded in {time.time()-start:.2f}s")
     return vad_model
 
+def warmup():
+    """Preload VAD and decode synthetic audio per length bucket (runs once at startup)"""
+    warmup_state["status"] = "running"
+    start = time.time()
+    try:
+        m = get_model()
+        vad = get_vad_model()
+        if COMPILE_ENCODER:
+            frontend = m.kwargs["frontend"]
+            frame_ms = frontend.frame_shift * frontend.lfr_n
+            m.model.enable_compile([int(math.ceil(b * 1000 / frame_ms)) for b in WARMUP_BUCKETS], COMPILE_MODE)
+            logger.info(f"Encoder compile enabled for buckets {WARMUP_BUCKETS}s (mode={COMPILE_MODE})")
+        generator = torch.Generator().manual_seed(0)
+        for seconds in sorted(WARMUP_BUCKETS):
+            # Low-level noise rather than silence so the decoder runs a few steps
+            audio = torch.randn(int(seconds * 16000), generator=generator) * 0.01
+            t = time.time()
+            run_generate(m, audio, [], "auto", True)
+            warmup_state["buckets"][str(seconds)] = round(time.time() - t, 3)
+            logger.info(f"Warmup {seconds}s bucket: {warmup_state['buckets'][str(seconds)]}s")
+        if WARMUP_BUCKETS:
+            vad.generate(input=audio)
+        warmup_state["status"] = "ready"
+    except Exception as e:
+        # Serve anyway: warmup only moves latency, it is not required for correctness
+        logger.error(f"Warmup failed: {e}")
+        warmup_state.update(status="failed", error=str(e))
+    warmup_state["elapsed"] = round(time.time() - start, 2)
+
 def get_audio_duration(audio_path: str) -> float:
     """Get audio duration in seconds"""
     try:
@@ -99,64 +329,171 @@ def get_audio_duration(audio_path: str) -> float:
     except:
         return 0
 
+def admission_duration(audio) -> float:
+    """Audio-seconds to admit; undecodable or empty audio must not pass admission at zero cost"""
+    duration = get_audio_duration(audio)
+    if duration <= 0:
+        raise ValueError("Could not decode audio (unsupported format or empty file)")
+    return duration
+
+def load_waveform(audio) -> torch.Tensor:
+    """Load a path or file-like object as a mono 16 kHz waveform of shape [1, samples]"""
+    waveform, sr = torchaudio.load(audio)
+    if sr != 16000:
+        waveform = torchaudio.functional.resample(waveform, sr, 16000)
+    return waveform.mean(dim=0, keepdim=True) if waveform.shape[0] > 1 else waveform
+
+def voiced_range(samples: torch.Tensor, sr: int = 16000, frame_ms: int = 20):
+    """
+    (start, end) sample range around frames louder than SILENCE_THRESHOLD_DB, padded
+    by SILENCE_PAD_MS, or None when the whole clip is below the threshold.
+    """
+    frame = sr * frame_ms // 1000
+    n_frames = samples.numel() // frame
+    if n_frames == 0:
+        return None
+    frames = samples[: n_frames * frame].float().reshape(n_frames, frame)
+    rms_db = 10 * torch.log10(frames.pow(2).mean(dim=1) + 1e-10)
+    voiced = torch.nonzero(rms_db > settings["silence_threshold_db"]).flatten()
+    if voiced.numel() == 0:
+        return None
+    pad = sr * settings["silence_pad_ms"] // 1000
+    start = max(0, int(voiced[0]) * frame - pad)
+    end = min(samples.numel(), (int(voiced[-1]) + 1) * frame + pad)
+    return start, end
+
+def run_generate(m, audio_input, hotwords: List[str], language: str, itn: bool,
+                 cancel_token: Optional[CancelToken] = None,
+                 partial_callback: Optional[Callable[[str], None]] = None,
+                 job: Optional[ScheduledJob] = None, seconds: float = 0.0, adapter: Optional[str] = None) -> list:
+    """
+    Run AutoModel.generate on a single input, inside a device slot of the engine's
+    segment scheduler (job: the request's scheduler handle, seconds: input length),
+    with the named LoRA adapter (None = base behaviour).
+    
+    AutoModel merges call options into its shared kwargs dict, so a private copy
+    is passed to keep per-request objects (cancel token, partial callback) from
+    leaking across threads. Decode settings are read per call so runtime changes
+    apply to the next segment.
+    """
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+    with engine.device_slot(job or engine.job(seconds), seconds):
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        res = m.generate(
+            input=[audio_input], cache={}, batch_size=1, kwargs=dict(m.kwargs),
+            hotwords=hotwords or [], language=language, itn=itn,
+            cancel_token=cancel_token, partial_callback=partial_callback,
+            max_length=settings["max_length"], greedy_decoder=settings["greedy_decoder"], adapter=adapter,
+        )
+    # Generation may have been stopped early by the cancel token
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+    return res
+
+def segment_partial(partial_callback: Optional[Callable[[int, str], None]], index: int) -> Optional[Callable[[str], None]]:
+    """Bind a segment index to a partial-hypothesis callback"""
+    if partial_callback is None:
+        return None
+    return lambda text: partial_callback(index, text)
+
 def transcribe_with_progress(
-    audio_path: str, 
+    audio: Union[str, bytes], 
     language: str = "auto", 
     hotwords: List[str] = None, 
     itn: bool = True,
-    progress_callback: Callable[[int, int, str], None] = None
+    progress_callback: Callable[[int, int, str], None] = None,
+    cancel_token: Optional[CancelToken] = None,
+    partial_callback: Callable[[int, str], None] = None,
+    adapter: Optional[str] = None,
 ) -> dict:
     """
     Core transcription function with VAD for long audio and progress callback.
     
     Args:
+        audio: File path, or encoded audio bytes (decoded in memory, no temp file)
         progress_callback: Function(current, total, partial_text) called during processing
+        cancel_token: Checked between VAD segments and during generation; raises
+            TranscriptionCancelled once triggered
+        partial_callback: Function(segment_index, hypothesis) called as tokens of the
+            segment being decoded are generated
+        adapter: LoRA adapter name (see LORA_ADAPTERS); None uses the base model
     """
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
     m = get_model()
     start = time.time()
     
-    duration = get_audio_duration(audio_path)
+    if isinstance(audio, bytes):
+        waveform = load_waveform(io.BytesIO(audio))
+        audio_input = waveform[0]
+        duration = waveform.shape[1] / 16000
+    else:
+        waveform = None
+        audio_input = audio
+        duration = get_audio_duration(audio)
+    # Per-stage wall time (seconds), reported with the result
+    timings = {"load": time.time() - start, "vad": 0.0, "segments": 1}
+    # Scheduler handle: decode calls of requests with less audio left go first
+    job = engine.job(duration)
     
     # For long audio, use VAD segmentation to avoid hallucination
-    if duration > VAD_THRESHOLD_SECONDS:
+    if duration > settings["vad_threshold_seconds"]:
         logger.info(f"Long audio ({duration:.1f}s), using VAD segmentation...")
+        vad_start = time.time()
         vad = get_vad_model()
-        vad_res = vad.generate(input=audio_path)
+        with engine.device_slot(job):
+            vad_res = vad.generate(input=audio_input)
         segments = vad_res[0]["value"] if vad_res and "value" in vad_res[0] else []
+        timings["vad"] = time.time() - vad_start
+        timings["segments"] = max(len(segments), 1)
         
         if not segments:
             logger.warning("VAD returned no segments, falling back to direct recognition")
             if progress_callback:
                 progress_callback(0, 1, "")
-            res = m.generate(input=[audio_path], cache={}, batch_size=1, hotwords=hotwords or [], language=language, itn=itn)
+            res = run_generate(m, audio_input, hotwords, language, itn, cancel_token, segment_partial(partial_callback, 0),
+                               job, duration, adapter)
             text = res[0]["text"] if res else ""
             if progress_callback:
                 progress_callback(1, 1, text)
         else:
             # Load audio and process each segment
-            waveform, sr = torchaudio.load(audio_path)
-            if sr != 16000:
-                waveform = torchaudio.functional.resample(waveform, sr, 16000)
-                sr = 16000
-            waveform = waveform.mean(dim=0, keepdim=True) if waveform.shape[0] > 1 else waveform
+            if waveform is None:
+                waveform = load_waveform(audio)
+            sr = 16000
             
             texts = []
             total = len(segments)
+            if progress_callback:
+                progress_callback(0, total, "")
             for i, seg in enumerate(segments):
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
                 start_sample = int(seg[0] * sr / 1000)
                 end_sample = int(seg[1] * sr / 1000)
-                chunk = waveform[:, start_sample:end_sample]
+                # Segments are decoded from memory; no per-chunk temp files
+                chunk = waveform[0, start_sample:end_sample]
                 
-                chunk_path = f"/tmp/chunk_{uuid.uuid4().hex[:8]}.wav"
-                torchaudio.save(chunk_path, chunk, sr)
-                
-                try:
-                    res = m.generate(input=[chunk_path], cache={}, batch_size=1, hotwords=hotwords or [], language=language, itn=itn)
-                    if res and res[0]["text"]:
-                        texts.append(res[0]["text"])
-                finally:
-                    if os.path.exists(chunk_path):
-                        os.remove(chunk_path)
+                cache_key = None
+                if segment_cache.enabled:
+                    fp = fingerprint(chunk, sr)
+                    cache_key = segment_cache.key(fp, language, hotwords, itn, adapter) if fp is not None else None
+                cached = segment_cache.get(cache_key, chunk.numel() / sr) if cache_key else None
+                if cached is not None:
+                    seg_text = cached
+                    timings["cache_hits"] = timings.get("cache_hits", 0) + 1
+                    if partial_callback and seg_text:
+                        partial_callback(i, seg_text)
+                else:
+                    res = run_generate(m, chunk, hotwords, language, itn, cancel_token, segment_partial(partial_callback, i),
+                                       job, chunk.numel() / sr, adapter)
+                    seg_text = res[0]["text"] if res else ""
+                    if cache_key:
+                        segment_cache.put(cache_key, seg_text)
+                if seg_text:
+                    texts.append(seg_text)
                 
                 if progress_callback:
                     progress_callback(i + 1, total, "".join(texts))
@@ -166,24 +503,76 @@ def transcribe_with_progress(
     else:
         if progress_callback:
             progress_callback(0, 1, "")
-        res = m.generate(input=[audio_path], cache={}, batch_size=1, hotwords=hotwords or [], language=language, itn=itn)
-        text = res[0]["text"] if res else ""
+        silent = False
+        if settings["silence_trim"]:
+            samples = waveform[0] if waveform is not None else load_waveform(audio)[0]
+            voiced = voiced_range(samples)
+            if voiced is None:
+                silent = True
+            else:
+                audio_input = samples[voiced[0]:voiced[1]]
+                timings["trimmed_seconds"] = (samples.numel() - audio_input.numel()) / 16000
+        if silent:
+            # Nothing to recognize; skipping the model also avoids hallucinated text
+            text = ""
+            timings["silent"] = True
+        else:
+            res = run_generate(m, audio_input, hotwords, language, itn, cancel_token, segment_partial(partial_callback, 0),
+                               job, duration, adapter)
+            text = res[0]["text"] if res else ""
         if progress_callback:
             progress_callback(1, 1, text)
     
     elapsed = time.time() - start
-    return {"text": text, "time": round(elapsed, 3), "duration": round(duration, 2)}
+    timings["asr"] = elapsed - timings["load"] - timings["vad"]
+    timings = {k: round(v, 3) if isinstance(v, float) else v for k, v in timings.items()}
+    return {"text": text, "time": round(elapsed, 3), "duration": round(duration, 2), "timings": timings}
 
-def transcribe(audio_path: str, language: str = "auto", hotwords: List[str] = None, itn: bool = True) -> dict:
+def transcribe(audio: Union[str, bytes], language: str = "auto", hotwords: List[str] = None, itn: bool = True,
+               cancel_token: Optional[CancelToken] = None, adapter: Optional[str] = None) -> dict:
     """Simple transcription without progress callback"""
-    return transcribe_with_progress(audio_path, language, hotwords, itn, None)
+    return transcribe_with_progress(audio, language, hotwords, itn, None, cancel_token, adapter=adapter)
+
+async def watch_disconnect(request: Request, cancel_token: CancelToken):
+    """Trigger cancel_token once the HTTP client goes away (request body must already be consumed)"""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            cancel_token.cancel("client disconnected")
+            return
+
+async def admit_request(frontend: str, audio_path: str) -> AdmissionTicket:
+    """Reserve admission budget for an uploaded file, or raise 400 (undecodable) / 429 with Retry-After"""
+    try:
+        # Probing decodes the header; keep it off the event loop
+        duration = await run_in_threadpool(admission_duration, audio_path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        return engine.admit(frontend, duration)
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected {frontend} request: {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def prune_tasks():
+    """Drop finished async tasks older than TASK_TTL_SECONDS"""
+    now = time.time()
+    for task_id in [k for k, t in tasks.items() if t.get("finished") and now - t["finished"] > TASK_TTL_SECONDS]:
+        tasks.pop(task_id, None)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Preload model on startup"""
+    """Preload model on startup, then warm up in the background"""
+    telemetry.start()
     get_model()
-    logger.info("Model preloaded and ready")
+    logger.info("Model preloaded")
+    if WARMUP_ENABLED:
+        # On the shared pool so requests arriving meanwhile queue behind it
+        engine.executor.submit(warmup)
+    else:
+        warmup_state["status"] = "skipped"
     yield
+    telemetry.stop()
 
 app = FastAPI(
     title="Fun-ASR API",
@@ -202,52 +591,225 @@ app.add_middleware(
 
 # ==================== REST API ====================
 
-@app.get("/health")
-async def health():
-    """Health check endpoint"""
-    gpu_info = {}
+@app.get("/v1/admission")
+async def admission_status():
+    """Engine state: queued audio-seconds per class/frontend, limits, rejections, throughput, worker pool"""
+    return engine.stats()
+
+@app.get("/v1/adapters")
+async def list_adapters():
+    """LoRA adapters available for the `adapter` request parameter"""
+    return {"adapters": sorted(lora_adapters()), "loaded": sorted(getattr(model.model, "lora_adapters", {})) if model else []}
+
+@app.get("/v1/settings")
+async def get_settings():
+    """Effective performance settings: value, source, bounds, reload_required and any pending value"""
+    return settings.snapshot()
+
+@app.patch("/admin/settings")
+async def update_settings(request: Request):
+    """
+    Change settings at runtime (JSON object of name -> value, all or nothing).
+    Requires "Authorization: Bearer $ADMIN_TOKEN"; disabled when ADMIN_TOKEN is unset.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API disabled (set ADMIN_TOKEN)")
+    if not hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {ADMIN_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
     try:
-        import subprocess
-        result = subprocess.run(
-            ['nvidia-smi', '--query-gpu=memory.used,memory.total', '--format=csv,noheader,nounits'],
-            capture_output=True, text=True
-        )
-        if result.returncode == 0:
-            used, total = result.stdout.strip().split(', ')
-            gpu_info = {"memory_used_mb": int(used), "memory_total_mb": int(total)}
-    except:
-        pass
+        changes = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON object")
+    if not isinstance(changes, dict) or not changes:
+        raise HTTPException(status_code=400, detail="Body must be a non-empty JSON object")
+    try:
+        result = settings.update(changes)
+    except SettingError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    response = {**result, "reload_required": sorted(result["pending_reload"])}
+    if not result["persisted"]:
+        response["warning"] = ("SETTINGS_FILE is not set: changes last until the process exits"
+                               + ("; pending_reload values will not persist to the restart that applies them"
+                                  if result["pending_reload"] else ""))
+    return response
+
+def health_status() -> dict:
+    """Model/GPU status shared by /health and the MCP tools (read from the telemetry buffer)"""
+    sample = telemetry.latest()
+    gpu_info = sample.get("gpu", {}).get("0", {})
+    ready = model is not None and warmup_state["status"] in ("ready", "failed", "skipped")
     return {
-        "status": "healthy",
+        "status": "healthy" if ready else "starting",
+        "ready": ready,
+        "warmup": warmup_state,
         "model_loaded": model is not None,
+        "model_path": model_path,
         "vad_loaded": vad_model is not None,
-        "gpu": gpu_info
+        "gpu": gpu_info,
+        "rss_mb": sample.get("rss_mb"),
+        "cpu_percent": sample.get("cpu_percent"),
+        "sampled_at": sample.get("timestamp"),
     }
 
+@app.get("/health")
+async def health():
+    """Health check endpoint (503 until the model is loaded and warmed up)"""
+    status = health_status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/metrics")
+async def metrics():
+    """Latest resource sample plus scheduler state"""
+    return {**telemetry.latest(), "admission": engine.admission.stats(), "segment_cache": segment_cache.stats(),
+            "ws_sessions": ws_sessions.stats()}
+
+@app.get("/metrics/history")
+async def metrics_history(seconds: Optional[float] = None):
+    """Buffered resource samples, oldest first (optionally only the last `seconds`)"""
+    return {"interval": telemetry.interval, "samples": telemetry.history(seconds)}
+
 @app.post("/v1/audio/transcriptions")
 async def transcribe_audio(
+    request: Request,
     file: UploadFile = File(...),
     language: str = Form("auto"),
     hotwords: str = Form(""),
     itn: bool = Form(True),
+    adapter: str = Form(""),
 ):
     """
     Transcribe audio file (OpenAI Whisper compatible endpoint)
     Supports long audio with automatic VAD segmentation.
     """
+    arrival = time.time()
+    adapter = check_adapter(adapter)
     with tempfile.NamedTemporaryFile(suffix=Path(file.filename).suffix, delete=False) as tmp:
         content = await file.read()
         tmp.write(content)
         tmp_path = tmp.name
     
     try:
-        hw_list = [w.strip() for w in hotwords.split(",") if w.strip()] if hotwords else []
-        # Run in thread pool to not block event loop
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(executor, transcribe, tmp_path, language, hw_list, itn)
+        ticket = await admit_request("rest", tmp_path)
+    except HTTPException:
+        os.unlink(tmp_path)
+        raise
+    
+    cancel_token = CancelToken()
+    hw_list = [w.strip() for w in hotwords.split(",") if w.strip()] if hotwords else []
+    try:
+        # Run on the engine's pool to not block event loop
+        future = engine.submit("rest", transcribe, tmp_path, language, hw_list, itn, cancel_token, adapter)
+    except Exception:
+        engine.release(ticket, False)
+        os.unlink(tmp_path)
+        raise
+    
+    def cleanup(f: Future):
+        # The job owns the temp file until it settles, even if this handler is cancelled first
+        engine.release(ticket, not f.cancelled() and f.exception() is None)
+        os.unlink(tmp_path)
+    
+    future.add_done_callback(cleanup)
+    watcher = asyncio.ensure_future(watch_disconnect(request, cancel_token))
+    result, status = None, "error"
+    try:
+        result = await asyncio.wrap_future(future)
+        status = "ok"
         return {"text": result["text"], "duration": result["time"], "audio_duration": result.get("duration", 0)}
+    except TranscriptionCancelled:
+        status = "cancelled"
+        logger.info("Client disconnected, transcription cancelled")
+        # Nonstandard "client closed request"; nobody is left to read it
+        return JSONResponse(status_code=499, content={"detail": "Client closed request"})
+    except asyncio.CancelledError:
+        status = "cancelled"
+        cancel_token.cancel("request cancelled")
+        raise
     finally:
+        watcher.cancel()
+        capture.record("rest", content, arrival, {"language": language, "hotwords": hw_list, "itn": itn, "adapter": adapter},
+                       status, time.time() - arrival, result, Path(file.filename).suffix)
+
+@app.post("/v1/audio/transcriptions/async")
+async def transcribe_audio_async(
+    file: UploadFile = File(...),
+    language: str = Form("auto"),
+    hotwords: str = Form(""),
+    itn: bool = Form(True),
+    adapter: str = Form(""),
+):
+    """
+    Submit a transcription job and return immediately with a task id.
+    Poll GET /v1/tasks/{task_id} for the result, DELETE it to cancel.
+    """
+    arrival = time.time()
+    adapter = check_adapter(adapter)
+    with tempfile.NamedTemporaryFile(suffix=Path(file.filename).suffix, delete=False) as tmp:
+        content = await file.read()
+        tmp.write(content)
+        tmp_path = tmp.name
+    
+    try:
+        ticket = await admit_request("rest", tmp_path)
+    except HTTPException:
         os.unlink(tmp_path)
+        raise
+    
+    prune_tasks()
+    hw_list = [w.strip() for w in hotwords.split(",") if w.strip()] if hotwords else []
+    task_id = uuid.uuid4().hex
+    task = {"status": "queued", "current": 0, "total": 0, "result": None, "error": None,
+            "created": time.time(), "finished": None, "cancel_token": CancelToken()}
+    tasks[task_id] = task
+    
+    def progress_cb(current, total, text):
+        task["current"] = current
+        task["total"] = total
+    
+    def run_task():
+        task["status"] = "running"
+        completed = False
+        result = None
+        try:
+            result = transcribe_with_progress(tmp_path, language, hw_list, itn, progress_cb, task["cancel_token"],
+                                              adapter=adapter)
+            task["result"] = {"text": result["text"], "duration": result["time"], "audio_duration": result.get("duration", 0)}
+            task["status"] = "completed"
+            completed = True
+        except TranscriptionCancelled:
+            task["status"] = "cancelled"
+        except Exception as e:
+            logger.error(f"Task {task_id} failed: {e}")
+            task["error"] = str(e)
+            task["status"] = "failed"
+        finally:
+            task["finished"] = time.time()
+            engine.release(ticket, completed)
+            os.unlink(tmp_path)
+            capture.record("rest", content, arrival, {"language": language, "hotwords": hw_list, "itn": itn, "adapter": adapter},
+                           "ok" if completed else task["status"], task["finished"] - arrival, result,
+                           Path(file.filename).suffix)
+    
+    engine.submit("rest", run_task)
+    return {"task_id": task_id, "status": task["status"]}
+
+@app.get("/v1/tasks/{task_id}")
+async def get_task(task_id: str):
+    """Get status, progress and result of an async transcription task"""
+    task = tasks.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return {"task_id": task_id, **{k: v for k, v in task.items() if k != "cancel_token"}}
+
+@app.delete("/v1/tasks/{task_id}")
+async def cancel_task(task_id: str):
+    """Cancel a queued or running async transcription task"""
+    task = tasks.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task["status"] in ("queued", "running"):
+        task["cancel_token"].cancel("cancelled by client")
+    return {"task_id": task_id, "status": task["status"], "cancel_requested": task["cancel_token"].cancelled}
 
 @app.post("/v1/audio/transcriptions/stream")
 async def transcribe_audio_stream(
@@ -255,229 +817,425 @@ async def transcribe_audio_stream(
     language: str = Form("auto"),
     hotwords: str = Form(""),
     itn: bool = Form(True),
+    adapter: str = Form(""),
 ):
     """
     Transcribe audio with Server-Sent Events for progress updates.
     Returns streaming response with progress and final result.
     """
+    arrival = time.time()
+    adapter = check_adapter(adapter)
     with tempfile.NamedTemporaryFile(suffix=Path(file.filename).suffix, delete=False) as tmp:
         content = await file.read()
         tmp.write(content)
         tmp_path = tmp.name
     
+    try:
+        ticket = await admit_request("sse", tmp_path)
+    except HTTPException:
+        os.unlink(tmp_path)
+        raise
+    
     hw_list = [w.strip() for w in hotwords.split(",") if w.strip()] if hotwords else []
     
-    def generate():
-        progress_data = {"current": 0, "total": 0, "text": ""}
-        
-        def progress_cb(current, total, text):
-            progress_data["current"] = current
-            progress_data["total"] = total
-            progress_data["text"] = text
-        
-        # Start transcription in background
-        result_holder = [None]
-        def run_transcribe():
-            result_holder[0] = transcribe_with_progress(tmp_path, language, hw_list, itn, progress_cb)
-        
-        thread = threading.Thread(target=run_transcribe)
-        thread.start()
-        
-        last_current = -1
-        while thread.is_alive():
-            if progress_data["current"] != last_current and progress_data["total"] > 0:
-                last_current = progress_data["current"]
-                yield f"data: {json.dumps({'type': 'progress', 'current': progress_data['current'], 'total': progress_data['total'], 'text': progress_data['text']})}\n\n"
-            time.sleep(0.1)
-        
-        thread.join()
-        os.unlink(tmp_path)
-        
-        if result_holder[0]:
-            yield f"data: {json.dumps({'type': 'complete', 'text': result_holder[0]['text'], 'duration': result_holder[0]['time']})}\n\n"
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    cancel_token = CancelToken()
+    
+    def progress_cb(current, total, text):
+        # Called from the worker thread; hand every update to the event loop
+        loop.call_soon_threadsafe(events.put_nowait, ("progress", (current, total, text)))
+    
+    def partial_cb(segment, text):
+        loop.call_soon_threadsafe(events.put_nowait, ("partial", (segment, text)))
+    
+    def run_transcribe():
+        completed = False
+        result, status = None, "error"
+        try:
+            result = transcribe_with_progress(tmp_path, language, hw_list, itn, progress_cb, cancel_token, partial_cb,
+                                              adapter)
+            completed = True
+            status = "ok"
+            loop.call_soon_threadsafe(events.put_nowait, ("complete", result))
+        except TranscriptionCancelled:
+            status = "cancelled"
+            logger.info("SSE client disconnected, transcription cancelled")
+        except Exception as e:
+            logger.error(f"Streaming transcription failed: {e}")
+            loop.call_soon_threadsafe(events.put_nowait, ("error", str(e)))
+        finally:
+            engine.release(ticket, completed)
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            capture.record("sse", content, arrival, {"language": language, "hotwords": hw_list, "itn": itn, "adapter": adapter},
+                           status, time.time() - arrival, result, Path(file.filename).suffix)
+    
+    # Run on the shared engine so SSE requests respect the worker limit
+    engine.submit("sse", run_transcribe)
+    
+    async def generate():
+        try:
+            while True:
+                kind, payload = await events.get()
+                if kind == "progress":
+                    current, total, text = payload
+                    if total > 0:
+                        yield f"data: {json.dumps({'type': 'progress', 'current': current, 'total': total, 'text': text})}\n\n"
+                elif kind == "partial":
+                    segment, text = payload
+                    yield f"data: {json.dumps({'type': 'partial', 'segment': segment, 'text': text})}\n\n"
+                elif kind == "complete":
+                    yield f"data: {json.dumps({'type': 'complete', 'text': payload['text'], 'duration': payload['time'], 'audio_duration': payload['duration']})}\n\n"
+                    break
+                else:
+                    yield f"data: {json.dumps({'type': 'error', 'message': payload})}\n\n"
+                    break
+        finally:
+            # Reached early only when the consumer went away; stop the worker too
+            cancel_token.cancel("client disconnected")
     
     return StreamingResponse(generate(), media_type="text/event-stream")
 
 # ==================== WebSocket Streaming ====================
 
+def pcm_to_wav(pcm: bytes, sample_rate: int = 16000) -> bytes:
+    """Wrap raw mono 16-bit little-endian PCM in a WAV container"""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(pcm[: len(pcm) - len(pcm) % 2])
+    return buf.getvalue()
+
+def expire_ws_session(session: WSSession):
+    """Nobody resumed within the TTL: stop the session's job, if any"""
+    if session.cancel_token is not None:
+        session.cancel_token.cancel("session expired")
+
+async def start_ws_job(session: WSSession):
+    """Admit and submit the session's audio; results are published to the session as they come"""
+    loop = asyncio.get_running_loop()
+    config = session.config
+    # Latency is measured from the end of the upload
+    arrival = time.time()
+    upload = ws_sessions.take_audio(session)
+    if config["format"] == "pcm_s16le":
+        upload = pcm_to_wav(upload, int(config["sample_rate"]))
+    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
+        tmp.write(upload)
+        tmp_path = tmp.name
+    
+    try:
+        ticket = engine.admit("ws", await run_in_threadpool(admission_duration, tmp_path))
+    except ValueError as e:
+        os.unlink(tmp_path)
+        session.state = "done"
+        session.publish({"type": "error", "code": 400, "message": str(e)})
+        return
+    except AdmissionRejected as e:
+        os.unlink(tmp_path)
+        session.state = "done"
+        session.publish({"type": "error", "code": 429, "message": str(e), "retry_after": e.retry_after})
+        return
+    
+    session.state = "transcribing"
+    session.cancel_token = CancelToken()
+    
+    def progress_cb(current, total, text):
+        loop.call_soon_threadsafe(session.publish, {
+            "type": "progress", 
+            "current": current, 
+            "total": total,
+            "text": text[:200] + "..." if len(text) > 200 else text
+        })
+    
+    def partial_cb(segment, text):
+        loop.call_soon_threadsafe(session.publish, {"type": "partial", "segment": segment, "text": text}, False)
+    
+    def finish(event: dict):
+        session.state = "done"
+        session.publish(event)
+        ws_sessions.schedule(session)
+    
+    def done(future: Future):
+        completed = not future.cancelled() and future.exception() is None
+        result, status = None, "error"
+        if completed:
+            result, status = future.result(), "ok"
+            event = {"type": "final", "text": result["text"], "time": result["time"]}
+        elif isinstance(future.exception(), TranscriptionCancelled):
+            status = "cancelled"
+            logger.info(f"WebSocket session {session.id} cancelled: {session.cancel_token.reason}")
+            event = {"type": "error", "message": f"cancelled: {session.cancel_token.reason}"}
+        else:
+            logger.error(f"WebSocket transcription failed: {future.exception()}")
+            event = {"type": "error", "message": str(future.exception())}
+        engine.release(ticket, completed)
+        os.unlink(tmp_path)
+        capture.record("ws", upload, arrival, {k: config[k] for k in ("language", "hotwords", "itn", "adapter")},
+                       status, time.time() - arrival, result)
+        loop.call_soon_threadsafe(finish, event)
+    
+    # Run with progress in thread, ahead of queued batch work
+    engine.submit(
+        "ws",
+        transcribe_with_progress, 
+        tmp_path, 
+        config["language"], 
+        config["hotwords"], 
+        config["itn"],
+        progress_cb,
+        session.cancel_token,
+        partial_cb,
+        config["adapter"],
+    ).add_done_callback(done)
+
+def parse_ws_message(text: str) -> Optional[dict]:
+    """A client text frame as a JSON object, or None when it is not one"""
+    try:
+        msg = json.loads(text)
+    except ValueError:
+        return None
+    return msg if isinstance(msg, dict) else None
+
+async def close_superseded(websocket: WebSocket):
+    """This connection's session was resumed by another one: tell the client and hang up"""
+    try:
+        await websocket.send_json({"type": "error", "code": 409, "message": "Session resumed by another connection"})
+        await websocket.close(code=4409)
+    except Exception:
+        pass
+
+async def forward_ws_events(websocket: WebSocket, session: WSSession, queue: asyncio.Queue) -> bool:
+    """
+    Send the session's events until its final/error event. Returns False when the
+    client went away (or another connection took the session over) first; the
+    session then keeps running until it is resumed or expires.
+    """
+    receiver = asyncio.ensure_future(websocket.receive())
+    try:
+        while True:
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+                message = receiver.result()
+                if message["type"] == "websocket.disconnect":
+                    return False
+                if "text" in message and (parse_ws_message(message["text"]) or {}).get("action") == "cancel":
+                    if session.cancel_token is not None:
+                        session.cancel_token.cancel("cancelled by client")
+                receiver = asyncio.ensure_future(websocket.receive())
+                continue
+            event = getter.result()
+            if event is None:
+                await close_superseded(websocket)
+                return False
+            await websocket.send_json(event)
+            if event["type"] in ("final", "error"):
+                return True
+    finally:
+        receiver.cancel()
+
 @app.websocket("/ws/transcribe")
 async def websocket_transcribe(websocket: WebSocket):
-    """WebSocket endpoint for streaming audio transcription with progress."""
+    """
+    WebSocket endpoint for streaming audio transcription with progress.
+    
+    Each connection belongs to a session (id in config_ack). After a dropped
+    connection, {"action": "resume", "session_id", "last_seq"} reattaches: the
+    upload continues from the returned offset and only events after last_seq
+    are sent again. Disconnecting no longer cancels the job;
+    {"action": "cancel"} does, and so does WS_SESSION_TTL_SECONDS without a resume.
+    """
     await websocket.accept()
-    audio_buffer = io.BytesIO()
-    config = {"language": "auto", "hotwords": [], "itn": True}
+    session: Optional[WSSession] = None
+    queue: Optional[asyncio.Queue] = None
+    
+    def open_session() -> tuple:
+        # format: "file" (any encoded audio, the default) or "pcm_s16le" (raw mono 16-bit
+        # little-endian frames at sample_rate, e.g. a live microphone)
+        created = ws_sessions.create({"language": "auto", "hotwords": [], "itn": True, "adapter": None,
+                                      "format": "file", "sample_rate": 16000})
+        created.on_expire = expire_ws_session
+        return created, created.attach()
     
     try:
         while True:
             data = await websocket.receive()
+            if data["type"] == "websocket.disconnect":
+                break
+            if session is not None and not session.owns(queue):
+                # Taken over by a resume on another connection: stop feeding the session
+                session = None
+                await close_superseded(websocket)
+                return
             
             if "text" in data:
-                msg = json.loads(data["text"])
-                if msg.get("action") == "end":
-                    if audio_buffer.tell() > 0:
-                        audio_buffer.seek(0)
-                        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-                            tmp.write(audio_buffer.read())
-                            tmp_path = tmp.name
-                        
-                        try:
-                            async def send_progress(current, total, text):
-                                await websocket.send_json({
-                                    "type": "progress", 
-                                    "current": current, 
-                                    "total": total,
-                                    "text": text[:200] + "..." if len(text) > 200 else text
-                                })
-                            
-                            # Run with progress in thread
-                            loop = asyncio.get_event_loop()
-                            result = await loop.run_in_executor(
-                                executor, 
-                                transcribe, 
-                                tmp_path, 
-                                config["language"], 
-                                config["hotwords"], 
-                                config["itn"]
-                            )
-                            await websocket.send_json({"type": "final", "text": result["text"], "time": result["time"]})
-                        finally:
-                            os.unlink(tmp_path)
+                msg = parse_ws_message(data["text"])
+                if msg is None:
+                    await websocket.send_json({"type": "error", "code": 400, "message": "Expected a JSON object"})
+                    continue
+                action = msg.get("action")
+                if action == "resume":
+                    try:
+                        last_seq = int(msg.get("last_seq", 0))
+                    except (TypeError, ValueError):
+                        await websocket.send_json({"type": "error", "code": 400, "message": "last_seq must be an integer"})
+                        continue
+                    resumed = ws_sessions.resume(msg.get("session_id"), last_seq)
+                    if resumed is None:
+                        await websocket.send_json({"type": "error", "code": 404, "message": "Unknown or expired session"})
+                        continue
+                    if session is not None:
+                        ws_sessions.release(session, queue)
+                    session, queue = resumed
+                    await websocket.send_json({"type": "resume_ack", "session_id": session.id, "offset": session.received,
+                                               "state": session.state, "seq": session.seq, "config": session.config})
+                    if session.state != "receiving":
+                        if await forward_ws_events(websocket, session, queue):
+                            break
+                        return
+                elif action == "end":
+                    if session is None:
+                        session, queue = open_session()
+                    if session.state == "receiving":
+                        if session.received == 0:
+                            break
+                        await start_ws_job(session)
+                    if not await forward_ws_events(websocket, session, queue):
+                        return
                     break
-                elif msg.get("action") == "config":
-                    config.update({k: v for k, v in msg.items() if k in ("language", "hotwords", "itn")})
-                    await websocket.send_json({"type": "config_ack", "config": config})
+                elif action == "config":
+                    if session is None:
+                        session, queue = open_session()
+                    if "adapter" in msg:
+                        try:
+                            msg["adapter"] = check_adapter(msg["adapter"])
+                        except HTTPException as e:
+                            await websocket.send_json({"type": "error", "code": 400, "message": e.detail})
+                            continue
+                    if msg.get("format", "file") not in ("file", "pcm_s16le"):
+                        await websocket.send_json({"type": "error", "code": 400, "message": f"Unsupported format: {msg['format']}"})
+                        continue
+                    if session.state == "receiving":
+                        session.config.update({k: v for k, v in msg.items()
+                                               if k in ("language", "hotwords", "itn", "adapter", "format", "sample_rate")})
+                    await websocket.send_json({"type": "config_ack", "config": session.config,
+                                               "session_id": session.id, "offset": session.received})
                     
             elif "bytes" in data:
-                audio_buffer.write(data["bytes"])
+                if session is None:
+                    session, queue = open_session()
+                if session.state != "receiving":
+                    continue
+                try:
+                    ws_sessions.append(session, data["bytes"])
+                except SessionBufferFull as e:
+                    await websocket.send_json({"type": "error", "code": 413, "message": str(e)})
+                    ws_sessions.discard(session)
+                    session = None
+                    break
                         
     except WebSocketDisconnect:
         logger.info("WebSocket disconnected")
+    except SessionLimitExceeded as e:
+        logger.warning(str(e))
+        try:
+            await websocket.send_json({"type": "error", "code": 503, "message": str(e)})
+        except Exception:
+            pass
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
         try:
             await websocket.send_json({"type": "error", "message": str(e)})
         except:
             pass
+    finally:
+        if session is not None:
+            ws_sessions.release(session, queue)
 
-# ==================== Gradio UI with Progress ====================
+# ==================== Web UI ====================
 
-LANGUAGES = {
-    "自动检测 / Auto": "auto",
-    "中文 / Chinese": "zh", 
-    "English": "en",
-    "日本語 / Japanese": "ja",
-}
+def ui_transcribe(audio_path: str, language: str, hotwords: List[str], itn: bool,
+                  progress_callback: Callable = None, partial_callback: Callable = None,
+                  adapter: Optional[str] = None) -> dict:
+    """Web UI runner: interactive admission + priority on the shared engine (raises AdmissionRejected)"""
+    arrival = time.time()
+    ticket = engine.admit("ui", admission_duration(audio_path))
+    completed = False
+    result = None
+    try:
+        # Interactive priority: runs ahead of queued REST batch work
+        result = engine.submit(
+            "ui", transcribe_with_progress, audio_path, language, hotwords, itn, progress_callback,
+            None, partial_callback, adapter,
+        ).result()
+        completed = True
+        return result
+    finally:
+        engine.release(ticket, completed)
+        capture.record("ui", audio_path, arrival, {"language": language, "hotwords": hotwords, "itn": itn, "adapter": adapter},
+                       "ok" if completed else "error", time.time() - arrival, result, Path(audio_path).suffix)
 
-def gradio_transcribe(audio, language, hotwords, itn, progress=gr.Progress()):
-    """Gradio interface function with progress bar"""
-    if audio is None:
-        return "请上传或录制音频 / Please upload or record audio", ""
+# UI_MODE: "mounted" serves the Gradio UI on "/" from this process,
+# "none" runs the API headless (Gradio is never imported); the UI can then run
+# as a separate process with `python ui.py`.
+UI_MODE = os.environ.get("UI_MODE", "mounted")
+
+if UI_MODE == "mounted":
+    import gradio as gr
+    from ui import build_demo
     
-    hw_list = [w.strip() for w in hotwords.split(",") if w.strip()] if hotwords else []
-    lang_code = LANGUAGES.get(language, "auto")
+    # Mount Gradio app
+    app = gr.mount_gradio_app(app, build_demo(ui_transcribe), path="/")
+else:
+    @app.get("/")
+    async def root():
+        """Headless mode: no UI on this process"""
+        return {"service": "Fun-ASR API", "ui": UI_MODE, "docs": "/docs"}
+
+# ==================== MCP ====================
+
+def mcp_transcribe(audio: Union[str, bytes], language: str, hotwords: List[str], itn: bool,
+                   progress_callback: Callable = None, adapter: Optional[str] = None,
+                   cancel_token: Optional[CancelToken] = None) -> Future:
+    """MCP runner: batch admission + the shared engine; returns the job's future (raises AdmissionRejected)"""
+    if adapter and adapter not in lora_adapters():
+        raise ValueError(f"Unknown adapter: {adapter} (available: {sorted(lora_adapters())})")
+    duration = admission_duration(io.BytesIO(audio) if isinstance(audio, bytes) else audio)
+    arrival = time.time()
+    ticket = engine.admit("mcp", duration)
+    future = engine.submit("mcp", transcribe_with_progress, audio, language, hotwords, itn, progress_callback,
+                           cancel_token, None, adapter)
     
-    # Get audio duration first
+    def finish(f: Future):
+        ok = not f.cancelled() and f.exception() is None
+        engine.release(ticket, ok)
+        if ok:
+            status = "ok"
+        elif f.cancelled() or isinstance(f.exception(), TranscriptionCancelled):
+            status = "cancelled"
+        else:
+            status = "error"
+        capture.record("mcp", audio, arrival, {"language": language, "hotwords": hotwords, "itn": itn, "adapter": adapter},
+                       status, time.time() - arrival, f.result() if ok else None,
+                       ".wav" if isinstance(audio, bytes) else Path(audio).suffix)
+    
+    future.add_done_callback(finish)
+    return future
+
+# ENABLE_MCP=1 serves the MCP tools over SSE on /mcp from this process, sharing
+# the loaded model, worker pool and admission budget with the HTTP API.
+if os.environ.get("ENABLE_MCP", "0") == "1":
     try:
-        info = torchaudio.info(audio)
-        audio_duration = info.num_frames / info.sample_rate
-    except:
-        audio_duration = 0
-    
-    # Progress tracking
-    progress_state = {"current": 0, "total": 1, "text": ""}
-    
-    def progress_callback(current, total, text):
-        progress_state["current"] = current
-        progress_state["total"] = total
-        progress_state["text"] = text
-        if total > 0:
-            progress(current / total, desc=f"处理中 {current}/{total} 段...")
-    
-    progress(0, desc="开始识别...")
-    result = transcribe_with_progress(audio, lang_code, hw_list, itn, progress_callback)
-    progress(1, desc="完成!")
-    
-    # Format timer
-    rtf = result['time'] / audio_duration if audio_duration > 0 else 0
-    if progress_state["total"] > 1:
-        timer_text = f"⏱️ 识别耗时: {result['time']:.2f}s | 音频时长: {audio_duration:.2f}s | RTF: {rtf:.2f}x | VAD分段: {progress_state['total']}段"
-    else:
-        timer_text = f"⏱️ 识别耗时: {result['time']:.2f}s | 音频时长: {audio_duration:.2f}s | RTF: {rtf:.2f}x"
-    
-    return result["text"], timer_text
-
-with gr.Blocks(title="Fun-ASR 语音识别") as demo:
-    gr.Markdown("""
-    <div style="text-align: center; margin-bottom: 1rem;">
-    <h1>🎙️ Fun-ASR 语音识别</h1>
-    <p>基于 Fun-ASR-Nano-2512 的端到端语音识别服务 | 支持超长音频自动分段</p>
-    </div>
-    """)
-    
-    with gr.Row():
-        with gr.Column(scale=1):
-            audio_input = gr.Audio(
-                label="🎤 上传或录制音频 (支持任意时长)",
-                type="filepath",
-                sources=["upload", "microphone"],
-            )
-            
-            with gr.Accordion("⚙️ 参数设置", open=True):
-                language = gr.Dropdown(
-                    choices=list(LANGUAGES.keys()),
-                    value="自动检测 / Auto",
-                    label="语言 / Language",
-                )
-                hotwords = gr.Textbox(
-                    label="热词 / Hotwords",
-                    placeholder="用逗号分隔，如：人工智能,机器学习",
-                    info="提高特定词汇的识别准确率",
-                )
-                itn = gr.Checkbox(
-                    value=True,
-                    label="文本规整 (ITN)",
-                    info="将数字、日期等转换为标准格式",
-                )
-            
-            submit_btn = gr.Button("🚀 开始识别", variant="primary", size="lg")
-        
-        with gr.Column(scale=1):
-            result_text = gr.Textbox(
-                label="📝 识别结果",
-                lines=12,
-                max_lines=20,
-            )
-            timer_display = gr.Markdown()
-    
-    submit_btn.click(
-        fn=gradio_transcribe,
-        inputs=[audio_input, language, hotwords, itn],
-        outputs=[result_text, timer_display],
-    )
-    
-    gr.Markdown("""
-    ---
-    ### 📡 API 使用
-    
-    **REST API (同步):**
-    ```bash
-    curl -X POST http://localhost:8189/v1/audio/transcriptions \\
-      -F "file=@audio.wav" -F "language=auto"
-    ```
-    
-    **REST API (流式进度):**
-    ```bash
-    curl -X POST http://localhost:8189/v1/audio/transcriptions/stream \\
-      -F "file=@long_audio.mp3" -F "language=zh"
-    ```
-    
-    **WebSocket:** `ws://localhost:8189/ws/transcribe`
-    
-    📖 [API 文档](/docs) | 💡 超过30秒的音频自动使用VAD分段处理
-    """)
-
-# Mount Gradio app
-app = gr.mount_gradio_app(app, demo, path="/")
+        import mcp_server
+    except ImportError as e:
+        raise RuntimeError(f"ENABLE_MCP=1 needs the MCP SDK (pip install mcp): {e}") from e
+    mcp_server.use_engine(mcp_transcribe, health_status, CancelToken)
+    app.mount("/mcp", mcp_server.mcp.sse_app())
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,330 @@
+"""
+Fun-ASR Offline Batch Transcription
+Sharded, resumable bulk transcription without the HTTP service.
+
+Results are written in the same layout as FunASRNano's DatadirWriter
+(``<output_dir>/1best_recog/text`` and ``text_tn``, one "key text" line each).
+Every worker appends to its own shard under ``<output_dir>/shards/`` as keys
+complete; on restart, keys already present in any shard are skipped.
+Inputs that fail to load or decode are recorded in the shard's
+``errors.jsonl`` (merged into ``<output_dir>/errors.jsonl``) and count as done
+on restart unless ``--retry-failed`` is given.
+
+Usage:
+    python batch_transcribe.py /data/wavs -o /data/out --devices cuda:0,cuda:1
+    python batch_transcribe.py manifest.jsonl -o /data/out --batch-size 16
+
+Manifest lines: {"key": "utt1", "source": "/path/to/utt1.wav"}
+("audio", "wav" or "path" are accepted instead of "source"). An optional
+"adapter" field selects one of the LoRA adapters given with --adapters;
+segments are batched per adapter.
+"""
+import os
+import sys
+import json
+import time
+import glob
+import argparse
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from engine import parse_frontend_map
+
+logger = logging.getLogger("batch_transcribe")
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".m4a", ".ogg", ".opus", ".aac", ".wma")
+
+def load_items(input_path: str) -> list:
+    """(key, audio_path, adapter) tuples from a directory tree or a JSONL manifest"""
+    items = []
+    if os.path.isdir(input_path):
+        for root, _, files in os.walk(input_path):
+            for name in sorted(files):
+                if name.lower().endswith(AUDIO_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    key = os.path.splitext(os.path.relpath(path, input_path))[0]
+                    items.append((key.replace(os.sep, "__").replace(" ", "_"), path, None))
+    else:
+        with open(input_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                path = entry.get("source") or entry.get("audio") or entry.get("wav") or entry.get("path")
+                key = entry.get("key") or os.path.splitext(os.path.basename(path))[0]
+                items.append((str(key).replace(" ", "_"), path, entry.get("adapter") or None))
+    return sorted(items, key=lambda item: item[:2])
+
+def failed_entries(output_dir: str) -> dict:
+    """key -> last error record from the shards' errors.jsonl"""
+    failed = {}
+    for path in sorted(glob.glob(os.path.join(output_dir, "shards", "*", "errors.jsonl"))):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    failed[entry["key"]] = entry
+    return failed
+
+def completed_keys(output_dir: str, include_failed: bool = True) -> set:
+    """Keys already written (or, with include_failed, recorded as failed) by any shard of a previous run"""
+    done = set()
+    for path in glob.glob(os.path.join(output_dir, "shards", "*", "1best_recog", "text")):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    done.add(line.split(maxsplit=1)[0])
+    if include_failed:
+        done.update(failed_entries(output_dir))
+    return done
+
+class ShardWriter:
+    """Append-mode writer with the DatadirWriter text / text_tn layout, plus errors.jsonl"""
+    def __init__(self, shard_dir: str):
+        out = os.path.join(shard_dir, "1best_recog")
+        os.makedirs(out, exist_ok=True)
+        self.files = {name: open(os.path.join(out, name), "a", encoding="utf-8") for name in ("text", "text_tn")}
+        self.files["errors"] = open(os.path.join(shard_dir, "errors.jsonl"), "a", encoding="utf-8")
+
+    def write(self, key: str, text: str, text_tn: str):
+        # text_tn first: a key only counts as done once "text" has it
+        for name, value in (("text_tn", text_tn), ("text", text)):
+            self.files[name].write(f"{key} {value.replace(chr(10), ' ')}\n")
+            self.files[name].flush()
+
+    def write_error(self, key: str, source: str, stage: str, error: Exception):
+        entry = {"key": key, "source": source, "stage": stage, "error": f"{type(error).__name__}: {error}"}
+        self.files["errors"].write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.files["errors"].flush()
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+def run_shard(shard_id: int, device: str, items: list, args: dict) -> dict:
+    """Worker: transcribe one shard on one device, writing results as keys complete"""
+    logging.basicConfig(level=logging.INFO, format=f"[shard {shard_id}] %(message)s")
+    import torch
+    import torchaudio
+    from funasr import AutoModel
+    from model import FunASRNano
+
+    model, kwargs = FunASRNano.from_pretrained(model=args["model_dir"], device=device, disable_update=True)
+    if args["adapters"]:
+        model.load_adapters(args["adapters"])
+    model.eval()
+    kwargs.update({"hotwords": args["hotwords"], "language": args["language"], "itn": args["itn"],
+                   "greedy_decoder": args["greedy_decoder"]})
+    vad = None
+
+    writer = ShardWriter(os.path.join(args["output_dir"], "shards", f"{shard_id:03d}"))
+    batch_size = args["batch_size"]
+    pending = []   # (key, segment_index, waveform, adapter)
+    results = {}   # key -> {segment_index: text}
+    remaining = {} # key -> segments not yet decoded
+    sources = {}   # key -> audio path, for error records
+    failed = set()
+    stats = {"files": 0, "segments": 0, "audio_seconds": 0.0, "failed": 0, "batch_fallbacks": 0}
+    start = time.time()
+
+    def fail(key, stage, error):
+        """Record a failed input once; its other segments are dropped"""
+        if key in failed:
+            return
+        logger.error(f"{key}: {stage} failed: {error}")
+        failed.add(key)
+        results.pop(key, None)
+        remaining.pop(key, None)
+        writer.write_error(key, sources.get(key, ""), stage, error)
+        stats["failed"] += 1
+
+    def generate(batch, adapter):
+        with torch.no_grad():
+            res, _ = model.inference(
+                data_in=[w for _, _, w, _ in batch],
+                key=[f"{k}#{i}" for k, i, _, _ in batch],
+                **{**kwargs, "batch_size": len(batch), "adapter": adapter},
+            )
+        return res
+
+    def decode(batch, adapter):
+        batch = [p for p in batch if p[0] not in failed]
+        if not batch:
+            return
+        try:
+            decoded = [(batch, generate(batch, adapter))]
+        except Exception as e:
+            if len(batch) == 1:
+                fail(batch[0][0], "decode", e)
+                return
+            # One bad segment (or an OOM on a long batch) must not take the others down
+            logger.warning(f"batch of {len(batch)} segments failed ({e}); decoding them one by one")
+            stats["batch_fallbacks"] += 1
+            decoded = []
+            for p in batch:
+                try:
+                    decoded.append(([p], generate([p], adapter)))
+                except Exception as item_error:
+                    fail(p[0], "decode", item_error)
+        for decoded_batch, res in decoded:
+            for (key, index, _, _), r in zip(decoded_batch, res):
+                if key in failed:
+                    continue
+                results[key][index] = (r["text"], r["text_tn"])
+                remaining[key] -= 1
+                stats["segments"] += 1
+                if remaining[key] == 0:
+                    ordered = [results[key][i] for i in sorted(results.pop(key))]
+                    writer.write(key, "".join(t for t, _ in ordered), "".join(t for _, t in ordered))
+                    del remaining[key]
+                    stats["files"] += 1
+
+    def flush(force=False):
+        # One adapter per generate() call; within an adapter, sort by length so
+        # each batch pads as little as possible
+        groups = {}
+        for p in pending:
+            groups.setdefault(p[3], []).append(p)
+        pending.clear()
+        for adapter, group in groups.items():
+            group.sort(key=lambda p: p[2].shape[0])
+            while len(group) >= batch_size or (force and group):
+                batch = group[:batch_size]
+                del group[:batch_size]
+                decode(batch, adapter)
+            pending.extend(group)
+
+    for key, path, adapter in items:
+        sources[key] = path
+        try:
+            waveform, sr = torchaudio.load(path)
+            if sr != 16000:
+                waveform = torchaudio.functional.resample(waveform, sr, 16000)
+            waveform = waveform.mean(dim=0)
+            duration = waveform.shape[0] / 16000
+            if duration > args["vad_threshold"]:
+                if vad is None:
+                    vad = AutoModel(model="fsmn-vad", device=device, disable_update=True)
+                vad_res = vad.generate(input=path)
+                bounds = vad_res[0]["value"] if vad_res and "value" in vad_res[0] else []
+                segments = [waveform[int(b * 16):int(e * 16)] for b, e in bounds] or [waveform]
+            else:
+                segments = [waveform]
+        except Exception as e:
+            fail(key, "load", e)
+            continue
+        stats["audio_seconds"] += duration
+
+        results[key] = {}
+        remaining[key] = len(segments)
+        pending.extend((key, i, seg, adapter) for i, seg in enumerate(segments))
+        if len(pending) >= batch_size * 4:
+            flush()
+    flush(force=True)
+    writer.close()
+
+    stats["elapsed"] = time.time() - start
+    stats["rtf"] = stats["elapsed"] / stats["audio_seconds"] if stats["audio_seconds"] else 0
+    logger.info(f"done: {stats['files']} files, {stats['segments']} segments, {stats['failed']} failed, "
+                f"RTF {stats['rtf']:.3f}")
+    return stats
+
+def merge_shards(output_dir: str):
+    """Concatenate shard outputs into <output_dir>/1best_recog/{text,text_tn}"""
+    out = os.path.join(output_dir, "1best_recog")
+    os.makedirs(out, exist_ok=True)
+    for name in ("text", "text_tn"):
+        lines = {}
+        for path in sorted(glob.glob(os.path.join(output_dir, "shards", "*", "1best_recog", name))):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        lines[line.split(maxsplit=1)[0]] = line
+        with open(os.path.join(out, name), "w", encoding="utf-8") as f:
+            for key in sorted(lines):
+                f.write(lines[key])
+    # Failures that a later run (--retry-failed) has not since transcribed
+    done = completed_keys(output_dir, include_failed=False)
+    failed = {key: entry for key, entry in failed_entries(output_dir).items() if key not in done}
+    with open(os.path.join(output_dir, "errors.jsonl"), "w", encoding="utf-8") as f:
+        for key in sorted(failed):
+            f.write(json.dumps(failed[key], ensure_ascii=False) + "\n")
+    return len(failed)
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline batch transcription with Fun-ASR-Nano")
+    parser.add_argument("input", help="Audio directory or JSONL manifest")
+    parser.add_argument("-o", "--output-dir", required=True)
+    parser.add_argument("--model-dir", default=os.environ.get("MODEL_DIR", "FunAudioLLM/Fun-ASR-Nano-2512"))
+    parser.add_argument("--devices", default="cuda:0", help="Comma-separated devices, e.g. cuda:0,cuda:1 or cpu")
+    parser.add_argument("--workers-per-device", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=8, help="Segments decoded per generate() call")
+    parser.add_argument("--language", default="auto", choices=["auto", "zh", "en", "ja"])
+    parser.add_argument("--hotwords", default="", help="Comma-separated hotwords")
+    parser.add_argument("--no-itn", action="store_true", help="Disable inverse text normalization")
+    parser.add_argument("--greedy-decoder", action="store_true",
+                        help="Use the static-cache greedy decode loop instead of generate()")
+    parser.add_argument("--adapters", default=os.environ.get("LORA_ADAPTERS", ""),
+                        help="LoRA adapters on the shared base model, e.g. medical=/lora/medical,finance=/lora/finance")
+    parser.add_argument("--vad-threshold", type=float, default=30, help="Segment files longer than this (seconds) with VAD")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Retry inputs recorded in errors.jsonl by a previous run instead of skipping them")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    items = load_items(args.input)
+    adapters = parse_frontend_map(args.adapters, str)
+    unknown = {item[2] for item in items if item[2] and item[2] not in adapters}
+    if unknown:
+        parser.error(f"manifest references unknown adapters: {sorted(unknown)}")
+    done = completed_keys(args.output_dir, include_failed=not args.retry_failed)
+    todo = [item for item in items if item[0] not in done]
+    logger.info(f"{len(items)} inputs, {len(done)} already done, {len(todo)} to transcribe")
+
+    devices = [d.strip() for d in args.devices.split(",") if d.strip()]
+    workers = [d for d in devices for _ in range(args.workers_per_device)]
+    # Shard ids continue after those of previous runs so no shard file is shared
+    existing = glob.glob(os.path.join(args.output_dir, "shards", "*"))
+    base_id = max([int(os.path.basename(p)) for p in existing if os.path.basename(p).isdigit()], default=-1) + 1
+    shards = [todo[i::len(workers)] for i in range(len(workers))]
+    worker_args = {
+        "model_dir": args.model_dir,
+        "output_dir": args.output_dir,
+        "batch_size": args.batch_size,
+        "language": args.language,
+        "hotwords": [w.strip() for w in args.hotwords.split(",") if w.strip()],
+        "itn": not args.no_itn,
+        "vad_threshold": args.vad_threshold,
+        "greedy_decoder": args.greedy_decoder,
+        "adapters": adapters,
+    }
+
+    start = time.time()
+    jobs = [(base_id + i, device, shard, worker_args) for i, (device, shard) in enumerate(zip(workers, shards)) if shard]
+    if len(jobs) == 1:
+        all_stats = [run_shard(*jobs[0])]
+    elif jobs:
+        import multiprocessing as mp
+        with mp.get_context("spawn").Pool(len(jobs)) as pool:
+            all_stats = pool.starmap(run_shard, jobs)
+    else:
+        all_stats = []
+    elapsed = time.time() - start
+    total_failed = merge_shards(args.output_dir)
+
+    audio_seconds = sum(s["audio_seconds"] for s in all_stats)
+    files = sum(s["files"] for s in all_stats)
+    failed = sum(s["failed"] for s in all_stats)
+    fallbacks = sum(s["batch_fallbacks"] for s in all_stats)
+    rtf = elapsed / audio_seconds if audio_seconds else 0
+    print(f"Transcribed {files} files ({audio_seconds / 3600:.2f} h audio, {failed} failed, "
+          f"{fallbacks} batches retried per segment) in {elapsed:.1f}s with {len(jobs)} workers | "
+          f"aggregate RTF {rtf:.4f} ({1 / rtf if rtf else 0:.1f}x realtime)")
+    print(f"Results: {os.path.join(args.output_dir, '1best_recog')}")
+    if total_failed:
+        print(f"Failures: {total_failed} inputs in {os.path.join(args.output_dir, 'errors.jsonl')} "
+              f"(skipped on restart; rerun with --retry-failed to try them again)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Fun-ASR traffic capture
+Opt-in JSONL log of request metadata for replaying realistic load (see replay.py)
+
+Each line describes one request:
+    {"arrival": 1718000000.123, "frontend": "rest", "audio_sha256": "...",
+     "audio_bytes": 123456, "audio_format": ".wav", "duration": 12.3,
+     "params": {"language": "auto", "hotwords": [...], "itn": true},
+     "status": "ok", "latency": 1.84,
+     "timings": {"queue": 0.4, "load": 0.01, "vad": 0.0, "asr": 1.43, "segments": 1},
+     "audio_file": "ab12....wav"}   # only when the audio was sampled
+
+Hashing, audio sampling and writing happen on a background thread, so
+recording a request only costs a queue put.
+"""
+import os
+import json
+import queue
+import random
+import shutil
+import hashlib
+import logging
+import threading
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+class TrafficCapture:
+    """
+    Append request records to a JSONL file.
+
+    Args:
+        path: Capture log; None or "" disables capture (record() is a no-op)
+        audio_sample_rate: Fraction of requests whose audio is also saved (0..1)
+        audio_dir: Where sampled audio is saved (default: "<path>.audio/")
+        max_queue: Records buffered for the writer; further records are dropped
+    """
+    def __init__(self, path: Optional[str], audio_sample_rate: float = 0.0,
+                 audio_dir: Optional[str] = None, max_queue: int = 1000):
+        self.path = path or None
+        self.audio_sample_rate = audio_sample_rate
+        self.audio_dir = audio_dir or (f"{path}.audio" if path else None)
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        if self.enabled:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            if self.audio_sample_rate > 0:
+                os.makedirs(self.audio_dir, exist_ok=True)
+            self._thread = threading.Thread(target=self._writer, name="traffic-capture", daemon=True)
+            self._thread.start()
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def record(self, frontend: str, audio: Union[str, bytes], arrival: float, params: dict,
+               status: str, latency: float, result: Optional[dict] = None, audio_format: str = ".wav"):
+        """
+        Queue one request record.
+
+        Args:
+            audio: Encoded audio bytes, or a path that stays valid after the call
+            arrival: time.time() when the request arrived
+            latency: Seconds from arrival to completion
+            result: transcribe_with_progress() result (duration and stage timings)
+        """
+        if not self.enabled:
+            return
+        entry = {
+            "arrival": round(arrival, 3),
+            "frontend": frontend,
+            "audio_format": audio_format,
+            "params": params,
+            "status": status,
+            "latency": round(latency, 3),
+        }
+        if result is not None:
+            entry["duration"] = result.get("duration")
+            timings = dict(result.get("timings", {}))
+            timings["queue"] = round(max(0.0, latency - result.get("time", 0)), 3)
+            entry["timings"] = timings
+        try:
+            self._queue.put_nowait((entry, audio))
+        except queue.Full:
+            self.dropped += 1
+
+    def _writer(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                entry, audio = self._queue.get()
+                try:
+                    self._complete(entry, audio)
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                    f.flush()
+                except Exception as e:
+                    logger.warning(f"Traffic capture failed: {e}")
+
+    def _complete(self, entry: dict, audio: Union[str, bytes]):
+        """Hash the audio and save a copy when sampled (writer thread)"""
+        if isinstance(audio, bytes):
+            digest = hashlib.sha256(audio).hexdigest()
+            size = len(audio)
+        else:
+            h = hashlib.sha256()
+            with open(audio, "rb") as src:
+                for block in iter(lambda: src.read(1 << 20), b""):
+                    h.update(block)
+            digest = h.hexdigest()
+            size = os.path.getsize(audio)
+        entry["audio_sha256"] = digest
+        entry["audio_bytes"] = size
+        if self.audio_sample_rate > 0 and random.random() < self.audio_sample_rate:
+            name = digest + entry["audio_format"]
+            target = os.path.join(self.audio_dir, name)
+            if not os.path.exists(target):
+                if isinstance(audio, bytes):
+                    with open(target, "wb") as dst:
+                        dst.write(audio)
+                else:
+                    shutil.copyfile(audio, target)
+            entry["audio_file"] = name
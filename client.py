@@ -0,0 +1,314 @@
+"""
+Fun-ASR Python Client
+Async client for the Fun-ASR service: pooled keep-alive HTTP, bounded-concurrency
+bulk submission that honours 429 Retry-After, SSE progress iteration and
+real-time PCM streaming over the WebSocket endpoint.
+
+Usage:
+    async with FunASRClient("http://localhost:8189") as client:
+        result = await client.transcribe("meeting.wav", language="zh")
+        results = await client.transcribe_many(paths, concurrency=8)
+        async for event in client.stream("long.mp3"):
+            print(event)
+        async for event in client.stream_pcm(pcm_bytes, sample_rate=16000):
+            print(event)
+
+    python client.py a.wav b.wav --url http://localhost:8189 --concurrency 8
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterable, AsyncIterator, Iterable, List, Optional, Union
+
+import httpx
+
+AudioSource = Union[str, bytes, os.PathLike]
+
+# Retried with backoff: admission rejections and a service that is still warming up
+RETRY_STATUS = (429, 503)
+
+
+class FunASRError(Exception):
+    """Request failed (HTTP error status, error event or exhausted retries)"""
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After header as seconds (delta-seconds or HTTP date form)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _read_audio(audio: AudioSource, filename: Optional[str]) -> tuple:
+    """(filename, bytes); read once so retries resend the same payload"""
+    if isinstance(audio, bytes):
+        return filename or "audio.wav", audio
+    with open(audio, "rb") as f:
+        return filename or os.path.basename(os.fspath(audio)), f.read()
+
+
+def _form(language: str, hotwords: Optional[List[str]], itn: bool, adapter: Optional[str]) -> dict:
+    return {"language": language, "hotwords": ",".join(hotwords or []), "itn": str(itn).lower(),
+            "adapter": adapter or ""}
+
+
+class FunASRClient:
+    """
+    Async client sharing one pooled HTTP/1.1 keep-alive connection pool across calls.
+
+    Args:
+        base_url: Service root, e.g. http://localhost:8189
+        max_connections: Pool size; also the useful upper bound for bulk concurrency
+        timeout: Per-request timeout in seconds (None = no limit; long audio can take minutes)
+        max_retries: Retries for 429/503 responses and connection errors
+        backoff: Base delay (seconds) when the server sends no Retry-After
+        max_backoff: Cap on a single wait
+        headers: Extra headers sent with every request
+        transport: Custom httpx transport, e.g. httpx.MockTransport for a local stub
+    """
+    def __init__(self, base_url: str = "http://localhost:8189", max_connections: int = 16,
+                 timeout: Optional[float] = None, max_retries: int = 5, backoff: float = 1.0,
+                 max_backoff: float = 60.0, headers: Optional[dict] = None,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.headers = dict(headers or {})
+        self.retries = 0
+        self._http = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            headers=self.headers,
+            transport=transport,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    def _delay(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            # Spread clients that were told the same Retry-After
+            return min(self.max_backoff, retry_after + random.uniform(0, min(1.0, retry_after * 0.1 + 0.1)))
+        return min(self.max_backoff, self.backoff * 2 ** attempt * random.uniform(0.5, 1.0))
+
+    async def _post_with_retry(self, path: str, filename: str, content: bytes, data: dict,
+                               stream: bool = False) -> httpx.Response:
+        """POST a multipart upload, retrying 429/503 (honouring Retry-After) and connection errors"""
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                request = self._http.build_request("POST", path, data=data, files={"file": (filename, content)})
+                response = await self._http.send(request, stream=stream)
+            except httpx.TransportError as e:
+                if attempt == self.max_retries:
+                    raise FunASRError(f"{path}: {e}") from e
+            else:
+                if response.status_code not in RETRY_STATUS:
+                    if response.status_code >= 400:
+                        await response.aread()
+                        await response.aclose()
+                        raise FunASRError(f"{path}: HTTP {response.status_code}: {response.text}",
+                                          response.status_code)
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                await response.aclose()
+                if attempt == self.max_retries:
+                    raise FunASRError(f"{path}: HTTP {response.status_code} after {attempt + 1} attempts",
+                                      response.status_code, retry_after)
+            self.retries += 1
+            await asyncio.sleep(self._delay(attempt, retry_after))
+
+    async def transcribe(self, audio: AudioSource, language: str = "auto", hotwords: Optional[List[str]] = None,
+                         itn: bool = True, adapter: Optional[str] = None, filename: Optional[str] = None) -> dict:
+        """Sync transcription endpoint: {"text", "duration", "audio_duration"}"""
+        filename, content = _read_audio(audio, filename)
+        response = await self._post_with_retry("/v1/audio/transcriptions", filename, content,
+                                               _form(language, hotwords, itn, adapter))
+        return response.json()
+
+    async def transcribe_many(self, audios: Iterable[AudioSource], concurrency: int = 8,
+                              return_exceptions: bool = True, **params) -> list:
+        """
+        Transcribe many inputs with at most `concurrency` requests in flight.
+
+        Results come back in input order; a failed input yields its exception
+        (or raises when return_exceptions=False). Files are read only when their
+        request starts, so large batches do not sit in memory.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run(audio):
+            async with semaphore:
+                return await self.transcribe(audio, **params)
+
+        return await asyncio.gather(*(run(audio) for audio in audios), return_exceptions=return_exceptions)
+
+    async def stream(self, audio: AudioSource, language: str = "auto", hotwords: Optional[List[str]] = None,
+                     itn: bool = True, adapter: Optional[str] = None,
+                     filename: Optional[str] = None) -> AsyncIterator[dict]:
+        """
+        SSE endpoint as an async iterator of events ("progress", "partial", then
+        "complete"); an "error" event raises FunASRError. Leaving the loop early
+        closes the stream, which cancels the job server-side.
+        """
+        filename, content = _read_audio(audio, filename)
+        response = await self._post_with_retry("/v1/audio/transcriptions/stream", filename, content,
+                                               _form(language, hotwords, itn, adapter), stream=True)
+        try:
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[6:])
+                if event["type"] == "error":
+                    raise FunASRError(event.get("message", "transcription failed"))
+                yield event
+                if event["type"] == "complete":
+                    return
+        finally:
+            await response.aclose()
+
+    @staticmethod
+    async def _pcm_frames(pcm: Union[bytes, AsyncIterable[bytes]], sample_rate: int, frame_ms: int,
+                          realtime: bool) -> AsyncIterator[bytes]:
+        if not isinstance(pcm, (bytes, bytearray)):
+            async for frame in pcm:
+                yield frame
+            return
+        frame_bytes = max(2, sample_rate * 2 * frame_ms // 1000)
+        start = time.monotonic()
+        for i, offset in enumerate(range(0, len(pcm), frame_bytes)):
+            if realtime:
+                delay = start + i * frame_ms / 1000 - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield bytes(pcm[offset:offset + frame_bytes])
+
+    async def stream_pcm(self, pcm: Union[bytes, AsyncIterable[bytes]], sample_rate: int = 16000,
+                         frame_ms: int = 100, realtime: bool = True, language: str = "auto",
+                         hotwords: Optional[List[str]] = None, itn: bool = True,
+                         adapter: Optional[str] = None, max_reconnects: int = 3) -> AsyncIterator[dict]:
+        """
+        Stream 16-bit little-endian mono PCM over /ws/transcribe and iterate the
+        server's events ("progress", "partial", then "final").
+
+        pcm is either a complete buffer, sent in frame_ms frames (paced at real
+        time when realtime=True), or an async iterable of frames such as a
+        microphone reader, sent as they arrive.
+
+        A dropped connection is resumed (up to max_reconnects times): the upload
+        continues from the byte offset the server holds and only events after
+        the last one received are delivered again.
+        """
+        import websockets
+        url = "ws" + self.base_url[len("http"):] + "/ws/transcribe"
+        frames = self._pcm_frames(pcm, sample_rate, frame_ms, realtime)
+        sent = bytearray()   # kept to resend whatever the server did not receive
+        uploaded = False
+        session_id, last_seq, reconnects = None, 0, 0
+        while True:
+            try:
+                async with websockets.connect(url, max_size=None, additional_headers=self.headers or None) as ws:
+                    if session_id is None:
+                        await ws.send(json.dumps({"action": "config", "format": "pcm_s16le", "sample_rate": sample_rate,
+                                                  "language": language, "hotwords": hotwords or [], "itn": itn,
+                                                  "adapter": adapter}))
+                    else:
+                        await ws.send(json.dumps({"action": "resume", "session_id": session_id, "last_seq": last_seq}))
+                    ack = json.loads(await ws.recv())
+                    if ack.get("type") == "error":
+                        raise FunASRError(ack.get("message", "session rejected"), ack.get("code"))
+                    session_id = ack["session_id"]
+
+                    if ack.get("state", "receiving") == "receiving":
+                        if ack.get("offset", 0) < len(sent):
+                            await ws.send(bytes(sent[ack["offset"]:]))
+                        if not uploaded:
+                            async for frame in frames:
+                                sent += frame
+                                await ws.send(frame)
+                            uploaded = True
+                        await ws.send(json.dumps({"action": "end"}))
+
+                    async for message in ws:
+                        event = json.loads(message)
+                        if event.get("type") == "error":
+                            raise FunASRError(event.get("message", "transcription failed"), event.get("code"),
+                                              event.get("retry_after"))
+                        last_seq = event.get("seq", last_seq)
+                        yield event
+                        if event.get("type") == "final":
+                            return
+                # Closed by the server before the final result: resume like a drop
+            except (websockets.ConnectionClosed, OSError) as e:
+                if session_id is None:
+                    raise FunASRError(f"/ws/transcribe: {e}") from e
+            if reconnects >= max_reconnects:
+                raise FunASRError(f"/ws/transcribe: connection lost {reconnects + 1} times, giving up")
+            await asyncio.sleep(self._delay(reconnects, None))
+            reconnects += 1
+            self.retries += 1
+
+    async def health(self) -> dict:
+        response = await self._http.get("/health")
+        return response.json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe files with a running Fun-ASR service")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--url", default=os.environ.get("FUNASR_API_URL", "http://localhost:8189"))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--language", default="auto", choices=["auto", "zh", "en", "ja"])
+    parser.add_argument("--hotwords", default="", help="Comma-separated hotwords")
+    parser.add_argument("--adapter", default=None, help="LoRA adapter name")
+    parser.add_argument("--no-itn", action="store_true")
+    args = parser.parse_args()
+
+    async def run():
+        async with FunASRClient(args.url, max_connections=args.concurrency) as client:
+            start = time.time()
+            results = await client.transcribe_many(
+                args.files, concurrency=args.concurrency, language=args.language,
+                hotwords=[w.strip() for w in args.hotwords.split(",") if w.strip()],
+                itn=not args.no_itn, adapter=args.adapter,
+            )
+            failed = 0
+            for path, result in zip(args.files, results):
+                if isinstance(result, Exception):
+                    failed += 1
+                    print(json.dumps({"file": path, "error": str(result)}, ensure_ascii=False))
+                else:
+                    print(json.dumps({"file": path, **result}, ensure_ascii=False))
+            print(f"{len(results) - failed}/{len(results)} transcribed in {time.time() - start:.1f}s "
+                  f"({client.retries} retries)", file=sys.stderr)
+            return failed
+
+    sys.exit(1 if asyncio.run(run()) else 0)
+
+
+if __name__ == "__main__":
+    main()
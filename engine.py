@@ -0,0 +1,452 @@
+"""
+Fun-ASR inference scheduling
+Priority-ordered worker pool, audio-seconds based admission control and the
+engine that every frontend (REST, SSE, WebSocket, Web UI, MCP) submits through
+"""
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from typing import Optional
+
+# Priority classes (lower value runs first)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+PRIORITY_CLASSES = {"interactive": PRIORITY_INTERACTIVE, "batch": PRIORITY_BATCH}
+
+
+class PriorityExecutor(Executor):
+    """
+    Thread pool whose queue is ordered by priority class, FIFO within a class.
+
+    submit() uses the batch class so the pool stays a drop-in for loop.run_in_executor;
+    interactive work goes through submit_with_priority(). Jobs may carry a group
+    (e.g. the submitting frontend) whose concurrently running jobs are capped by
+    group_limits; a capped group's jobs wait in the queue without holding a worker.
+    The pool can be resized at runtime (set_max_workers); surplus workers exit
+    once their current job finishes.
+    """
+    def __init__(self, max_workers: int = 2, thread_name_prefix: str = "asr-worker",
+                 group_limits: Optional[dict] = None):
+        self.max_workers = max_workers
+        self.group_limits = dict(group_limits or {})
+        self._thread_name_prefix = thread_name_prefix
+        self._thread_ids = itertools.count()
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._shutdown = False
+        self._busy = 0
+        self._live = 0
+        self._running = {}
+        self._threads = []
+        with self._cond:
+            self._spawn(max_workers)
+
+    def _spawn(self, n: int):
+        # Called with self._cond held
+        for _ in range(n):
+            t = threading.Thread(target=self._worker, name=f"{self._thread_name_prefix}-{next(self._thread_ids)}",
+                                 daemon=True)
+            self._live += 1
+            t.start()
+            self._threads.append(t)
+
+    def set_max_workers(self, max_workers: int):
+        """Grow the pool now, or shrink it as workers become idle"""
+        with self._cond:
+            self.max_workers = max_workers
+            self._threads = [t for t in self._threads if t.is_alive()]
+            if self._live < max_workers:
+                self._spawn(max_workers - self._live)
+            self._cond.notify_all()
+
+    def set_group_limits(self, group_limits: dict):
+        with self._cond:
+            self.group_limits = dict(group_limits)
+            self._cond.notify_all()
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        return self.submit_with_priority(PRIORITY_BATCH, fn, *args, **kwargs)
+
+    def submit_with_priority(self, priority: int, fn, /, *args, **kwargs) -> Future:
+        return self.submit_to_group(None, priority, fn, *args, **kwargs)
+
+    def submit_to_group(self, group: Optional[str], priority: int, fn, /, *args, **kwargs) -> Future:
+        future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            heapq.heappush(self._queue, (priority, next(self._seq), group, future, fn, args, kwargs))
+            self._cond.notify()
+        return future
+
+    def _has_slot(self, group: Optional[str]) -> bool:
+        return group is None or self._running.get(group, 0) < self.group_limits.get(group, self.max_workers)
+
+    def _pop_runnable(self):
+        """Pop the first queued job, in priority order, whose group is under its limit"""
+        skipped = []
+        item = None
+        while self._queue:
+            candidate = heapq.heappop(self._queue)
+            if self._has_slot(candidate[2]):
+                item = candidate
+                break
+            skipped.append(candidate)
+        for candidate in skipped:
+            heapq.heappush(self._queue, candidate)
+        return item
+
+    def _retire(self) -> bool:
+        # Called with self._cond held: a surplus worker leaves the pool
+        if self._live > self.max_workers:
+            self._live -= 1
+            return True
+        return False
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                if self._retire():
+                    return
+                item = self._pop_runnable()
+                while item is None and not (self._shutdown and not self._queue):
+                    self._cond.wait()
+                    if self._retire():
+                        return
+                    item = self._pop_runnable()
+                if item is None:
+                    self._live -= 1
+                    return
+                _, _, group, future, fn, args, kwargs = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self._busy += 1
+                if group is not None:
+                    self._running[group] = self._running.get(group, 0) + 1
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._busy -= 1
+                    if group is not None:
+                        self._running[group] -= 1
+                        # A job of this group may have been waiting for the slot
+                        self._cond.notify_all()
+
+    def stats(self) -> dict:
+        """Snapshot of pool occupancy"""
+        with self._cond:
+            queued_by_group = {}
+            for item in self._queue:
+                if item[2] is not None:
+                    queued_by_group[item[2]] = queued_by_group.get(item[2], 0) + 1
+            return {
+                "max_workers": self.max_workers,
+                "workers": self._live,
+                "busy": self._busy,
+                "queued": len(self._queue),
+                "running_by_group": {k: v for k, v in self._running.items() if v},
+                "queued_by_group": queued_by_group,
+                "group_limits": dict(self.group_limits),
+            }
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        with self._cond:
+            self._shutdown = True
+            if cancel_futures:
+                for item in self._queue:
+                    item[3].cancel()
+                self._queue.clear()
+            self._cond.notify_all()
+        if wait:
+            for t in list(self._threads):
+                t.join()
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request would exceed its class's (or its frontend's share of the) queued audio budget"""
+    def __init__(self, priority_class: str, retry_after: int):
+        super().__init__(f"{priority_class} queue is full, retry after {retry_after}s")
+        self.priority_class = priority_class
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """Audio-seconds reserved by one admitted request"""
+    def __init__(self, priority_class: str, audio_seconds: float, frontend: Optional[str] = None):
+        self.priority_class = priority_class
+        self.audio_seconds = audio_seconds
+        self.frontend = frontend
+        self.released = False
+
+
+class AdmissionController:
+    """
+    Caps the audio-seconds admitted but not yet finished, per priority class.
+
+    Retry-After for rejected requests is derived from the observed completion
+    throughput (audio-seconds finished per wall-clock second).
+
+    shares optionally caps a frontend at a fraction of its class's limit, so one
+    frontend cannot fill the whole class budget on its own.
+    """
+    def __init__(self, limits: dict, default_throughput: float = 10.0, window_seconds: float = 60.0,
+                 shares: Optional[dict] = None):
+        self.limits = dict(limits)
+        self.shares = dict(shares or {})
+        self.default_throughput = default_throughput
+        self.window_seconds = window_seconds
+        self._queued = {name: 0.0 for name in self.limits}
+        self._queued_by_frontend = {}
+        self._completions = deque()
+        self._rejected = {name: 0 for name in self.limits}
+        self._lock = threading.Lock()
+
+    def _throughput(self, now: float) -> float:
+        while self._completions and now - self._completions[0][0] > self.window_seconds:
+            self._completions.popleft()
+        if not self._completions:
+            return self.default_throughput
+        span = max(now - self._completions[0][0], 1.0)
+        return max(sum(s for _, s in self._completions) / span, 1e-3)
+
+    def admit(self, priority_class: str, audio_seconds: float, frontend: Optional[str] = None) -> AdmissionTicket:
+        """Reserve budget for a request or raise AdmissionRejected"""
+        with self._lock:
+            queued = self._queued[priority_class]
+            limit = self.limits[priority_class]
+            excess = 0.0
+            # A single oversized request is still admitted when its class is idle
+            if queued > 0 and queued + audio_seconds > limit:
+                excess = queued + audio_seconds - limit
+            if frontend in self.shares:
+                frontend_queued = self._queued_by_frontend.get(frontend, 0.0)
+                frontend_limit = self.shares[frontend] * limit
+                if frontend_queued > 0 and frontend_queued + audio_seconds > frontend_limit:
+                    excess = max(excess, frontend_queued + audio_seconds - frontend_limit)
+            if excess > 0:
+                self._rejected[priority_class] += 1
+                retry_after = max(1, math.ceil(excess / self._throughput(time.time())))
+                raise AdmissionRejected(priority_class, retry_after)
+            self._queued[priority_class] = queued + audio_seconds
+            if frontend is not None:
+                self._queued_by_frontend[frontend] = self._queued_by_frontend.get(frontend, 0.0) + audio_seconds
+            return AdmissionTicket(priority_class, audio_seconds, frontend)
+
+    def set_limit(self, priority_class: str, limit: float):
+        with self._lock:
+            self.limits[priority_class] = limit
+
+    def set_shares(self, shares: dict):
+        with self._lock:
+            self.shares = dict(shares)
+
+    def release(self, ticket: Optional[AdmissionTicket], completed: bool = True):
+        """Return a ticket's budget; completed work feeds the throughput estimate"""
+        if ticket is None or ticket.released:
+            return
+        with self._lock:
+            ticket.released = True
+            self._queued[ticket.priority_class] = max(0.0, self._queued[ticket.priority_class] - ticket.audio_seconds)
+            if ticket.frontend is not None:
+                self._queued_by_frontend[ticket.frontend] = max(
+                    0.0, self._queued_by_frontend.get(ticket.frontend, 0.0) - ticket.audio_seconds)
+            if completed and ticket.audio_seconds > 0:
+                self._completions.append((time.time(), ticket.audio_seconds))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queued_audio_seconds": {k: round(v, 2) for k, v in self._queued.items()},
+                "queued_audio_seconds_by_frontend": {k: round(v, 2) for k, v in self._queued_by_frontend.items()},
+                "limits": dict(self.limits),
+                "shares": dict(self.shares),
+                "rejected": dict(self._rejected),
+                "throughput_audio_seconds_per_second": round(self._throughput(time.time()), 2),
+            }
+
+
+class ScheduledJob:
+    """Decode work still pending for one request, as seen by the SegmentScheduler"""
+    def __init__(self, priority: int, remaining_seconds: float):
+        self.priority = priority
+        self.remaining_seconds = remaining_seconds
+
+
+class SegmentScheduler:
+    """
+    Grants device slots one decode call (one VAD segment) at a time.
+
+    Worker threads outnumber device slots, so many requests are in flight and
+    only the decode calls compete here. Among waiting calls the lowest
+    (priority class, remaining audio-seconds of the request - aging_rate x wait)
+    wins: short requests overtake long ones (shortest remaining work first).
+    Since all waiters age at the same rate, the key reduces to
+    remaining + aging_rate x enqueue time and can be fixed at enqueue.
+
+    Aging alone lets a long request wait remaining / aging_rate seconds per
+    segment under sustained short traffic (about 24 minutes for a 2 h file at
+    the default rate). So every fair_every-th grant is a fair turn: it goes to
+    the longest-waiting call of the top priority class instead. A call then
+    waits at most (calls ahead of it in arrival order + 1) x (fair_every + 1)
+    grants, whatever the length of its file; fair_every=0 disables fair turns.
+    """
+    def __init__(self, slots: int = 2, aging_rate: float = 5.0, fair_every: int = 4):
+        self.slots = slots
+        self.aging_rate = aging_rate
+        self.fair_every = fair_every
+        self._free = slots
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._granted = 0
+        self._fair_granted = 0
+        self._since_fair = 0
+
+    def _fair_turn(self) -> bool:
+        return 0 < self.fair_every <= self._since_fair
+
+    def _next(self) -> tuple:
+        """Key of the waiting call the next free slot goes to"""
+        if self._fair_turn():
+            top = self._waiting[0][0]
+            return min((key for key in self._waiting if key[0] == top), key=lambda key: key[2])
+        return self._waiting[0]
+
+    @contextmanager
+    def slot(self, job: ScheduledJob, seconds: float = 0.0):
+        """Hold a device slot for one decode call of `seconds` audio"""
+        with self._cond:
+            key = (job.priority, job.remaining_seconds + self.aging_rate * time.monotonic(), next(self._seq))
+            heapq.heappush(self._waiting, key)
+            while not (self._free > 0 and self._next() == key):
+                self._cond.wait()
+            if self._fair_turn():
+                self._since_fair = 0
+                self._fair_granted += 1
+            else:
+                self._since_fair += 1
+            if self._waiting[0] == key:
+                heapq.heappop(self._waiting)
+            else:
+                self._waiting.remove(key)
+                heapq.heapify(self._waiting)
+            self._free -= 1
+            self._granted += 1
+            # The next waiter may be runnable too if more slots are free
+            self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._free += 1
+                job.remaining_seconds = max(0.0, job.remaining_seconds - seconds)
+                self._cond.notify_all()
+
+    def set_slots(self, slots: int):
+        """Change the number of device slots; busy slots above the new count drain naturally"""
+        with self._cond:
+            self._free += slots - self.slots
+            self.slots = slots
+            self._cond.notify_all()
+
+    def set_aging_rate(self, aging_rate: float):
+        # Applies to calls enqueued from now on
+        with self._cond:
+            self.aging_rate = aging_rate
+
+    def set_fair_every(self, fair_every: int):
+        with self._cond:
+            self.fair_every = fair_every
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"slots": self.slots, "busy": self.slots - self._free, "waiting": len(self._waiting),
+                    "granted": self._granted, "fair_granted": self._fair_granted,
+                    "aging_rate": self.aging_rate, "fair_every": self.fair_every}
+
+
+class InferenceEngine:
+    """
+    Single entry point for inference from every frontend.
+
+    Each frontend maps to a priority class (queue order and admission budget),
+    may cap its concurrently running jobs (max_concurrent) and may be limited to
+    a share of its class's audio-seconds budget (shares).
+
+    Requests run on worker threads; their decode calls then take turns on the
+    device through the SegmentScheduler (see job() / device_slot()), so long
+    files are interleaved with short requests segment by segment.
+
+    Args:
+        max_workers: Worker threads, i.e. requests in flight
+        class_limits: priority class -> max queued audio-seconds
+        frontends: frontend name -> priority class
+        max_concurrent: frontend name -> max running jobs (unset = max_workers)
+        shares: frontend name -> fraction of its class limit
+        device_slots: Concurrent decode calls on the device
+        aging_rate: Scheduler credit (audio-seconds) per second a decode call waits
+        fair_every: Every fair_every-th device grant goes to the longest waiter (0 = never)
+    """
+    def __init__(self, max_workers: int, class_limits: dict, frontends: dict,
+                 max_concurrent: Optional[dict] = None, shares: Optional[dict] = None,
+                 default_throughput: float = 10.0, device_slots: int = 2, aging_rate: float = 5.0,
+                 fair_every: int = 4):
+        self.frontends = dict(frontends)
+        self.executor = PriorityExecutor(max_workers=max_workers, group_limits=max_concurrent)
+        self.admission = AdmissionController(class_limits, default_throughput, shares=shares)
+        self.scheduler = SegmentScheduler(device_slots, aging_rate, fair_every)
+        self._local = threading.local()
+
+    def admit(self, frontend: str, audio_seconds: float) -> AdmissionTicket:
+        """Reserve admission budget for a frontend's request or raise AdmissionRejected"""
+        return self.admission.admit(self.frontends[frontend], audio_seconds, frontend)
+
+    def release(self, ticket: Optional[AdmissionTicket], completed: bool = True):
+        self.admission.release(ticket, completed)
+
+    def submit(self, frontend: str, fn, /, *args, **kwargs) -> Future:
+        """Queue a job at the frontend's priority, subject to its concurrency cap"""
+        priority = PRIORITY_CLASSES[self.frontends[frontend]]
+        return self.executor.submit_to_group(frontend, priority, self._run_as, priority, fn, *args, **kwargs)
+
+    def _run_as(self, priority: int, fn, /, *args, **kwargs):
+        # Lets job() pick up the submitting frontend's priority on this worker thread
+        self._local.priority = priority
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._local.priority = None
+
+    def job(self, total_seconds: float) -> ScheduledJob:
+        """Scheduler handle for the request running on this thread (batch priority outside submit())"""
+        priority = getattr(self._local, "priority", None)
+        return ScheduledJob(PRIORITY_BATCH if priority is None else priority, total_seconds)
+
+    def device_slot(self, job: ScheduledJob, seconds: float = 0.0):
+        """Context manager holding a device slot for one decode call"""
+        return self.scheduler.slot(job, seconds)
+
+    def stats(self) -> dict:
+        return {**self.admission.stats(), "executor": self.executor.stats(), "scheduler": self.scheduler.stats(),
+                "frontends": dict(self.frontends)}
+
+
+def parse_frontend_map(value: str, cast=float) -> dict:
+    """Parse "ui=1,mcp=0.5" style settings"""
+    result = {}
+    for part in value.split(","):
+        if "=" in part:
+            name, raw = part.split("=", 1)
+            result[name.strip()] = cast(raw.strip())
+    return result
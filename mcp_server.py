@@ -1,24 +1,112 @@
 """
 Fun-ASR MCP Server
 Model Context Protocol interface for speech recognition
+
+Backends (MCP_BACKEND):
+    local   load a private model copy in this process (standalone use)
+    http    forward to a running Fun-ASR service at FUNASR_API_URL
+    engine  run on the service's own engine; set by app.py when ENABLE_MCP=1
+            mounts this server on /mcp
+
+Tools are async: inference runs on a worker pool (or the remote service), so
+status tools stay responsive and several transcriptions can run at once.
+Per-segment progress is sent as MCP progress notifications.
 """
+import io
 import os
 import sys
+import asyncio
 import tempfile
 import base64
-from typing import Optional, List
+from concurrent.futures import Future
+from typing import Optional, List, Callable
 
 # Add current directory to path for model.py
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import FastMCP, Context
+
+from engine import PriorityExecutor, AdmissionRejected, parse_frontend_map
+from telemetry import TelemetrySampler
 
 mcp = FastMCP("fun-asr")
 
-# Global model instance (persistent in memory)
+# Global model instance (persistent in memory, local backend only)
 _model = None
 _model_path = None
 
+# Local backend worker pool (created on first use)
+MCP_WORKERS = int(os.environ.get("MCP_WORKERS", 2))
+_executor = None
+
+# Local backend resource telemetry (started on first use)
+_telemetry = None
+
+API_URL = os.environ.get("FUNASR_API_URL", "").rstrip("/")
+BACKEND = os.environ.get("MCP_BACKEND", "http" if API_URL else "local")
+
+# Engine backend hooks, installed by use_engine()
+_engine_transcribe = None
+_engine_status = None
+_engine_cancel_token = None
+
+def use_engine(transcribe_fn: Callable, status_fn: Callable, cancel_token_factory: Callable):
+    """
+    Route tools to the hosting service's engine instead of a private model.
+    
+    Args:
+        transcribe_fn: Function(audio, language, hotwords, itn, progress_callback, adapter, cancel_token)
+            -> Future resolving to {"text", "time", ...}; audio is a file path or encoded
+            audio bytes, progress_callback(current, total, text) is called from the worker
+            thread. Called on a thread of the loop's default executor, since it probes
+            the audio for admission. May raise AdmissionRejected.
+        status_fn: Function() -> {"model_loaded", "model_path", "gpu", ...}
+        cancel_token_factory: Function() -> token with cancel(reason); a tool call the
+            client cancels trips its token so the engine stops the job
+    """
+    global BACKEND, _engine_transcribe, _engine_status, _engine_cancel_token
+    BACKEND = "engine"
+    _engine_transcribe = transcribe_fn
+    _engine_status = status_fn
+    _engine_cancel_token = cancel_token_factory
+
+async def _http_transcribe(filename: str, fileobj, language: str, hotwords: List[str], itn: bool,
+                           progress_callback: Callable, adapter: Optional[str] = None) -> dict:
+    """Forward one file to the service's SSE endpoint, relaying its progress events"""
+    import json
+    import httpx
+    data = {"language": language, "hotwords": ",".join(hotwords), "itn": str(itn).lower(), "adapter": adapter or ""}
+    async with httpx.AsyncClient(timeout=None) as client:
+        async with client.stream("POST", f"{API_URL}/v1/audio/transcriptions/stream",
+                                 data=data, files={"file": (filename, fileobj)}) as response:
+            if response.status_code == 429:
+                raise AdmissionRejected("batch", int(response.headers.get("Retry-After", 1)))
+            if response.status_code == 400:
+                await response.aread()
+                return {"error": response.json().get("detail", response.text)}
+            if response.status_code != 200:
+                await response.aread()
+                return {"error": f"HTTP {response.status_code}: {response.text}"}
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[6:])
+                if event["type"] == "progress":
+                    progress_callback(event["current"], event["total"], event["text"])
+                elif event["type"] == "complete":
+                    return {"text": event["text"], "time": event["duration"], "audio_duration": event.get("audio_duration", 0)}
+                elif event["type"] == "error":
+                    return {"error": event["message"]}
+    return {"error": "Connection closed before completion"}
+
+async def _service_status() -> dict:
+    """/health of the hosting (engine) or remote (http) service"""
+    if BACKEND == "engine":
+        return _engine_status()
+    import httpx
+    async with httpx.AsyncClient(timeout=10) as client:
+        return (await client.get(f"{API_URL}/health")).json()
+
 def get_model():
     """Get or load the ASR model (singleton, always in GPU memory)"""
     global _model, _model_path
@@ -34,15 +122,119 @@ def get_model():
             device=device,
         )
         _model_path = _model.model_path
+        adapters = parse_frontend_map(os.environ.get("LORA_ADAPTERS", ""), str)
+        if adapters:
+            _model.model.load_adapters(adapters)
         print(f"[MCP] Model loaded successfully", file=sys.stderr)
     return _model
 
+def get_executor() -> PriorityExecutor:
+    """Local backend worker pool (singleton)"""
+    global _executor
+    if _executor is None:
+        _executor = PriorityExecutor(max_workers=MCP_WORKERS, thread_name_prefix="mcp-worker")
+    return _executor
+
+def get_telemetry() -> TelemetrySampler:
+    """Local backend telemetry sampler (singleton)"""
+    global _telemetry
+    if _telemetry is None:
+        _telemetry = TelemetrySampler(
+            interval=float(os.environ.get("TELEMETRY_INTERVAL_SECONDS", 5)),
+            sources={"executor": lambda: get_executor().stats()},
+        )
+        _telemetry.sample()
+        _telemetry.start()
+    return _telemetry
+
+def _local_transcribe(audio_path: str, language: str, hotwords: List[str], itn: bool,
+                      progress_callback: Callable, adapter: Optional[str] = None) -> dict:
+    """Local backend job (runs on a pool thread)"""
+    import time
+    model = get_model()
+    start = time.time()
+    progress_callback(0, 1, "")
+    # Private kwargs copy: AutoModel merges call options into its shared dict
+    res = model.generate(
+        input=[audio_path],
+        cache={},
+        batch_size=1,
+        kwargs=dict(model.kwargs),
+        hotwords=hotwords,
+        language=language,
+        itn=itn,
+        adapter=adapter,
+    )
+    elapsed = time.time() - start
+    text = res[0]["text"] if res else ""
+    progress_callback(1, 1, text)
+    return {"text": text, "time": round(elapsed, 3)}
+
+async def _run_transcription(audio, filename: str, language: str, hotwords: List[str], itn: bool,
+                             ctx: Optional[Context], adapter: Optional[str] = None) -> dict:
+    """
+    Run one transcription on the active backend without blocking the event loop.
+    
+    Args:
+        audio: File path, or encoded audio bytes
+        filename: Name used for uploads / temp files (its extension selects the decoder)
+        ctx: MCP request context; progress is reported through it when given
+        adapter: LoRA adapter name; None uses the base model
+    """
+    loop = asyncio.get_running_loop()
+    
+    def progress_cb(current, total, text):
+        # May run on a worker thread; hop to the event loop to notify the client
+        if ctx is not None and total > 0:
+            loop.call_soon_threadsafe(
+                lambda: asyncio.ensure_future(ctx.report_progress(current, total))
+            )
+    
+    try:
+        if BACKEND == "http":
+            if isinstance(audio, bytes):
+                return await _http_transcribe(filename, io.BytesIO(audio), language, hotwords, itn, progress_cb, adapter)
+            with open(audio, "rb") as f:
+                return await _http_transcribe(filename, f, language, hotwords, itn, progress_cb, adapter)
+        
+        if BACKEND == "engine":
+            cancel_token = _engine_cancel_token()
+            # Admission probes the audio (a decode); keep it off the loop the HTTP frontends share
+            try:
+                future: Future = await loop.run_in_executor(
+                    None, _engine_transcribe, audio, language, hotwords, itn, progress_cb, adapter, cancel_token)
+                return await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                # The MCP request was cancelled: stop the job between segments / decode steps
+                # (a job submitted after this point sees the token already set)
+                cancel_token.cancel("cancelled by MCP client")
+                raise
+        
+        # Local backend: funasr decodes from a path, so bytes go through a temp file
+        tmp_path = None
+        if isinstance(audio, bytes):
+            with tempfile.NamedTemporaryFile(suffix=os.path.splitext(filename)[1], delete=False) as tmp:
+                tmp.write(audio)
+                tmp_path = audio = tmp.name
+        try:
+            future = get_executor().submit(_local_transcribe, audio, language, hotwords, itn, progress_cb, adapter)
+            return await asyncio.wrap_future(future)
+        finally:
+            if tmp_path:
+                os.unlink(tmp_path)
+    except AdmissionRejected as e:
+        return {"error": f"Server busy, retry after {e.retry_after}s", "retry_after": e.retry_after}
+    except Exception as e:
+        return {"error": str(e)}
+
 @mcp.tool()
-def transcribe(
+async def transcribe(
     audio_path: str,
     language: str = "auto",
     hotwords: Optional[List[str]] = None,
     itn: bool = True,
+    adapter: Optional[str] = None,
+    ctx: Context = None,
 ) -> dict:
     """
     Transcribe audio file to text.
@@ -52,40 +244,25 @@ def transcribe(
         language: Language code - "auto" (detect), "zh" (Chinese), "en" (English), "ja" (Japanese)
         hotwords: List of hotwords to improve recognition accuracy
         itn: Inverse text normalization (convert numbers to digits, etc.)
+        adapter: Domain LoRA adapter name (e.g. "medical"); omit for the base model
     
     Returns:
         Dictionary with "text" (transcription) and "time" (processing time in seconds)
     """
-    import time
-    
     if not os.path.exists(audio_path):
         return {"error": f"File not found: {audio_path}"}
-    
-    model = get_model()
-    start = time.time()
-    
-    try:
-        res = model.generate(
-            input=[audio_path],
-            cache={},
-            batch_size=1,
-            hotwords=hotwords or [],
-            language=language,
-            itn=itn,
-        )
-        elapsed = time.time() - start
-        text = res[0]["text"] if res else ""
-        return {"text": text, "time": round(elapsed, 3)}
-    except Exception as e:
-        return {"error": str(e)}
+    return await _run_transcription(audio_path, os.path.basename(audio_path), language, hotwords or [], itn, ctx,
+                                   adapter)
 
 @mcp.tool()
-def transcribe_base64(
+async def transcribe_base64(
     audio_base64: str,
     audio_format: str = "wav",
     language: str = "auto",
     hotwords: Optional[List[str]] = None,
     itn: bool = True,
+    adapter: Optional[str] = None,
+    ctx: Context = None,
 ) -> dict:
     """
     Transcribe base64-encoded audio to text.
@@ -96,6 +273,7 @@ def transcribe_base64(
         language: Language code - "auto", "zh", "en", "ja"
         hotwords: List of hotwords to improve recognition accuracy
         itn: Inverse text normalization
+        adapter: Domain LoRA adapter name; omit for the base model
     
     Returns:
         Dictionary with "text" (transcription) and "time" (processing time)
@@ -104,58 +282,52 @@ def transcribe_base64(
         audio_data = base64.b64decode(audio_base64)
     except Exception as e:
         return {"error": f"Invalid base64 data: {e}"}
-    
-    with tempfile.NamedTemporaryFile(suffix=f".{audio_format}", delete=False) as tmp:
-        tmp.write(audio_data)
-        tmp_path = tmp.name
-    
-    try:
-        return transcribe(tmp_path, language, hotwords, itn)
-    finally:
-        os.unlink(tmp_path)
+    return await _run_transcription(audio_data, f"audio.{audio_format}", language, hotwords or [], itn, ctx,
+                                   adapter)
 
 @mcp.tool()
-def get_gpu_status() -> dict:
+async def get_gpu_status() -> dict:
     """
     Get current GPU memory status.
     
     Returns:
         Dictionary with GPU memory information
     """
+    if BACKEND in ("engine", "http"):
+        try:
+            status = await _service_status()
+            return {**status.get("gpu", {}), "model_loaded": status.get("model_loaded", False)}
+        except Exception as e:
+            return {"error": str(e)}
+    
     gpu_id = os.environ.get('NVIDIA_VISIBLE_DEVICES', '0').split(',')[0]
-    try:
-        import subprocess
-        result = subprocess.run(
-            ['nvidia-smi', '--query-gpu=name,memory.used,memory.total,utilization.gpu', 
-             '--format=csv,noheader,nounits', f'--id={gpu_id}'],
-            capture_output=True, text=True
-        )
-        if result.returncode == 0:
-            parts = [p.strip() for p in result.stdout.strip().split(',')]
-            return {
-                "gpu_id": gpu_id,
-                "name": parts[0],
-                "memory_used_mb": int(parts[1]),
-                "memory_total_mb": int(parts[2]),
-                "utilization_percent": int(parts[3]),
-                "model_loaded": _model is not None,
-            }
-    except Exception as e:
-        return {"error": str(e)}
-    return {"error": "Failed to get GPU status"}
+    devices = get_telemetry().latest().get("gpu", {})
+    # Container runtimes renumber the single visible GPU as device 0
+    gpu = devices.get(gpu_id, devices.get("0"))
+    if gpu is None:
+        return {"error": "No GPU available", "model_loaded": _model is not None}
+    return {"gpu_id": gpu_id, **gpu, "model_loaded": _model is not None}
 
 @mcp.tool()
-def get_model_info() -> dict:
+async def get_model_info() -> dict:
     """
     Get information about the loaded ASR model.
     
     Returns:
         Dictionary with model information
     """
+    model_loaded, model_path = _model is not None, _model_path
+    if BACKEND in ("engine", "http"):
+        try:
+            status = await _service_status()
+            model_loaded, model_path = status.get("model_loaded", False), status.get("model_path")
+        except Exception:
+            model_loaded = False
     return {
-        "model_loaded": _model is not None,
+        "backend": BACKEND,
+        "model_loaded": model_loaded,
         "model_dir": os.environ.get("MODEL_DIR", "FunAudioLLM/Fun-ASR-Nano-2512"),
-        "model_path": _model_path,
+        "model_path": model_path,
         "supported_languages": ["auto", "zh", "en", "ja"],
         "features": [
             "Chinese (7 dialects, 26 regional accents)",
@@ -169,7 +341,7 @@ def get_model_info() -> dict:
     }
 
 @mcp.tool()
-def preload_model() -> dict:
+async def preload_model() -> dict:
     """
     Preload the ASR model into GPU memory.
     Call this to ensure the model is ready before transcription.
@@ -178,8 +350,17 @@ def preload_model() -> dict:
         Dictionary with status and model info
     """
     import time
+    if BACKEND in ("engine", "http"):
+        # The service owns the model; nothing to load here
+        status = await get_model_info()
+        return {
+            "status": "success" if status["model_loaded"] else "loading",
+            "message": f"Model is served by the Fun-ASR service ({BACKEND} backend)",
+            "load_time": 0,
+            "model_path": status["model_path"],
+        }
     start = time.time()
-    model = get_model()
+    await asyncio.get_running_loop().run_in_executor(None, get_model)
     elapsed = time.time() - start
     return {
         "status": "success",
@@ -189,6 +370,7 @@ def preload_model() -> dict:
     }
 
 if __name__ == "__main__":
-    # Preload model on startup
-    get_model()
+    # Preload model on startup (only the local backend has its own copy)
+    if BACKEND == "local":
+        get_model()
     mcp.run()
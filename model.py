@@ -1,3 +1,6 @@
+import contextlib
+import functools
+import hashlib
 import json
 import logging
 import os
@@ -7,6 +10,7 @@ import string
 import time
 import traceback
 
+import numpy as np
 import torch
 import torch.nn as nn
 from funasr import AutoModel
@@ -15,11 +19,592 @@ from funasr.register import tables
 from funasr.train_utils.device_funcs import force_gatherable, to_device
 from funasr.utils.datadir_writer import DatadirWriter
 from funasr.utils.load_utils import extract_fbank, load_audio_text_image_video
-from transformers import AutoConfig, AutoModelForCausalLM
+from transformers import (
+    AutoConfig,
+    AutoModelForCausalLM,
+    StoppingCriteria,
+    StoppingCriteriaList,
+)
+from transformers.generation.streamers import BaseStreamer
 
 dtype_map = {"bf16": torch.bfloat16, "fp16": torch.float16, "fp32": torch.float32}
 
 
+class CancelStoppingCriteria(StoppingCriteria):
+    """Stop generation as soon as the request's cancel token is triggered.
+
+    The token only needs a boolean ``cancelled`` attribute.
+    """
+
+    def __init__(self, cancel_token):
+        self.cancel_token = cancel_token
+
+    def __call__(self, input_ids, scores, **kwargs):
+        cancelled = bool(getattr(self.cancel_token, "cancelled", False))
+        return torch.full(
+            (input_ids.shape[0],), cancelled, dtype=torch.bool, device=input_ids.device
+        )
+
+
+class PartialTextStreamer(BaseStreamer):
+    """Incrementally detokenize generated ids and report the hypothesis so far.
+
+    Only the tokens since the last complete character are re-decoded on each
+    step, so the cost per token is constant. ``callback`` receives the full
+    hypothesis text of batch row ``row`` every time it grows; the other rows
+    are ignored.
+    """
+
+    def __init__(self, tokenizer, callback, skip_special_tokens: bool = True, row: int = 0):
+        self.tokenizer = tokenizer
+        self.callback = callback
+        self.skip_special_tokens = skip_special_tokens
+        self.row = row
+        self.token_ids = []
+        self.text = ""
+        self.prefix_offset = 0
+        self.read_offset = 0
+        self.next_tokens_are_prompt = True
+
+    def _decode(self, ids):
+        return self.tokenizer.decode(ids, skip_special_tokens=self.skip_special_tokens)
+
+    def put(self, value):
+        # generate() first pushes the (empty, for inputs_embeds) prompt
+        if self.next_tokens_are_prompt:
+            self.next_tokens_are_prompt = False
+            return
+        # Steps arrive as [batch] (one new token per row) or [batch, n]
+        if value.dim() > 1:
+            value = value[self.row]
+        else:
+            value = value[self.row : self.row + 1]
+        self.token_ids.extend(value.tolist())
+        prefix_text = self._decode(self.token_ids[self.prefix_offset : self.read_offset])
+        new_text = self._decode(self.token_ids[self.prefix_offset :])
+        # Wait for the rest of a multi-byte character
+        if len(new_text) <= len(prefix_text) or new_text.endswith("\ufffd"):
+            return
+        self.text += new_text[len(prefix_text) :]
+        self.prefix_offset = self.read_offset
+        self.read_offset = len(self.token_ids)
+        self.callback(self.text)
+
+    def end(self):
+        self.next_tokens_are_prompt = True
+
+
+def splice_speech_embeds(
+    inputs_embeds, encoder_out, encoder_out_lens, fbank_beg, fake_token_len
+):
+    """Write encoder outputs over the speech placeholder tokens in one scatter.
+
+    Turns with ``fbank_beg > 0`` consume ``encoder_out`` rows in (batch, turn)
+    order, with the same lengths as the former per-turn loop: a turn writes
+    ``fake_token_len`` frames when both the encoder output and the sequence
+    have room for them (or are cut to the same length); otherwise it falls
+    back to ``encoder_out_lens`` frames, and raises if those overrun the
+    sequence. Nothing is clipped silently.
+    """
+    token_num = inputs_embeds.shape[1]
+    batch_idx, turn_idx = (fbank_beg > 0).nonzero(as_tuple=True)
+    num_speech = batch_idx.numel()
+    if num_speech == 0:
+        return inputs_embeds
+    max_frames = encoder_out.shape[1]
+    beg = fbank_beg[batch_idx, turn_idx].long()
+    lens = fake_token_len[batch_idx, turn_idx].long()
+    room = (token_num - beg).clamp(min=0)
+    # The loop sliced both sides to lens; a shape mismatch sent it to the fallback
+    fallback = lens.clamp(max=max_frames) != torch.minimum(lens, room)
+    lens = torch.where(fallback, encoder_out_lens[:num_speech].long(), lens.clamp(max=max_frames))
+    if fallback.any():
+        logging.warning(
+            f"speech placeholder does not match encoder output: fake_token_len: {fake_token_len}, "
+            f"encoder_out_lens: {encoder_out_lens}, fbank_beg: {fbank_beg}, token_num: {token_num}"
+        )
+        if (fallback & (lens > room)).any():
+            raise RuntimeError(
+                f"speech tokens overrun the sequence: fbank_beg: {beg.tolist()}, "
+                f"lens: {lens.tolist()}, token_num: {token_num}"
+            )
+
+    offsets = torch.arange(max_frames, device=inputs_embeds.device)
+    mask = offsets[None, :] < lens[:, None]
+    rows = batch_idx[:, None].expand(-1, max_frames)[mask]
+    cols = (beg[:, None] + offsets[None, :])[mask]
+    inputs_embeds[rows, cols] = encoder_out[:num_speech][mask].to(inputs_embeds.dtype)
+    return inputs_embeds
+
+
+def _static_cache(config, batch_size, max_cache_len, device, dtype):
+    """StaticCache across transformers versions.
+
+    The batch-size keyword was renamed, and recent releases size the buffers
+    lazily from the first forward call instead.
+    """
+    from transformers import StaticCache
+
+    variants = (
+        {"max_batch_size": batch_size, "device": device, "dtype": dtype},
+        {"batch_size": batch_size, "device": device, "dtype": dtype},
+        {},
+    )
+    for extra in variants:
+        try:
+            return StaticCache(config=config, max_cache_len=max_cache_len, **extra)
+        except TypeError:
+            continue
+    raise RuntimeError("unsupported transformers StaticCache signature")
+
+
+@torch.no_grad()
+def greedy_decode(
+    llm,
+    inputs_embeds,
+    attention_mask=None,
+    max_new_tokens=512,
+    eos_token_ids=(),
+    pad_token_id=0,
+    stopping_criteria=None,
+    streamer=None,
+    model_kwargs=None,
+):
+    """Greedy decoding with a KV cache preallocated for prompt + max_new_tokens.
+
+    A lean replacement for ``llm.generate`` in the plain greedy case: no
+    logits processors and no cache growth. Rows may be left-padded (see
+    ``inference_prepare_batch``). A row is finished once it emits one of
+    ``eos_token_ids`` or a stopping criterion flags it; finished rows keep
+    emitting ``pad_token_id`` until every row is done. Returns the generated
+    ids only (without the prompt), like ``generate`` does for ``inputs_embeds``.
+    ``model_kwargs`` are passed to every forward call (e.g. PEFT ``adapter_names``).
+    """
+    model_kwargs = model_kwargs or {}
+    batch_size, prompt_len, _ = inputs_embeds.shape
+    device = inputs_embeds.device
+    if attention_mask is None:
+        attention_mask = torch.ones(batch_size, prompt_len, dtype=torch.long, device=device)
+    max_len = prompt_len + max_new_tokens
+    cache = _static_cache(llm.config, batch_size, max_len, device, inputs_embeds.dtype)
+
+    mask = torch.zeros(batch_size, max_len, dtype=attention_mask.dtype, device=device)
+    mask[:, :prompt_len] = attention_mask
+    # Left padding: real tokens start at position 0 in every row
+    position_ids = (attention_mask.long().cumsum(-1) - 1).clamp(min=0)
+    eos = torch.tensor(list(eos_token_ids), dtype=torch.long, device=device)
+    output_ids = torch.full((batch_size, max_new_tokens), pad_token_id, dtype=torch.long, device=device)
+    finished = torch.zeros(batch_size, dtype=torch.bool, device=device)
+    if streamer is not None:
+        streamer.put(torch.empty(batch_size, 0, dtype=torch.long))
+
+    outputs = llm(
+        inputs_embeds=inputs_embeds,
+        attention_mask=mask[:, :prompt_len],
+        position_ids=position_ids,
+        past_key_values=cache,
+        cache_position=torch.arange(prompt_len, device=device),
+        use_cache=True,
+        **model_kwargs,
+    )
+    next_position = position_ids[:, -1:] + 1
+    num_generated = 0
+    for step in range(max_new_tokens):
+        next_tokens = outputs.logits[:, -1, :].argmax(dim=-1)
+        next_tokens = torch.where(finished, torch.full_like(next_tokens, pad_token_id), next_tokens)
+        output_ids[:, step] = next_tokens
+        num_generated = step + 1
+        if streamer is not None:
+            streamer.put(next_tokens.cpu())
+        finished |= torch.isin(next_tokens, eos)
+        if stopping_criteria is not None:
+            finished |= stopping_criteria(output_ids[:, :num_generated], None)
+        if bool(finished.all()) or num_generated == max_new_tokens:
+            break
+        cur = prompt_len + step
+        mask[:, cur] = 1
+        outputs = llm(
+            input_ids=next_tokens[:, None],
+            attention_mask=mask[:, : cur + 1],
+            position_ids=next_position,
+            past_key_values=cache,
+            cache_position=torch.tensor([cur], device=device),
+            use_cache=True,
+            **model_kwargs,
+        )
+        next_position = next_position + 1
+    if streamer is not None:
+        streamer.end()
+    return output_ids[:, :num_generated]
+
+
+def pack_sequences(inputs_embeds, attention_mask, labels_ids, max_length=None):
+    """Concatenate the real tokens of several samples into fewer, fuller rows.
+
+    Samples are placed first-fit-decreasing into rows of at most
+    ``max_length`` tokens (default: the padded batch width). Position ids
+    restart at every sample boundary and ``seq_ids`` marks which sample each
+    position belongs to (-1 for padding), from which a block-diagonal causal
+    mask is built. Padding is assumed to be on the right.
+
+    Returns packed embeds [R, L, D], labels [R, L], position_ids [R, L],
+    seq_ids [R, L] and the number of real tokens.
+    """
+    batch_size, token_num, dims = inputs_embeds.shape
+    lengths = attention_mask.sum(-1).tolist()
+    max_length = max(max_length or token_num, max(lengths))
+
+    rows, row_lens = [], []
+    for i in sorted(range(batch_size), key=lambda i: -lengths[i]):
+        for r, used in enumerate(row_lens):
+            if used + lengths[i] <= max_length:
+                rows[r].append(i)
+                row_lens[r] += lengths[i]
+                break
+        else:
+            rows.append([i])
+            row_lens.append(lengths[i])
+
+    num_rows, packed_len = len(rows), max(row_lens)
+    packed = inputs_embeds.new_zeros(num_rows, packed_len, dims)
+    labels = labels_ids.new_full((num_rows, packed_len), -100)
+    position_ids = torch.zeros(
+        num_rows, packed_len, dtype=torch.long, device=inputs_embeds.device
+    )
+    seq_ids = torch.full_like(position_ids, -1)
+    for r, members in enumerate(rows):
+        offset = 0
+        for k, i in enumerate(members):
+            n = lengths[i]
+            packed[r, offset : offset + n] = inputs_embeds[i, :n]
+            labels[r, offset : offset + n] = labels_ids[i, :n]
+            position_ids[r, offset : offset + n] = torch.arange(n, device=packed.device)
+            seq_ids[r, offset : offset + n] = k
+            offset += n
+    return packed, labels, position_ids, seq_ids, sum(lengths)
+
+
+def packed_attention_mask(seq_ids, dtype):
+    """Additive [R, 1, L, L] mask: causal within a sample, blocked across samples."""
+    length = seq_ids.shape[1]
+    causal = torch.ones(length, length, dtype=torch.bool, device=seq_ids.device).tril()
+    allowed = (seq_ids[:, :, None] == seq_ids[:, None, :]) & causal
+    allowed &= (seq_ids >= 0)[:, :, None]
+    # Padding positions attend to themselves so no softmax row is empty
+    allowed |= torch.eye(length, dtype=torch.bool, device=seq_ids.device)
+    mask = torch.zeros(allowed.shape, dtype=dtype, device=seq_ids.device)
+    mask.masked_fill_(~allowed, torch.finfo(dtype).min)
+    return mask[:, None]
+
+
+class LengthGroupedBatchSampler(torch.utils.data.Sampler):
+    """Batches of similar-length samples, for padding- or packing-efficient training.
+
+    Indices are shuffled, split into mega-batches of ``sort_size`` samples
+    (default ``batch_size * 50`` for example batches, 1024 for token
+    batches), sorted by length inside each mega-batch and cut into batches. The batch order is then shuffled and split across ranks.
+    With ``batch_type="token"`` a batch holds up to ``batch_size`` tokens,
+    counted as padded width x samples, or as the sum of lengths when
+    ``pack_sequences`` is set.
+    """
+
+    def __init__(
+        self,
+        dataset,
+        batch_size: int = 1,
+        batch_type: str = "example",
+        shuffle: bool = True,
+        drop_last: bool = False,
+        sort_size: int = None,
+        pack_sequences: bool = False,
+        rank: int = None,
+        num_replicas: int = None,
+        seed: int = 0,
+        **kwargs,
+    ):
+        if num_replicas is None or rank is None:
+            dist = torch.distributed
+            initialized = dist.is_available() and dist.is_initialized()
+            rank = dist.get_rank() if initialized else 0
+            num_replicas = dist.get_world_size() if initialized else 1
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.batch_type = batch_type
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        if sort_size is None:
+            sort_size = 1024 if batch_type == "token" else batch_size * 50
+        self.sort_size = max(1, sort_size)
+        self.pack_sequences = pack_sequences
+        self.rank = rank
+        self.num_replicas = num_replicas
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _length(self, idx):
+        source = getattr(self.dataset, "get_source_len", lambda i: 1)(idx)
+        target = getattr(self.dataset, "get_target_len", lambda i: 0)(idx)
+        return source + target
+
+    def _batches(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        n = len(self.dataset)
+        indices = torch.randperm(n, generator=g).tolist() if self.shuffle else list(range(n))
+        batches = []
+        for start in range(0, n, self.sort_size):
+            group = sorted(
+                indices[start : start + self.sort_size], key=self._length, reverse=True
+            )
+            batch, batch_max, batch_sum = [], 0, 0
+            for idx in group:
+                length = self._length(idx)
+                if self.batch_type == "token":
+                    new_max, new_sum = max(batch_max, length), batch_sum + length
+                    cost = new_sum if self.pack_sequences else new_max * (len(batch) + 1)
+                    full = len(batch) > 0 and cost > self.batch_size
+                else:
+                    full = len(batch) >= self.batch_size
+                if full:
+                    batches.append(batch)
+                    batch, batch_max, batch_sum = [], 0, 0
+                batch.append(idx)
+                batch_max, batch_sum = max(batch_max, length), batch_sum + length
+            incomplete = self.batch_type != "token" and len(batch) < self.batch_size
+            if batch and not (self.drop_last and incomplete):
+                batches.append(batch)
+
+        if self.shuffle:
+            order = torch.randperm(len(batches), generator=g).tolist()
+            batches = [batches[i] for i in order]
+        # Every rank gets the same number of batches
+        per_rank = len(batches) // self.num_replicas
+        return batches[self.rank : per_rank * self.num_replicas : self.num_replicas]
+
+    def __iter__(self):
+        return iter(self._batches())
+
+    def __len__(self):
+        return len(self._batches())
+
+
+@tables.register("batch_sampler_classes", "LengthGroupedBatchSampler")
+def LengthGroupedBatchSampler_fn(dataset, **kwargs):
+    return {
+        "batch_sampler": LengthGroupedBatchSampler(dataset, **kwargs),
+        "num_workers": kwargs.get("num_workers", 4),
+        "pin_memory": kwargs.get("pin_memory", True),
+    }
+
+
+class FbankFeatureStore:
+    """Sharded, memory-mapped store of precomputed fbank features.
+
+    Layout under ``root``::
+
+        meta.json               feature dim, length dtype, frontend settings
+        index_<pid>.jsonl       {"key", "shard", "offset", "frames"} per entry
+        shard_<pid>_<n>.bin     raw float32 features, appended
+
+    Every writer process appends to its own index and shards, so dataloader
+    workers can fill the store concurrently without locking. Reads return
+    copy-on-write views of the mapped shards, so no feature data is copied.
+    """
+
+    def __init__(self, root: str, frontend=None, shard_size_mb: int = 1024):
+        self.root = root
+        self.shard_size = shard_size_mb * 1024 * 1024
+        os.makedirs(root, exist_ok=True)
+        self.frontend_conf = self._frontend_conf(frontend)
+        meta_path = os.path.join(root, "meta.json")
+        self.meta = None
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                self.meta = json.load(f)
+            if self.frontend_conf and self.meta.get("frontend") != self.frontend_conf:
+                raise ValueError(
+                    f"feature store {root} was built with frontend {self.meta.get('frontend')}, "
+                    f"current frontend is {self.frontend_conf}"
+                )
+        self.index = {}
+        for name in sorted(os.listdir(root)):
+            if name.startswith("index_") and name.endswith(".jsonl"):
+                with open(os.path.join(root, name), "r", encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            entry = json.loads(line)
+                            self.index[entry["key"]] = entry
+        self._maps = {}
+        self._pid = None
+        self._index_fd = None
+        self._shard_name = None
+        self._shard_fd = None
+        self._shard_num = 0
+
+    @staticmethod
+    def _frontend_conf(frontend):
+        if frontend is None:
+            return None
+        names = ("fs", "n_mels", "frame_length", "frame_shift", "lfr_m", "lfr_n")
+        return {name: getattr(frontend, name) for name in names if hasattr(frontend, name)}
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, key):
+        """Return ``(speech [1, T, D], speech_lengths [1])`` or None if absent."""
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        shard = self._maps.get(entry["shard"])
+        if shard is None:
+            shard = np.memmap(
+                os.path.join(self.root, entry["shard"]), dtype=np.float32, mode="c"
+            )
+            self._maps[entry["shard"]] = shard
+        dim = self.meta["dim"]
+        begin = entry["offset"] // 4
+        feats = shard[begin : begin + entry["frames"] * dim].reshape(entry["frames"], dim)
+        speech_lengths = torch.tensor(
+            [entry["frames"]], dtype=getattr(torch, self.meta["lengths_dtype"])
+        )
+        return torch.from_numpy(feats)[None], speech_lengths
+
+    def put(self, key, speech, speech_lengths):
+        """Append features of one utterance (``speech`` as returned by extract_fbank)."""
+        frames = int(speech_lengths.reshape(-1)[0])
+        feats = speech[0, :frames].detach().to("cpu", torch.float32).contiguous().numpy()
+        if self.meta is None:
+            self.meta = {
+                "dim": feats.shape[1],
+                "lengths_dtype": str(speech_lengths.dtype).replace("torch.", ""),
+                "frontend": self.frontend_conf,
+            }
+            with open(os.path.join(self.root, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(self.meta, f)
+        # Writers are per process; a forked dataloader worker opens its own files
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._shard_fd = None
+            self._index_fd = open(
+                os.path.join(self.root, f"index_{self._pid}.jsonl"), "a", encoding="utf-8"
+            )
+        if self._shard_fd is None or self._shard_fd.tell() >= self.shard_size:
+            if self._shard_fd is not None:
+                self._shard_fd.close()
+                self._shard_num += 1
+            self._shard_name = f"shard_{self._pid}_{self._shard_num:05d}.bin"
+            self._shard_fd = open(os.path.join(self.root, self._shard_name), "ab")
+        offset = self._shard_fd.tell()
+        self._shard_fd.write(feats.tobytes())
+        self._shard_fd.flush()
+        entry = {"key": key, "shard": self._shard_name, "offset": offset, "frames": frames}
+        self._index_fd.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._index_fd.flush()
+        self.index[key] = entry
+        # The shard grew; drop any stale mapping of it
+        self._maps.pop(self._shard_name, None)
+
+
+_feature_stores = {}
+
+
+def get_feature_store(kwargs, frontend=None):
+    """Feature store configured by ``feature_store`` (a directory) in kwargs or dataset_conf."""
+    root = kwargs.get("feature_store") or kwargs.get("dataset_conf", {}).get(
+        "feature_store"
+    )
+    if not root:
+        return None
+    if root not in _feature_stores:
+        _feature_stores[root] = FbankFeatureStore(root, frontend=frontend)
+    return _feature_stores[root]
+
+
+FAST_LOAD_CACHE_DIR = os.environ.get(
+    "FAST_LOAD_CACHE_DIR", os.path.expanduser("~/.cache/fun-asr/safetensors")
+)
+
+
+def safetensors_cache_path(path: str, cache_dir: str = FAST_LOAD_CACHE_DIR) -> str:
+    """Location of the converted copy of a checkpoint; changes whenever the checkpoint does"""
+    st = os.stat(path)
+    signature = [os.path.abspath(path), st.st_size, int(st.st_mtime)]
+    digest = hashlib.sha256(json.dumps(signature).encode()).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f"{name}-{digest}.safetensors")
+
+
+def load_checkpoint_mmap(path: str, convert_dir: str = None) -> dict:
+    """Load a checkpoint state dict without reading it into memory up front.
+
+    A ``.safetensors`` copy next to ``path`` (shipped with the model) or in
+    ``convert_dir`` is memory-mapped when present. Otherwise ``path`` is opened
+    with ``torch.load(mmap=True)``; only when ``convert_dir`` is given is it
+    also converted once into that directory, never next to ``path``, which may
+    be a shared or read-only model cache.
+    """
+    try:
+        from safetensors import safe_open
+        from safetensors.torch import load_file, save_file
+    except ImportError:
+        load_file = None
+
+    candidates = [os.path.splitext(path)[0] + ".safetensors"]
+    if convert_dir:
+        candidates.append(safetensors_cache_path(path, convert_dir))
+    for st_path in candidates:
+        if load_file is not None and os.path.exists(st_path):
+            state = load_file(st_path, device="cpu")
+            with safe_open(st_path, framework="pt") as f:
+                aliases = json.loads((f.metadata() or {}).get("aliases", "{}"))
+            for name, target in aliases.items():
+                state[name] = state[target]
+            logging.info(f"fast_load: memory-mapping {st_path}")
+            return state
+
+    logging.warning(
+        f"fast_load: no safetensors copy of {path}"
+        + ("" if load_file is not None else " (safetensors is not installed)")
+        + "; falling back to torch.load(mmap=True)"
+        + ("" if convert_dir or load_file is None else ", set FAST_LOAD=convert to write one to FAST_LOAD_CACHE_DIR")
+    )
+    state = torch.load(path, map_location="cpu", mmap=True)
+    if "state_dict" in state:
+        state = state["state_dict"]
+    state = {
+        (k[len("module.") :] if k.startswith("module.") else k): v
+        for k, v in state.items()
+    }
+
+    if load_file is not None and convert_dir:
+        st_path = candidates[-1]
+        # safetensors refuses shared storage (tied embeddings); store aliases instead
+        unique, aliases, seen = {}, {}, {}
+        for name, tensor in state.items():
+            key = (tensor.untyped_storage().data_ptr(), tensor.storage_offset(), tensor.shape)
+            if key in seen:
+                aliases[name] = seen[key]
+            else:
+                seen[key] = name
+                unique[name] = tensor.contiguous()
+        try:
+            os.makedirs(convert_dir, exist_ok=True)
+            tmp_path = f"{st_path}.tmp"
+            save_file(unique, tmp_path, metadata={"aliases": json.dumps(aliases)})
+            os.replace(tmp_path, st_path)
+            logging.info(f"fast_load: converted {path} to {st_path} for mmap loading")
+        except OSError as e:
+            logging.warning(f"could not write {st_path}: {e}")
+    return state
+
+
 @tables.register("model_classes", "FunASRNano")
 class FunASRNano(nn.Module):
     def __init__(
@@ -36,13 +621,34 @@ class FunASRNano(nn.Module):
     ):
         super().__init__()
 
+        # fast_load: build parameters on the meta device (no allocation or random
+        # init) and materialize them straight from a memory-mapped checkpoint.
+        # Pass init_param="" to AutoModel so funasr does not load the weights again.
+        fast_load = kwargs.get("fast_load", False)
+        if fast_load and llm_conf.get("use_lora", False):
+            logging.warning("fast_load is not supported with use_lora, using eager init")
+            fast_load = False
+        empty_init = contextlib.nullcontext
+        if fast_load:
+            try:
+                from accelerate import init_empty_weights
+
+                empty_init = functools.partial(init_empty_weights, include_buffers=False)
+            except ImportError:
+                logging.warning("accelerate is not installed, using eager init")
+                fast_load = False
+
         # audio encoder
         hub = audio_encoder_conf.get("hub", None)
         self.audio_encoder_activation_checkpoint = audio_encoder_conf.get(
             "activation_checkpoint", False
         )
         if hub == "ms":
-            model = AutoModel(model=audio_encoder, model_revision="master")
+            ms_kwargs = {}
+            if fast_load:
+                # Its weights are part of this model's checkpoint; skip loading them twice
+                ms_kwargs["init_param"] = ""
+            model = AutoModel(model=audio_encoder, model_revision="master", **ms_kwargs)
             audio_encoder_output_size = (
                 model.model.encoder_output_size
                 if hasattr(model.model, "encoder_output_size")
@@ -55,7 +661,10 @@ class FunASRNano(nn.Module):
             )
         else:
             encoder_class = tables.encoder_classes.get(audio_encoder)
-            audio_encoder = encoder_class(input_size=input_size, **audio_encoder_conf)
+            with empty_init():
+                audio_encoder = encoder_class(
+                    input_size=input_size, **audio_encoder_conf
+                )
             audio_encoder_output_size = audio_encoder.output_size()
         freeze = audio_encoder_conf.get("freeze", True)
         freeze_layer_num = int(audio_encoder_conf.get("freeze_layer_num", -1))
@@ -72,7 +681,8 @@ class FunASRNano(nn.Module):
 
         llm_load_kwargs = llm_conf.get("load_kwargs", {})
         config = AutoConfig.from_pretrained(init_param_path)
-        model = AutoModelForCausalLM.from_config(config, **llm_load_kwargs)
+        with empty_init():
+            model = AutoModelForCausalLM.from_config(config, **llm_load_kwargs)
 
         freeze = llm_conf.get("freeze", True)
         if freeze:
@@ -115,7 +725,8 @@ class FunASRNano(nn.Module):
         audio_adaptor_conf["llm_dim"] = (
             llm_dim if llm_dim is not None else audio_adaptor_conf["llm_dim"]
         )
-        audio_adaptor = adaptor_class(**audio_adaptor_conf)
+        with empty_init():
+            audio_adaptor = adaptor_class(**audio_adaptor_conf)
         freeze = audio_adaptor_conf.get("freeze", False)
         if freeze:
             for name, param in audio_adaptor.named_parameters():
@@ -124,10 +735,94 @@ class FunASRNano(nn.Module):
         self.audio_adaptor = audio_adaptor
 
         self.length_normalized_loss = length_normalized_loss
+        # Packed-sequence training: several utterances per row, see pack_sequences()
+        self.pack_sequences = kwargs.get("pack_sequences", False)
+        self.pack_max_length = kwargs.get("pack_max_length", None)
         self.feat_permute = audio_encoder_conf.get("feat_permute", True)
+        # Set by enable_compile(): compiled encoder+adaptor and its frame buckets
+        self.compiled_encoder = None
+        self.compile_buckets = []
+        # Set by use_onnx_encoder(): ONNX Runtime replacement for forward_export
+        self.onnx_encoder = None
+        # Set by load_adapters(): named LoRA adapters sharing the resident LLM, and
+        # the adapter used by requests that do not name one
+        self.lora_adapters = {}
+        self.default_adapter = None
         rank = int(os.environ.get("RANK", 0))
+        if fast_load:
+            self.materialize_from_checkpoint(
+                kwargs.get("fast_load_param")
+                or kwargs.get("init_param")
+                or os.path.join(kwargs.get("model_path", ""), "model.pt"),
+                kwargs.get("fast_load_convert_dir"),
+            )
         logging.info(f"rank: {rank}, model is builded.")
 
+    def materialize_from_checkpoint(self, path: str, convert_dir: str = None):
+        """Replace meta-device parameters with tensors from a memory-mapped checkpoint."""
+        time1 = time.perf_counter()
+        state = load_checkpoint_mmap(path, convert_dir)
+        self.load_state_dict(state, strict=False, assign=True)
+        # assign=True rebinds each module's tensors, so tied embeddings must be re-tied
+        self.llm.tie_weights()
+        missing = [name for name, param in self.named_parameters() if param.is_meta]
+        if missing:
+            raise RuntimeError(
+                f"fast_load: {len(missing)} parameters missing from {path}: {missing[:5]}"
+            )
+        self.llm.to(dtype_map[self.llm_dtype])
+        logging.info(
+            f"fast_load: materialized weights from {path} in {time.perf_counter() - time1:0.3f}s"
+        )
+
+    def load_adapters(self, adapters: dict):
+        """Attach named LoRA adapters (name -> adapter dir) on top of the resident LLM.
+
+        Base weights stay loaded once; each adapter only adds its low-rank
+        matrices. Requests select an adapter per call (``adapter`` kwarg), see
+        ``adapter_kwargs``. Requests without one keep the model's own behaviour:
+        the config LoRA when ``use_lora`` is set, otherwise the plain base model.
+        """
+        from peft import PeftModel
+
+        adapters = dict(adapters)
+        if not adapters:
+            return
+        if isinstance(self.llm, PeftModel):
+            self.default_adapter = self.llm.active_adapter
+        else:
+            name = next(iter(adapters))
+            self.llm = PeftModel.from_pretrained(
+                self.llm, adapters.pop(name), adapter_name=name, is_trainable=False
+            )
+            self.lora_adapters[name] = self.llm.peft_config[name]
+            self.default_adapter = "__base__"
+        for name, path in adapters.items():
+            self.llm.load_adapter(path, adapter_name=name, is_trainable=False)
+            self.lora_adapters[name] = self.llm.peft_config[name]
+        self.llm.to(dtype_map[self.llm_dtype])
+        self.llm.eval()
+        logging.info(f"LoRA adapters loaded: {list(self.lora_adapters)}")
+
+    def adapter_kwargs(self, batch_size, **kwargs):
+        """generate()/forward() kwargs that select each row's LoRA adapter.
+
+        ``adapter`` is a name or a list of names (one per row). Selection goes
+        through PEFT's per-row ``adapter_names`` instead of ``set_adapter``, so
+        concurrent decode calls with different adapters never switch shared state.
+        """
+        adapter = kwargs.get("adapter", None)
+        if not self.lora_adapters:
+            if adapter:
+                raise ValueError(f"Unknown adapter: {adapter} (no adapters loaded)")
+            return {}
+        names = adapter if isinstance(adapter, (list, tuple)) else [adapter] * batch_size
+        names = [name or self.default_adapter for name in names]
+        unknown = {name for name in names if name not in self.lora_adapters and name != self.default_adapter}
+        if unknown:
+            raise ValueError(f"Unknown adapter: {sorted(unknown)}")
+        return {"adapter_names": names}
+
     def forward(
         self,
         speech: torch.Tensor = None,
@@ -168,34 +863,9 @@ class FunASRNano(nn.Module):
             fake_token_len[fake_token_len < 0] = 0
             fbank_beg[fbank_beg < 0] = 0
 
-            speech_idx = 0
-            for batch_idx in range(batch_size):
-                for turn_id in range(fbank_beg.shape[1]):
-                    fbank_beg_idx = fbank_beg[batch_idx, turn_id].item()
-                    if fbank_beg_idx > 0:
-                        speech_token_len = fake_token_len[batch_idx, turn_id]
-                        speech_token = encoder_out[speech_idx, :speech_token_len, :]
-
-                        try:
-                            inputs_embeds[
-                                batch_idx,
-                                fbank_beg_idx : fbank_beg_idx + speech_token_len,
-                                :,
-                            ] = speech_token
-                        except Exception as e:
-                            logging.error(f"{str(e)}, {traceback.format_exc()}")
-                            logging.info(
-                                f"batch_idx: {batch_idx}, inputs_embeds: {inputs_embeds.shape}, fbank_beg_idx: {fbank_beg_idx}, speech_token_len: {speech_token_len}, encoder_out: {encoder_out.shape}, encoder_out_lens: {encoder_out_lens}, fake_token_len: {fake_token_len}, speech_lengths: {speech_lengths}"
-                            )
-                            speech_token_len = encoder_out_lens[speech_idx].item()
-                            speech_token = encoder_out[speech_idx, :speech_token_len, :]
-                            inputs_embeds[
-                                batch_idx,
-                                fbank_beg_idx : fbank_beg_idx + speech_token_len,
-                                :,
-                            ] = speech_token
-
-                        speech_idx += 1
+            inputs_embeds = splice_speech_embeds(
+                inputs_embeds, encoder_out, encoder_out_lens, fbank_beg, fake_token_len
+            )
 
             stats["batch_size_speech"] = batch_size_speech
             stats["batch_size_x_frames"] = frames * batch_size_speech
@@ -210,10 +880,28 @@ class FunASRNano(nn.Module):
         ):
             labels_ids[labels_ids == -1] = -100
             attention_mask[attention_mask < 0] = 0
+            real_tokens = attention_mask.sum().item()
+            llm_inputs = {}
+            if self.pack_sequences:
+                inputs_embeds, labels_ids, position_ids, seq_ids, _ = pack_sequences(
+                    inputs_embeds, attention_mask, labels_ids, self.pack_max_length
+                )
+                llm_inputs["position_ids"] = position_ids
+                if (
+                    getattr(self.llm.config, "_attn_implementation", None)
+                    == "flash_attention_2"
+                ):
+                    # flash-attn derives sequence boundaries from position_ids resets
+                    attention_mask = None
+                else:
+                    attention_mask = packed_attention_mask(
+                        seq_ids, dtype_map[self.llm_dtype]
+                    )
             model_outputs = self.llm(
                 inputs_embeds=inputs_embeds.to(dtype_map[self.llm_dtype]),
                 attention_mask=attention_mask,
                 labels=labels_ids,
+                **llm_inputs,
             )
             loss = model_outputs.loss
 
@@ -227,11 +915,15 @@ class FunASRNano(nn.Module):
         stats["loss"] = torch.clone(loss.detach())
         stats["batch_size"] = batch_size
 
-        stats["batch_size_x_tokens"] = token_num * batch_size
-        stats["batch_size_real_tokens"] = attention_mask.sum().item()
+        # Computed tokens: padded batch, or packed rows when packing is on
+        stats["batch_size_x_tokens"] = labels_ids.numel()
+        stats["batch_size_real_tokens"] = real_tokens
         stats["padding_tokens"] = (
             stats["batch_size_x_tokens"] - stats["batch_size_real_tokens"]
         )
+        stats["packing_efficiency"] = real_tokens / max(labels_ids.numel(), 1)
+        if self.pack_sequences:
+            stats["packed_rows"] = labels_ids.shape[0]
 
         dialog_turns = (fbank_beg > 0).sum(-1)
         dialog_turns_max = torch.max(dialog_turns).int().item()
@@ -261,6 +953,42 @@ class FunASRNano(nn.Module):
 
         return encoder_out, encoder_out_lens
 
+    def enable_compile(self, bucket_frames: list, mode: str = "default"):
+        """
+        torch.compile the encoder + adaptor for inference.
+
+        Inputs are right-padded to the smallest bucket (in feature frames) that
+        fits, so only one static graph per bucket and batch size is compiled;
+        longer inputs fall back to eager. Padded frames are masked out by the
+        encoder lengths, and the output is trimmed back to the real length.
+        """
+        self.compile_buckets = sorted(int(b) for b in bucket_frames)
+        self.compiled_encoder = torch.compile(self.forward_export, mode=mode, dynamic=False)
+
+    def use_onnx_encoder(self, onnx_encoder):
+        """
+        Run the encoder + adaptor of encode_speech() with ONNX Runtime.
+
+        onnx_encoder is a callable (speech, speech_lengths) -> (encoder_out,
+        encoder_out_lens) over an exported forward_export graph, see
+        onnx_encoder.py; None restores the PyTorch path.
+        """
+        self.onnx_encoder = onnx_encoder
+
+    def encode_speech(self, speech, speech_lengths):
+        """Encoder + adaptor for decoding; uses the ONNX or compiled bucket path when enabled"""
+        if self.feat_permute:
+            speech = speech.permute(0, 2, 1)
+        if self.onnx_encoder is not None:
+            return self.onnx_encoder(speech, speech_lengths)
+        frames = speech.shape[1]
+        bucket = next((b for b in self.compile_buckets if b >= frames), None)
+        if self.compiled_encoder is None or bucket is None:
+            return self.forward_export(speech, speech_lengths)
+        speech = torch.nn.functional.pad(speech, (0, 0, 0, bucket - frames))
+        encoder_out, encoder_out_lens = self.compiled_encoder(speech, speech_lengths)
+        return encoder_out[:, : int(encoder_out_lens.max())], encoder_out_lens
+
     def data_template(self, data):
         system, user, assistant = [], [], []
         for i, item in enumerate(data):
@@ -354,24 +1082,38 @@ class FunASRNano(nn.Module):
                         sub_str = sub_str[1:]
                         if sub_str.startswith("!"):  # !!: audio sample point
                             sub_str = audio
-                        try:
-                            time1 = time.perf_counter()
-                            data_src = load_audio_text_image_video(
-                                sub_str, fs=frontend.fs, **kwargs
-                            )
+                        feature_store = get_feature_store(kwargs, frontend)
+                        store_key = sub_str if isinstance(sub_str, str) else None
+                        cached = (
+                            feature_store.get(store_key)
+                            if feature_store is not None and store_key is not None
+                            else None
+                        )
+                        if cached is not None:
                             time2 = time.perf_counter()
-                            meta_data["load_data"] = f"{time2 - time1:0.3f}"
-                        except Exception as e:
-                            logging.error(
-                                f"Loading wav failed! {str(e)}, {traceback.format_exc()}"
-                            )
-
-                        speech, speech_lengths = extract_fbank(
-                            data_src,
-                            data_type=kwargs.get("data_type", "sound"),
-                            frontend=frontend,
-                            is_final=True,
-                        )  # speech: [b, T, d]
+                            speech, speech_lengths = cached
+                            meta_data["load_data"] = "0.000"
+                        else:
+                            try:
+                                time1 = time.perf_counter()
+                                data_src = load_audio_text_image_video(
+                                    sub_str, fs=frontend.fs, **kwargs
+                                )
+                                time2 = time.perf_counter()
+                                meta_data["load_data"] = f"{time2 - time1:0.3f}"
+                            except Exception as e:
+                                logging.error(
+                                    f"Loading wav failed! {str(e)}, {traceback.format_exc()}"
+                                )
+
+                            speech, speech_lengths = extract_fbank(
+                                data_src,
+                                data_type=kwargs.get("data_type", "sound"),
+                                frontend=frontend,
+                                is_final=True,
+                            )  # speech: [b, T, d]
+                            if feature_store is not None and store_key is not None:
+                                feature_store.put(store_key, speech, speech_lengths)
 
                         time3 = time.perf_counter()
                         meta_data["extract_feat"] = f"{time3 - time2:0.3f}"
@@ -454,8 +1196,8 @@ class FunASRNano(nn.Module):
     ):
         meta_data = {}
 
-        if kwargs.get("batch_size", 1) > 1:
-            raise NotImplementedError("batch decoding is not implemented")
+        if len(data_in) > 1:
+            raise NotImplementedError("use inference_prepare_batch for several inputs")
 
         contents = self.data_template(data_in[0])
         output = self.data_load_speech(
@@ -477,13 +1219,8 @@ class FunASRNano(nn.Module):
                     speech = speech.to(torch.float16)
                 elif kwargs.get("bf16", False):
                     speech = speech.to(torch.bfloat16)
-                # audio encoder
-                encoder_out, encoder_out_lens = self.encode(speech, speech_lengths)
-
-                # audio_adaptor
-                encoder_out, encoder_out_lens = self.audio_adaptor(
-                    encoder_out, encoder_out_lens
-                )
+                # audio encoder + audio_adaptor
+                encoder_out, encoder_out_lens = self.encode_speech(speech, speech_lengths)
                 meta_data["audio_adaptor_out"] = encoder_out
                 meta_data["audio_adaptor_out_lens"] = encoder_out_lens
 
@@ -503,37 +1240,87 @@ class FunASRNano(nn.Module):
         fake_token_len[fake_token_len < 0] = 0
         fbank_beg[fbank_beg < 0] = 0
 
-        speech_idx = 0
-        for batch_idx in range(batch_size):
-            for turn_id in range(fbank_beg.shape[1]):
-                fbank_beg_idx = fbank_beg[batch_idx, turn_id].item()
-                if fbank_beg_idx > 0:
-                    speech_token_len = fake_token_len[batch_idx, turn_id]
-                    speech_token = encoder_out[speech_idx, :speech_token_len, :]
-
-                    try:
-                        inputs_embeds[
-                            batch_idx,
-                            fbank_beg_idx : fbank_beg_idx + speech_token_len,
-                            :,
-                        ] = speech_token
-                    except Exception as e:
-                        #
-                        logging.error(f"{str(e)}, {traceback.format_exc()}")
-                        logging.info(
-                            f"batch_idx: {batch_idx}, inputs_embeds: {inputs_embeds.shape}, fbank_beg_idx: {fbank_beg_idx}, speech_token_len: {speech_token_len}, encoder_out: {encoder_out.shape}, encoder_out_lens: {encoder_out_lens}, fake_token_len: {fake_token_len}, speech_lengths: {speech_lengths}"
-                        )
-                        speech_token_len = encoder_out_lens[speech_idx].item()
-                        speech_token = encoder_out[speech_idx, :speech_token_len, :]
-                        inputs_embeds[
-                            batch_idx,
-                            fbank_beg_idx : fbank_beg_idx + speech_token_len,
-                            :,
-                        ] = speech_token
-
-                    speech_idx += 1
+        if len(speech) > 0:
+            inputs_embeds = splice_speech_embeds(
+                inputs_embeds, encoder_out, encoder_out_lens, fbank_beg, fake_token_len
+            )
         return inputs_embeds, contents, batch, source_ids, meta_data
 
+    def inference_prepare_batch(
+        self,
+        data_in,
+        data_lengths=None,
+        key: list = None,
+        tokenizer=None,
+        frontend=None,
+        **kwargs,
+    ):
+        """Prepare several dialogs for a single generate() call.
+
+        Prompts are left-padded to a common length so every row ends where
+        generation starts, and the speech of all samples is encoded in one
+        encoder/adaptor pass.
+        """
+        meta_data = {}
+        contents_list, outputs = [], []
+        for data in data_in:
+            contents = self.data_template(data)
+            outputs.append(
+                self.data_load_speech(
+                    contents, tokenizer, frontend, meta_data=meta_data, **kwargs
+                )
+            )
+            contents_list.append(contents)
+
+        batch_size = len(outputs)
+        max_len = max(o["source_ids"].shape[1] for o in outputs)
+        max_turns = max(o["fbank_beg"].shape[1] for o in outputs)
+        source_ids = torch.zeros(batch_size, max_len, dtype=torch.int64)
+        attention_mask = torch.zeros(batch_size, max_len, dtype=torch.int64)
+        fbank_beg = torch.full((batch_size, max_turns), -1, dtype=torch.int32)
+        fake_token_len = torch.zeros(batch_size, max_turns, dtype=torch.int32)
+        fbank, fbank_lens = [], []
+        for i, o in enumerate(outputs):
+            pad = max_len - o["source_ids"].shape[1]
+            source_ids[i, pad:] = o["source_ids"][0]
+            attention_mask[i, pad:] = 1
+            beg = o["fbank_beg"][0]
+            fbank_beg[i, : beg.shape[0]] = torch.where(beg > 0, beg + pad, beg)
+            fake_token_len[i, : beg.shape[0]] = o["fake_token_len"][0]
+            for t in range(len(o["speech"])):
+                speech_t = o["speech"][t]
+                # pad along time: speech is [d, T] when feat_permute
+                fbank.append(speech_t.T if self.feat_permute else speech_t)
+                fbank_lens.append(o["speech_lengths"][t, 0])
+
+        device = kwargs["device"]
+        source_ids = source_ids.to(device)
+        attention_mask = attention_mask.to(device)
+        inputs_embeds = self.llm.model.get_input_embeddings()(source_ids)
+
+        if len(fbank) > 0:
+            speech = torch.nn.utils.rnn.pad_sequence(
+                fbank, batch_first=True, padding_value=0.0
+            )
+            if self.feat_permute:
+                speech = speech.permute(0, 2, 1)
+            speech = speech.to(device)
+            speech_lengths = torch.stack(fbank_lens).to(device)
+            if kwargs.get("fp16", False):
+                speech = speech.to(torch.float16)
+            elif kwargs.get("bf16", False):
+                speech = speech.to(torch.bfloat16)
+            encoder_out, encoder_out_lens = self.encode_speech(speech, speech_lengths)
+            fbank_beg[fbank_beg < 0] = 0
+            inputs_embeds = splice_speech_embeds(
+                inputs_embeds,
+                encoder_out,
+                encoder_out_lens,
+                fbank_beg.to(device),
+                fake_token_len.to(device),
+            )
+        return inputs_embeds, attention_mask, contents_list, meta_data
+
     def inference(
         self,
         data_in,
@@ -616,6 +1403,10 @@ class FunASRNano(nn.Module):
         frontend=None,
         **kwargs,
     ):
+        if len(data_in) > 1:
+            return self.inference_llm_batch(
+                data_in, data_lengths, key, tokenizer, frontend, **kwargs
+            )
         inputs_embeds, contents, batch, source_ids, meta_data = self.inference_prepare(
             data_in, data_lengths, key, tokenizer, frontend, **kwargs
         )
@@ -630,13 +1421,35 @@ class FunASRNano(nn.Module):
             label = contents["assistant"][-1]
             self.llm = self.llm.to(dtype_map[llm_dtype])
             inputs_embeds = inputs_embeds.to(dtype_map[llm_dtype])
-            llm_kwargs = kwargs.get("llm_kwargs", {})
+            llm_kwargs = {**kwargs.get("llm_kwargs", {}), **self.adapter_kwargs(1, **kwargs)}
             if not kwargs.get("teachforing", False):
-                generated_ids = self.llm.generate(
-                    inputs_embeds=inputs_embeds,
-                    max_new_tokens=kwargs.get("max_length", 512),
-                    **llm_kwargs,
-                )
+                cancel_token = kwargs.get("cancel_token", None)
+                if cancel_token is not None:
+                    stopping_criteria = StoppingCriteriaList(
+                        llm_kwargs.get("stopping_criteria", [])
+                    )
+                    stopping_criteria.append(CancelStoppingCriteria(cancel_token))
+                    llm_kwargs = {**llm_kwargs, "stopping_criteria": stopping_criteria}
+                partial_callback = kwargs.get("partial_callback", None)
+                if partial_callback is not None and "streamer" not in llm_kwargs:
+                    llm_kwargs = {
+                        **llm_kwargs,
+                        "streamer": PartialTextStreamer(
+                            tokenizer,
+                            partial_callback,
+                            skip_special_tokens=kwargs.get("skip_special_tokens", True),
+                        ),
+                    }
+                if self.use_greedy_decoder(llm_kwargs, **kwargs):
+                    generated_ids = self.greedy_generate(
+                        inputs_embeds, None, tokenizer, llm_kwargs, **kwargs
+                    )
+                else:
+                    generated_ids = self.llm.generate(
+                        inputs_embeds=inputs_embeds,
+                        max_new_tokens=kwargs.get("max_length", 512),
+                        **llm_kwargs,
+                    )
 
                 response = tokenizer.batch_decode(
                     generated_ids,
@@ -663,30 +1476,158 @@ class FunASRNano(nn.Module):
                 )[0]
                 loss = model_outputs.loss.item()
 
-        ibest_writer = None
-        if kwargs.get("output_dir") is not None:
-            if not hasattr(self, "writer"):
-                self.writer = DatadirWriter(kwargs.get("output_dir"))
-            ibest_writer = self.writer[f"{0 + 1}best_recog"]
+        results = [self.format_result(key[0], response, label, loss, **kwargs)]
+        return results, meta_data
+
+    # generate() options (effective value, from generation_config or llm_kwargs)
+    # the static-cache decoder does not implement, with their no-op values
+    GREEDY_UNSUPPORTED = {
+        "do_sample": (False, None),
+        "num_beams": (1, None),
+        "num_beam_groups": (1, None),
+        "penalty_alpha": (None, 0),
+        "repetition_penalty": (1.0, None),
+        "encoder_repetition_penalty": (1.0, None),
+        "no_repeat_ngram_size": (0, None),
+        "min_new_tokens": (0, None),
+        "min_length": (0, None),
+        "bad_words_ids": (None,),
+        "suppress_tokens": (None,),
+        "begin_suppress_tokens": (None,),
+        "forced_bos_token_id": (None,),
+        "forced_eos_token_id": (None,),
+        "sequence_bias": (None,),
+        "logits_processor": (None,),
+    }
+
+    def use_greedy_decoder(self, llm_kwargs, **kwargs):
+        """The static-cache decoder only covers plain greedy search.
+
+        The check runs on the effective options, i.e. the checkpoint's
+        ``generation_config`` overridden by ``llm_kwargs``, since generate()
+        applies both. Anything else falls back to generate(), logged once.
+        """
+        if not kwargs.get("greedy_decoder", False):
+            return False
+        config = getattr(self.llm, "generation_config", None)
+        effective = config.to_dict() if config is not None else {}
+        effective.update(llm_kwargs)
+        unsupported = sorted(
+            name
+            for name, defaults in self.GREEDY_UNSUPPORTED.items()
+            if effective.get(name) not in defaults
+            and not (name == "logits_processor" and not effective.get(name))
+        )
+        if unsupported:
+            if not getattr(self, "_greedy_fallback_logged", False):
+                self._greedy_fallback_logged = True
+                logging.warning(
+                    f"greedy_decoder: falling back to generate(), options not plain greedy: "
+                    f"{ {name: effective[name] for name in unsupported} }"
+                )
+            return False
+        return True
+
+    def greedy_generate(self, inputs_embeds, attention_mask, tokenizer, llm_kwargs, **kwargs):
+        """Run greedy_decode() with the generate()-style options in ``llm_kwargs``."""
+        eos_token_ids = {tokenizer.convert_tokens_to_ids("<|im_end|>")}
+        config_eos = self.llm.generation_config.eos_token_id
+        if config_eos is not None:
+            eos_token_ids.update(config_eos if isinstance(config_eos, list) else [config_eos])
+        pad_token_id = llm_kwargs.get("pad_token_id", tokenizer.pad_token_id)
+        return greedy_decode(
+            self.llm,
+            inputs_embeds,
+            attention_mask,
+            max_new_tokens=kwargs.get("max_length", 512),
+            eos_token_ids=sorted(i for i in eos_token_ids if i is not None),
+            pad_token_id=pad_token_id if pad_token_id is not None else 0,
+            stopping_criteria=llm_kwargs.get("stopping_criteria"),
+            streamer=llm_kwargs.get("streamer"),
+            model_kwargs={k: llm_kwargs[k] for k in ("adapter_names",) if k in llm_kwargs},
+        )
+
+    def inference_llm_batch(
+        self,
+        data_in,
+        data_lengths=None,
+        key: list = None,
+        tokenizer=None,
+        frontend=None,
+        **kwargs,
+    ):
+        """Greedy/sampled decoding of several inputs in one left-padded generate() call."""
+        inputs_embeds, attention_mask, contents_list, meta_data = (
+            self.inference_prepare_batch(
+                data_in, data_lengths, key, tokenizer, frontend, **kwargs
+            )
+        )
+        llm_dtype = kwargs.get("llm_dtype", "fp32")
+        if llm_dtype == "fp32":
+            llm_dtype = "fp16" if kwargs.get("fp16", False) else llm_dtype
+            llm_dtype = "bf16" if kwargs.get("bf16", False) else llm_dtype
+
+        with torch.cuda.amp.autocast(
+            enabled=True if llm_dtype != "fp32" else False, dtype=dtype_map[llm_dtype]
+        ):
+            self.llm = self.llm.to(dtype_map[llm_dtype])
+            inputs_embeds = inputs_embeds.to(dtype_map[llm_dtype])
+            llm_kwargs = {
+                **kwargs.get("llm_kwargs", {}),
+                **self.adapter_kwargs(inputs_embeds.shape[0], **kwargs),
+            }
+            cancel_token = kwargs.get("cancel_token", None)
+            if cancel_token is not None:
+                stopping_criteria = StoppingCriteriaList(
+                    llm_kwargs.get("stopping_criteria", [])
+                )
+                stopping_criteria.append(CancelStoppingCriteria(cancel_token))
+                llm_kwargs = {**llm_kwargs, "stopping_criteria": stopping_criteria}
+            if tokenizer.pad_token_id is not None and "pad_token_id" not in llm_kwargs:
+                llm_kwargs = {**llm_kwargs, "pad_token_id": tokenizer.pad_token_id}
+            if self.use_greedy_decoder(llm_kwargs, **kwargs):
+                generated_ids = self.greedy_generate(
+                    inputs_embeds, attention_mask, tokenizer, llm_kwargs, **kwargs
+                )
+            else:
+                generated_ids = self.llm.generate(
+                    inputs_embeds=inputs_embeds,
+                    attention_mask=attention_mask,
+                    max_new_tokens=kwargs.get("max_length", 512),
+                    **llm_kwargs,
+                )
+            responses = tokenizer.batch_decode(
+                generated_ids,
+                skip_special_tokens=kwargs.get("skip_special_tokens", True),
+            )
+
+        results = [
+            self.format_result(k, response, contents["assistant"][-1], None, **kwargs)
+            for k, response, contents in zip(key, responses, contents_list)
+        ]
+        return results, meta_data
 
-        results = []
+    def format_result(self, key, response, label, loss=None, **kwargs):
+        """Build one result dict and write it to ``output_dir`` when configured."""
         response_clean = re.sub(r"[^\w\s\u3000\u4e00-\u9fff]+", "", response)
         result_i = {
-            "key": key[0],
+            "key": key,
             "text": re.sub(r'\s+', ' ', response.replace("/sil", " ")),
             "text_tn": response_clean,
             "label": label,
         }
         if loss is not None:
             result_i["loss"] = loss
-        results.append(result_i)
 
-        if ibest_writer is not None:
-            ibest_writer["text"][key[0]] = response.replace("\n", " ")
-            ibest_writer["label"][key[0]] = label.replace("\n", " ")
-            ibest_writer["text_tn"][key[0]] = response_clean
+        if kwargs.get("output_dir") is not None:
+            if not hasattr(self, "writer"):
+                self.writer = DatadirWriter(kwargs.get("output_dir"))
+            ibest_writer = self.writer[f"{0 + 1}best_recog"]
+            ibest_writer["text"][key] = response.replace("\n", " ")
+            ibest_writer["label"][key] = label.replace("\n", " ")
+            ibest_writer["text_tn"][key] = response_clean
 
-        return results, meta_data
+        return result_i
 
     @staticmethod
     def from_pretrained(model: str = None, **kwargs):
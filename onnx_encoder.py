@@ -0,0 +1,188 @@
+"""
+Fun-ASR ONNX Encoder
+Export FunASRNano.forward_export (audio encoder + adaptor) to ONNX and run it
+with ONNX Runtime on CPU, optionally int8-quantized.
+
+Artifacts are cached under ONNX_CACHE_DIR, keyed by the checkpoint files, the
+opset and the quantization setting, so a model is exported once per version.
+ONNX Runtime's optimized graph is cached next to each artifact.
+
+Usage:
+    python onnx_encoder.py --model-dir FunAudioLLM/Fun-ASR-Nano-2512 --quantize --check
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import logging
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.environ.get("ONNX_CACHE_DIR", os.path.expanduser("~/.cache/fun-asr/onnx"))
+DEFAULT_OPSET = 17
+
+
+class _ForwardExport(torch.nn.Module):
+    """Module view of FunASRNano.forward_export for torch.onnx.export"""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, speech, speech_lengths):
+        return self.model.forward_export(speech, speech_lengths)
+
+
+def feature_dim(frontend) -> int:
+    """Encoder input width (fbank bins x LFR stacking)"""
+    return frontend.output_size()
+
+
+def artifact_path(model_path: str, cache_dir: str = DEFAULT_CACHE_DIR, opset: int = DEFAULT_OPSET,
+                  quantize: bool = False) -> str:
+    """Cache location for a model's exported encoder; changes whenever the checkpoint does"""
+    signature = {"opset": opset, "quantize": quantize, "files": []}
+    for name in sorted(os.listdir(model_path)):
+        if name.endswith((".pt", ".safetensors", ".yaml", ".json")):
+            st = os.stat(os.path.join(model_path, name))
+            signature["files"].append([name, st.st_size, int(st.st_mtime)])
+    digest = hashlib.sha256(json.dumps(signature).encode()).hexdigest()[:12]
+    name = os.path.basename(os.path.normpath(model_path))
+    return os.path.join(cache_dir, f"{name}-encoder-{digest}{'.int8' if quantize else ''}.onnx")
+
+
+def export(model, frontend, path: str, opset: int = DEFAULT_OPSET):
+    """Export encoder + adaptor with dynamic batch and time axes (float32, CPU)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    module = _ForwardExport(model).eval()
+    speech = torch.randn(1, 100, feature_dim(frontend), device=next(model.parameters()).device)
+    speech_lengths = torch.tensor([100], dtype=torch.int32, device=speech.device)
+    start = time.time()
+    with torch.no_grad():
+        torch.onnx.export(
+            module,
+            (speech, speech_lengths),
+            path,
+            input_names=["speech", "speech_lengths"],
+            output_names=["encoder_out", "encoder_out_lens"],
+            dynamic_axes={
+                "speech": {0: "batch", 1: "frames"},
+                "speech_lengths": {0: "batch"},
+                "encoder_out": {0: "batch", 1: "tokens"},
+                "encoder_out_lens": {0: "batch"},
+            },
+            opset_version=opset,
+        )
+    logger.info(f"Exported encoder to {path} in {time.time() - start:.1f}s")
+
+
+def quantize(src: str, dst: str):
+    """Dynamic int8 weight quantization (MatMul/Gemm), the usual choice for CPU encoders"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(src, dst, weight_type=QuantType.QInt8)
+    logger.info(f"Quantized encoder written to {dst}")
+
+
+class OrtEncoder:
+    """
+    Callable drop-in for FunASRNano.forward_export backed by an ONNX Runtime CPU session.
+
+    The first session build saves ORT's optimized graph next to the artifact;
+    later starts load that directly and skip graph optimization.
+    """
+    def __init__(self, path: str, num_threads: int = 0):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        optimized_path = path[: -len(".onnx")] + ".opt.onnx"
+        if os.path.exists(optimized_path):
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            model_path = optimized_path
+        else:
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+            options.optimized_model_filepath = optimized_path
+            model_path = path
+        self.path = path
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.lengths_dtype = "int64" if "int64" in self.session.get_inputs()[1].type else "int32"
+
+    def __call__(self, speech: torch.Tensor, speech_lengths: torch.Tensor):
+        encoder_out, encoder_out_lens = self.session.run(None, {
+            "speech": speech.detach().float().cpu().numpy(),
+            "speech_lengths": speech_lengths.detach().cpu().numpy().astype(self.lengths_dtype),
+        })
+        return (
+            torch.from_numpy(encoder_out).to(device=speech.device, dtype=speech.dtype),
+            torch.from_numpy(encoder_out_lens).to(device=speech_lengths.device),
+        )
+
+
+def load_encoder(model, frontend, model_path: str, cache_dir: str = DEFAULT_CACHE_DIR,
+                 quantize_int8: bool = False, opset: int = DEFAULT_OPSET, num_threads: int = 0) -> OrtEncoder:
+    """Export (and quantize) on a cache miss, then open an ORT session on the cached artifact"""
+    path = artifact_path(model_path, cache_dir, opset, quantize_int8)
+    if not os.path.exists(path):
+        fp32_path = artifact_path(model_path, cache_dir, opset, False)
+        if not os.path.exists(fp32_path):
+            export(model, frontend, fp32_path, opset)
+        if quantize_int8:
+            quantize(fp32_path, path)
+    else:
+        logger.info(f"Using cached ONNX encoder: {path}")
+    return OrtEncoder(path, num_threads)
+
+
+def parity_check(model, frontend, encoder: OrtEncoder, frames=(50, 300, 1000)) -> dict:
+    """Max abs difference between the ORT and PyTorch encoder on random features per length"""
+    device = next(model.parameters()).device
+    report = {}
+    for n in frames:
+        speech = torch.randn(1, n, feature_dim(frontend), device=device)
+        speech_lengths = torch.tensor([n], dtype=torch.int32, device=device)
+        with torch.no_grad():
+            ref_out, ref_lens = model.forward_export(speech, speech_lengths)
+        out, lens = encoder(speech, speech_lengths)
+        report[n] = {
+            "max_abs_diff": (out.float() - ref_out.float()).abs().max().item(),
+            "lengths_match": bool((lens.to(ref_lens.dtype) == ref_lens).all()),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the Fun-ASR-Nano audio encoder to ONNX")
+    parser.add_argument("--model-dir", default=os.environ.get("MODEL_DIR", "FunAudioLLM/Fun-ASR-Nano-2512"))
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--opset", type=int, default=DEFAULT_OPSET)
+    parser.add_argument("--quantize", action="store_true", help="Also write an int8 dynamic-quantized copy")
+    parser.add_argument("--check", action="store_true", help="Compare ORT against PyTorch on random features")
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="Max abs diff accepted by --check (fp32)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    from model import FunASRNano
+    model, kwargs = FunASRNano.from_pretrained(model=args.model_dir, device="cpu", disable_update=True)
+    model.eval()
+    encoder = load_encoder(model, kwargs["frontend"], kwargs["model_path"], args.cache_dir, args.quantize, args.opset)
+    print(f"ONNX encoder: {encoder.path}")
+
+    if args.check:
+        report = parity_check(model, kwargs["frontend"], encoder)
+        # int8 weights shift activations well beyond fp32 rounding; report only
+        failed = False
+        for frames, r in report.items():
+            ok = r["lengths_match"] and (args.quantize or r["max_abs_diff"] <= args.tolerance)
+            failed |= not ok
+            print(f"  {frames:5d} frames: max_abs_diff={r['max_abs_diff']:.2e} "
+                  f"lengths_match={r['lengths_match']} {'OK' if ok else 'FAIL'}")
+        sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
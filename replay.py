@@ -0,0 +1,218 @@
+"""
+Fun-ASR Traffic Replay
+Re-issue a captured workload (CAPTURE_LOG, see capture.py) against a running
+instance and compare latency/throughput with the capture.
+
+Requests are sent at their captured relative arrival times divided by --speed.
+Captured audio is used when it was sampled; otherwise a noise WAV of the same
+duration stands in (--synthetic), which keeps the duration mix but not the
+content, or the entry is skipped.
+
+Usage:
+    python replay.py capture.jsonl --url http://localhost:8189 --speed 4
+    python replay.py capture.jsonl --synthetic --output replay_results.jsonl
+"""
+import io
+import os
+import sys
+import json
+import time
+import wave
+import random
+import asyncio
+import argparse
+import statistics
+from array import array
+from functools import lru_cache
+from typing import Optional
+
+# Frontends replayed through the SSE endpoint; everything else uses the sync REST endpoint
+SSE_FRONTENDS = ("sse",)
+
+
+def load_entries(path: str, frontends: Optional[set] = None, status: str = "ok") -> list:
+    """Captured entries in arrival order (only completed requests by default)"""
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if status and entry.get("status") != status:
+                continue
+            if frontends and entry.get("frontend") not in frontends:
+                continue
+            entries.append(entry)
+    return sorted(entries, key=lambda e: e["arrival"])
+
+
+@lru_cache(maxsize=256)
+def synthetic_wav(seconds: float) -> bytes:
+    """16 kHz mono 16-bit low-level noise of the given length (cached per length)"""
+    rng = random.Random(int(seconds * 1000))
+    samples = array("h", (int(rng.gauss(0, 300)) for _ in range(int(seconds * 16000))))
+    if sys.byteorder != "little":
+        samples.byteswap()
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(16000)
+        w.writeframes(samples.tobytes())
+    return buf.getvalue()
+
+
+def resolve_audio(entry: dict, audio_dir: Optional[str], synthetic: bool) -> Optional[tuple]:
+    """(filename, bytes) to upload for an entry, or None to skip it"""
+    if audio_dir and entry.get("audio_file"):
+        path = os.path.join(audio_dir, entry["audio_file"])
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                return entry["audio_file"], f.read()
+    if synthetic and entry.get("duration"):
+        return "synthetic.wav", synthetic_wav(round(entry["duration"], 1))
+    return None
+
+
+async def send(client, url: str, entry: dict, filename: str, audio: bytes) -> dict:
+    """Issue one request; returns status and client-side latency"""
+    params = entry.get("params", {})
+    data = {
+        "language": params.get("language", "auto"),
+        "hotwords": ",".join(params.get("hotwords") or []),
+        "itn": str(params.get("itn", True)).lower(),
+        "adapter": params.get("adapter") or "",
+    }
+    files = {"file": (filename, audio)}
+    start = time.time()
+    try:
+        if entry.get("frontend") in SSE_FRONTENDS:
+            status = "error"
+            async with client.stream("POST", f"{url}/v1/audio/transcriptions/stream", data=data, files=files) as response:
+                if response.status_code != 200:
+                    status = str(response.status_code)
+                else:
+                    async for line in response.aiter_lines():
+                        if line.startswith("data: "):
+                            kind = json.loads(line[6:])["type"]
+                            if kind in ("complete", "error"):
+                                status = "ok" if kind == "complete" else "error"
+                                break
+        else:
+            response = await client.post(f"{url}/v1/audio/transcriptions", data=data, files=files)
+            status = "ok" if response.status_code == 200 else str(response.status_code)
+    except Exception as e:
+        status = f"exception: {e}"
+    return {"status": status, "latency": time.time() - start}
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def summarize(name: str, latencies: list, audio_seconds: float, wall: float) -> dict:
+    return {
+        "name": name,
+        "requests": len(latencies),
+        "p50": percentile(latencies, 50),
+        "p90": percentile(latencies, 90),
+        "p99": percentile(latencies, 99),
+        "mean": statistics.mean(latencies) if latencies else 0.0,
+        "throughput": audio_seconds / wall if wall > 0 else 0.0,
+    }
+
+
+async def replay(entries: list, url: str, speed: float, audio_dir: Optional[str], synthetic: bool,
+                 concurrency: int) -> list:
+    import httpx
+    jobs = []
+    for entry in entries:
+        audio = resolve_audio(entry, audio_dir, synthetic)
+        if audio is not None:
+            jobs.append((entry, audio))
+    if not jobs:
+        return []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    results = []
+    async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+        origin = jobs[0][0]["arrival"]
+        start = time.time()
+
+        async def run(entry, filename, audio):
+            delay = (entry["arrival"] - origin) / speed - (time.time() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            outcome = await send(client, url, entry, filename, audio)
+            results.append({**outcome, "entry": entry, "sent": time.time() - start - outcome["latency"]})
+
+        await asyncio.gather(*(run(entry, name, data) for entry, (name, data) in jobs))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured Fun-ASR traffic")
+    parser.add_argument("capture", help="Capture log (CAPTURE_LOG)")
+    parser.add_argument("--url", default=os.environ.get("FUNASR_API_URL", "http://localhost:8189"))
+    parser.add_argument("--speed", type=float, default=1.0, help="Arrival-time acceleration (2 = twice as fast)")
+    parser.add_argument("--audio-dir", default=None, help="Sampled audio directory (default: <capture>.audio)")
+    parser.add_argument("--synthetic", action="store_true", help="Use noise of the captured duration when audio was not sampled")
+    parser.add_argument("--frontends", default="", help="Only replay these frontends, e.g. rest,sse")
+    parser.add_argument("--limit", type=int, default=0, help="Replay at most this many requests")
+    parser.add_argument("--concurrency", type=int, default=64, help="Max open connections")
+    parser.add_argument("--output", default=None, help="Write per-request results as JSONL")
+    args = parser.parse_args()
+
+    frontends = {f.strip() for f in args.frontends.split(",") if f.strip()} or None
+    entries = load_entries(args.capture, frontends)
+    if args.limit:
+        entries = entries[: args.limit]
+    audio_dir = args.audio_dir or f"{args.capture}.audio"
+    print(f"Replaying {len(entries)} captured requests against {args.url} at {args.speed}x")
+
+    start = time.time()
+    results = asyncio.run(replay(entries, args.url, args.speed, audio_dir, args.synthetic, args.concurrency))
+    wall = time.time() - start
+    if not results:
+        print("Nothing to replay: no sampled audio found (use --synthetic to substitute noise)")
+        sys.exit(1)
+
+    ok = [r for r in results if r["status"] == "ok"]
+    replayed = [r["entry"] for r in ok]
+    # Results are in completion order: span from the first captured arrival to the last captured completion
+    captured_span = (max(e["arrival"] + e["latency"] for e in replayed)
+                     - min(e["arrival"] for e in replayed)) if replayed else 0
+    captured = summarize("captured", [e["latency"] for e in replayed],
+                         sum(e.get("duration") or 0 for e in replayed), captured_span)
+    measured = summarize("replay", [r["latency"] for r in ok],
+                         sum(r["entry"].get("duration") or 0 for r in ok), wall)
+
+    print(f"\n{'':10s} {'requests':>9s} {'p50':>8s} {'p90':>8s} {'p99':>8s} {'mean':>8s} {'audio s/s':>10s}")
+    for row in (captured, measured):
+        print(f"{row['name']:10s} {row['requests']:9d} {row['p50']:8.3f} {row['p90']:8.3f} {row['p99']:8.3f} "
+              f"{row['mean']:8.3f} {row['throughput']:10.2f}")
+    if captured["p50"]:
+        print(f"{'change':10s} {'':9s} " + " ".join(
+            f"{(measured[k] / captured[k] - 1) * 100 if captured[k] else 0:+7.1f}%" for k in ("p50", "p90", "p99", "mean")))
+    failures = {}
+    for r in results:
+        if r["status"] != "ok":
+            failures[r["status"]] = failures.get(r["status"], 0) + 1
+    if failures:
+        print(f"Failures: {failures}")
+    if args.speed != 1:
+        print(f"(captured throughput is at 1x arrival rate; replay ran at {args.speed}x)")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for r in results:
+                f.write(json.dumps({"arrival": r["entry"]["arrival"], "frontend": r["entry"]["frontend"],
+                                    "duration": r["entry"].get("duration"), "status": r["status"],
+                                    "captured_latency": r["entry"]["latency"], "latency": round(r["latency"], 3),
+                                    "sent": round(r["sent"], 3)}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
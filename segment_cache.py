@@ -0,0 +1,179 @@
+"""
+Fun-ASR segment cache
+LRU cache of VAD segment transcripts keyed on an audio fingerprint, so
+recurring audio (IVR prompts, hold music, jingles) skips the encoder and LLM
+"""
+import math
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import torch
+
+SAMPLE_RATE = 16000
+N_FFT = 2048          # 128 ms frames
+HOP = N_FFT // 4      # 32 ms hop
+SUB_BITS = 32         # bits per sub-fingerprint (one per frame)
+BANDS = SUB_BITS + 1
+F_MIN, F_MAX = 300.0, 4000.0
+BER_THRESHOLD = 0.2   # max bit error rate for two segments to count as the same audio
+LENGTH_TOLERANCE = 0.05
+MAX_PROBES = 64       # query frames looked up exactly per get()
+MAX_CANDIDATES = 8    # (entry, alignment) pairs verified per get()
+MIN_RMS = 1e-4        # about -80 dBFS; quieter segments are not fingerprinted
+MIN_BIT_DENSITY = 0.05  # set-bit share must lie in [MIN_BIT_DENSITY, 1 - MIN_BIT_DENSITY]
+
+_BIT_WEIGHTS = torch.tensor([1 << i for i in range(SUB_BITS)], dtype=torch.int64)
+
+
+def fingerprint(chunk: torch.Tensor, sample_rate: int = SAMPLE_RATE) -> Optional[torch.Tensor]:
+    """
+    Per-frame 32-bit sub-fingerprints of a mono waveform segment (int64 tensor
+    of shape [frames]), or None when it is too short or uncacheable.
+
+    Each bit is the sign of the time-derivative of an adjacent band-energy
+    difference (Haitsma-Kalker): invariant to gain, and codec noise flips only
+    a few bits, which SegmentCache tolerates by matching on bit error rate.
+
+    Silence, DC and other stationary signals have no band-energy changes, so
+    their bits are (nearly) all equal and every such segment would match every
+    other one. Segments below MIN_RMS or whose share of set bits falls outside
+    [MIN_BIT_DENSITY, 1 - MIN_BIT_DENSITY] return None instead.
+    """
+    chunk = chunk.detach().float().cpu()
+    if chunk.numel() < N_FFT + 2 * HOP:
+        return None
+    if chunk.pow(2).mean().sqrt().item() < MIN_RMS:
+        return None
+    spec = torch.stft(chunk, N_FFT, HOP, window=torch.hann_window(N_FFT), return_complex=True).abs().pow(2)
+    bin_hz = sample_rate / N_FFT
+    edges = torch.logspace(math.log10(F_MIN), math.log10(F_MAX), BANDS + 1)
+    bins = (edges / bin_hz).round().long().tolist()
+    energy = torch.stack([spec[lo:max(hi, lo + 1)].sum(0) for lo, hi in zip(bins[:-1], bins[1:])])
+    diff = energy[:-1] - energy[1:]
+    bits = (diff[:, 1:] - diff[:, :-1]) > 0
+    density = bits.float().mean().item()
+    if not MIN_BIT_DENSITY <= density <= 1 - MIN_BIT_DENSITY:
+        return None
+    return (bits.long() * _BIT_WEIGHTS[:, None]).sum(0)
+
+
+def bit_error_rate(a: torch.Tensor, b: torch.Tensor) -> float:
+    """Fraction of differing bits between two equally long sub-fingerprint blocks"""
+    xor = torch.bitwise_xor(a, b)
+    errors = ((xor[:, None] >> torch.arange(SUB_BITS)) & 1).sum().item()
+    return errors / (SUB_BITS * a.numel())
+
+
+class SegmentCache:
+    """
+    Thread-safe LRU cache of transcripts, matched by audio fingerprint.
+
+    A lookup is a Haitsma-Kalker search: up to MAX_PROBES of the query's
+    sub-fingerprints are looked up exactly in an index of cached frames, each
+    hit proposes an (entry, frame offset) alignment, and the most-voted
+    alignments are verified by the bit error rate over the whole block. A
+    segment matches when its length is within LENGTH_TOLERANCE of the cached
+    one (so a VAD cut shifted by a hop or two still hits), the overlap covers
+    it and the BER is below BER_THRESHOLD. Decode params must match exactly.
+
+    Args:
+        capacity: Max cached segments; 0 disables the cache
+    """
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self._entries = OrderedDict()   # id -> (params, frames, text)
+        self._index = {}                # (params, sub-fingerprint) -> {(id, frame)}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_audio_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    @staticmethod
+    def key(fp: torch.Tensor, language: str, hotwords, itn: bool, adapter: Optional[str] = None) -> tuple:
+        """(decode params, sub-fingerprints) lookup key for get()/put()"""
+        return ((language, tuple(sorted(hotwords or [])), bool(itn), adapter or None), fp)
+
+    def _match(self, params: tuple, frames: torch.Tensor) -> Optional[int]:
+        n = frames.numel()
+        votes = {}
+        step = max(1, n // MAX_PROBES)
+        for i in range(0, n, step):
+            for entry_id, j in self._index.get((params, int(frames[i])), ()):
+                votes[(entry_id, j - i)] = votes.get((entry_id, j - i), 0) + 1
+        for (entry_id, offset), _ in sorted(votes.items(), key=lambda kv: -kv[1])[:MAX_CANDIDATES]:
+            cached = self._entries[entry_id][1]
+            m = cached.numel()
+            longest = max(n, m)
+            if abs(n - m) > max(2, LENGTH_TOLERANCE * longest):
+                continue
+            lo, hi = max(0, -offset), min(n, m - offset)
+            if hi - lo < (1 - LENGTH_TOLERANCE) * longest - 2:
+                continue
+            if bit_error_rate(frames[lo:hi], cached[lo + offset:hi + offset]) <= BER_THRESHOLD:
+                return entry_id
+        return None
+
+    def get(self, key: tuple, audio_seconds: float = 0.0) -> Optional[str]:
+        params, frames = key
+        with self._lock:
+            entry_id = self._match(params, frames)
+            if entry_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            self.saved_audio_seconds += audio_seconds
+            return self._entries[entry_id][2]
+
+    def put(self, key: tuple, text: str):
+        if not self.enabled:
+            return
+        params, frames = key
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (params, frames, text)
+            for j, sub in enumerate(frames.tolist()):
+                self._index.setdefault((params, sub), set()).add((entry_id, j))
+            self._evict(self.capacity)
+
+    def _evict(self, capacity: int):
+        while len(self._entries) > capacity:
+            entry_id, (params, frames, _) = self._entries.popitem(last=False)
+            for j, sub in enumerate(frames.tolist()):
+                postings = self._index.get((params, sub))
+                if postings is not None:
+                    postings.discard((entry_id, j))
+                    if not postings:
+                        del self._index[(params, sub)]
+            self.evictions += 1
+
+    def resize(self, capacity: int):
+        with self._lock:
+            self.capacity = capacity
+            self._evict(capacity)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "capacity": self.capacity,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "saved_audio_seconds": round(self.saved_audio_seconds, 1),
+            }
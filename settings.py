@@ -0,0 +1,214 @@
+"""
+Fun-ASR runtime settings
+Typed registry of performance knobs: defaults < environment < settings file,
+with validated hot updates (see the admin API in app.py)
+"""
+import os
+import json
+import logging
+import threading
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SettingError(ValueError):
+    """Raised for unknown settings or values that fail validation"""
+
+
+def _parse_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return bool(value)
+    text = str(value).strip().lower()
+    if text in ("1", "true", "yes", "on"):
+        return True
+    if text in ("0", "false", "no", "off", ""):
+        return False
+    raise ValueError(f"not a boolean: {value!r}")
+
+
+class Setting:
+    """
+    One knob.
+
+    Args:
+        name: Registry key (lower case); the env var is its upper-case form unless env is given
+        type: bool, int, float or str
+        minimum / maximum: Inclusive bounds for numbers
+        choices: Allowed values
+        reload_required: The value is only read at model load; changes apply after a restart
+        on_change: Called with the new value after a hot update
+        validator: Extra check on the coerced value; raises ValueError when invalid
+    """
+    def __init__(self, name: str, type: type, default: Any, description: str = "",
+                 env: Optional[str] = None, minimum: Optional[float] = None, maximum: Optional[float] = None,
+                 choices: Optional[tuple] = None, reload_required: bool = False,
+                 on_change: Optional[Callable[[Any], None]] = None,
+                 validator: Optional[Callable[[Any], None]] = None):
+        self.name = name
+        self.type = type
+        self.default = default
+        self.description = description
+        self.env = env or name.upper()
+        self.minimum = minimum
+        self.maximum = maximum
+        self.choices = choices
+        self.reload_required = reload_required
+        self.on_change = on_change
+        self.validator = validator
+
+    def parse(self, value) -> Any:
+        """Coerce and validate a value from env, file or the admin API"""
+        try:
+            if self.type is int and isinstance(value, float) and not value.is_integer():
+                raise ValueError(f"not an integer: {value!r}")
+            value = _parse_bool(value) if self.type is bool else self.type(value)
+        except (TypeError, ValueError) as e:
+            raise SettingError(f"{self.name}: expected {self.type.__name__}: {e}")
+        if self.minimum is not None and value < self.minimum:
+            raise SettingError(f"{self.name}: must be >= {self.minimum}")
+        if self.maximum is not None and value > self.maximum:
+            raise SettingError(f"{self.name}: must be <= {self.maximum}")
+        if self.choices is not None and value not in self.choices:
+            raise SettingError(f"{self.name}: must be one of {list(self.choices)}")
+        if self.validator is not None:
+            try:
+                self.validator(value)
+            except (TypeError, ValueError) as e:
+                raise SettingError(f"{self.name}: {e}")
+        return value
+
+
+class SettingsRegistry:
+    """
+    Effective values of registered settings.
+
+    Values come from the default, then the environment, then the JSON settings
+    file. The file holds runtime overrides written by update(), so it wins over
+    the deployment's environment; without a file, admin changes last until the
+    process exits. update() validates a whole change set before applying any of
+    it and rolls every hot change back if one on_change fails; reload-required
+    ones are recorded as pending until the process restarts.
+    """
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or None
+        self._settings = {}
+        self._values = {}
+        self._sources = {}
+        self._pending = {}
+        self._file = {}
+        self._lock = threading.Lock()
+        if self.path and os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._file = json.load(f)
+
+    def register(self, setting: Setting) -> Setting:
+        """Add a setting and resolve its startup value"""
+        value, source = setting.parse(setting.default), "default"
+        if os.environ.get(setting.env) is not None:
+            value, source = setting.parse(os.environ[setting.env]), "env"
+        if setting.name in self._file:
+            if source == "env":
+                logger.info(f"Setting {setting.name}: {self.path} overrides {setting.env}")
+            value, source = setting.parse(self._file[setting.name]), "file"
+        self._settings[setting.name] = setting
+        self._values[setting.name] = value
+        self._sources[setting.name] = source
+        return setting
+
+    def get(self, name: str) -> Any:
+        return self._values[name]
+
+    def __getitem__(self, name: str) -> Any:
+        return self._values[name]
+
+    def update(self, changes: dict) -> dict:
+        """
+        Validate and apply a change set (all or nothing).
+
+        Returns:
+            {"applied": {...}, "pending_reload": {...}, "persisted": bool} with the
+            parsed values; persisted is False when there is no settings file, in
+            which case pending_reload values are lost at the restart meant to apply them
+        """
+        unknown = [name for name in changes if name not in self._settings]
+        if unknown:
+            raise SettingError(f"unknown settings: {unknown}")
+        parsed = {name: self._settings[name].parse(value) for name, value in changes.items()}
+        applied, pending = {}, {}
+        with self._lock:
+            undo = []
+            try:
+                for name, value in parsed.items():
+                    setting = self._settings[name]
+                    if setting.reload_required:
+                        pending[name] = value
+                        continue
+                    old = self._values[name]
+                    undo.append((name, old, self._sources[name]))
+                    self._values[name] = value
+                    self._sources[name] = "admin"
+                    if setting.on_change is not None and value != old:
+                        setting.on_change(value)
+                    applied[name] = value
+                self._save(parsed)
+            except Exception:
+                self._rollback(undo, parsed)
+                raise
+            for name, value in pending.items():
+                if value == self._values[name]:
+                    self._pending.pop(name, None)
+                else:
+                    self._pending[name] = value
+        persisted = self.path is not None
+        logger.info(f"Settings updated: applied={applied} pending_reload={pending} persisted={persisted}")
+        return {"applied": applied, "pending_reload": pending, "persisted": persisted}
+
+    def _rollback(self, undo: list, parsed: dict):
+        """Restore hot settings changed by a failed update, newest first"""
+        for name, old, source in reversed(undo):
+            setting = self._settings[name]
+            self._values[name] = old
+            self._sources[name] = source
+            if setting.on_change is not None and parsed[name] != old:
+                try:
+                    setting.on_change(old)
+                except Exception:
+                    logger.exception(f"Rolling back setting {name} failed")
+
+    def _save(self, parsed: dict):
+        """Persist admin changes to the settings file so they survive a restart"""
+        if not self.path:
+            return
+        content = {**self._file, **parsed}
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(content, f, indent=2, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        self._file = content
+
+    def snapshot(self) -> dict:
+        """Read-only view: effective value, source and metadata of every setting"""
+        with self._lock:
+            view = {}
+            for name, setting in self._settings.items():
+                entry = {
+                    "value": self._values[name],
+                    "type": setting.type.__name__,
+                    "source": self._sources[name],
+                    "env": setting.env,
+                    "reload_required": setting.reload_required,
+                    "description": setting.description,
+                }
+                if setting.minimum is not None:
+                    entry["minimum"] = setting.minimum
+                if setting.maximum is not None:
+                    entry["maximum"] = setting.maximum
+                if setting.choices is not None:
+                    entry["choices"] = list(setting.choices)
+                if name in self._pending:
+                    entry["pending_value"] = self._pending[name]
+                view[name] = entry
+            return view
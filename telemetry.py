@@ -0,0 +1,155 @@
+"""
+Fun-ASR resource telemetry
+Background sampler keeping a short history of process and accelerator usage
+"""
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def process_rss_mb() -> Optional[float]:
+    """Resident set size of this process (psutil, else /proc; None if neither is available)"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / 2**20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def accelerator_info(devices: Optional[List[int]] = None) -> dict:
+    """
+    Per-device memory from torch.cuda (empty on CPU-only nodes, without torch or
+    before this process has initialized CUDA).
+
+    Querying free memory creates a CUDA context (hundreds of MB) on a device that
+    has none, so only `devices` are sampled, by default the ones this process
+    already holds memory on; GPUs used by neighbouring processes are never touched.
+    """
+    try:
+        import torch
+        if not torch.cuda.is_available() or not torch.cuda.is_initialized():
+            return {}
+    except ImportError:
+        return {}
+    if devices is None:
+        devices = [i for i in range(torch.cuda.device_count()) if torch.cuda.memory_reserved(i) > 0]
+    info_by_device = {}
+    for i in devices:
+        free, total = torch.cuda.mem_get_info(i)
+        info = {
+            "name": torch.cuda.get_device_name(i),
+            "memory_used_mb": (total - free) // 2**20,
+            "memory_total_mb": total // 2**20,
+            "memory_allocated_mb": torch.cuda.memory_allocated(i) // 2**20,
+            "memory_reserved_mb": torch.cuda.memory_reserved(i) // 2**20,
+        }
+        try:
+            # Needs pynvml; skipped silently when it is not installed
+            info["utilization_percent"] = torch.cuda.utilization(i)
+        except Exception:
+            pass
+        info_by_device[str(i)] = info
+    return info_by_device
+
+
+class TelemetrySampler:
+    """
+    Samples resource usage every `interval` seconds on a daemon thread into a ring buffer.
+
+    Readers (health probes, metrics endpoints) only copy the latest sample, so
+    probing costs nothing regardless of how often it happens.
+
+    Args:
+        interval: Seconds between samples
+        history: Samples kept in the ring buffer
+        sources: Extra name -> callable() -> dict sampled alongside the built-in
+            metrics (e.g. executor occupancy)
+        devices: CUDA device indices to sample (default: those this process
+            already holds memory on)
+    """
+    def __init__(self, interval: float = 5.0, history: int = 120,
+                 sources: Optional[Dict[str, Callable[[], dict]]] = None,
+                 devices: Optional[List[int]] = None):
+        self.interval = interval
+        self.devices = devices
+        self.sources = dict(sources or {})
+        self._samples = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_cpu = None
+
+    def _cpu_percent(self, now: float) -> Optional[float]:
+        """Process CPU time over wall time since the previous sample (100 = one core busy)"""
+        t = os.times()
+        cpu = t.user + t.system
+        last, self._last_cpu = self._last_cpu, (now, cpu)
+        if last is None or now <= last[0]:
+            return None
+        return round(100 * (cpu - last[1]) / (now - last[0]), 1)
+
+    def sample(self) -> dict:
+        """Take one sample and append it to the history"""
+        now = time.time()
+        rss = process_rss_mb()
+        sample = {
+            "timestamp": round(now, 3),
+            "rss_mb": round(rss, 1) if rss is not None else None,
+            "cpu_percent": self._cpu_percent(now),
+        }
+        try:
+            sample["gpu"] = accelerator_info(self.devices)
+        except Exception as e:
+            logger.debug(f"Accelerator sampling failed: {e}")
+            sample["gpu"] = {}
+        for name, fn in self.sources.items():
+            try:
+                sample[name] = fn()
+            except Exception as e:
+                logger.debug(f"Telemetry source {name} failed: {e}")
+        with self._lock:
+            self._samples.append(sample)
+        return sample
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def latest(self) -> dict:
+        """Most recent sample (empty before the first one)"""
+        with self._lock:
+            return dict(self._samples[-1]) if self._samples else {}
+
+    def history(self, seconds: Optional[float] = None) -> list:
+        """Buffered samples, oldest first, optionally limited to the last `seconds`"""
+        with self._lock:
+            samples = list(self._samples)
+        if seconds is not None:
+            cutoff = time.time() - seconds
+            samples = [s for s in samples if s["timestamp"] >= cutoff]
+        return samples
@@ -0,0 +1,159 @@
+"""
+FunASRClient against an in-process httpx.MockTransport stub
+"""
+import re
+import json
+import time
+import asyncio
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+from client import FunASRClient, FunASRError, parse_retry_after
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def payload_id(request) -> int:
+    """Index encoded in the uploaded bytes (b"payload-<n>")"""
+    return int(re.search(rb"payload-(\d+)", request.read()).group(1))
+
+
+def make_client(handler, **kwargs) -> FunASRClient:
+    return FunASRClient("http://stub", transport=httpx.MockTransport(handler), backoff=0.01, **kwargs)
+
+
+def test_retry_after_429_then_success():
+    calls = []
+
+    def handler(request):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"Retry-After": "0.2"}, json={"detail": "busy"})
+        return httpx.Response(200, json={"text": "ok", "duration": 0.1, "audio_duration": 1.0})
+
+    async def main():
+        async with make_client(handler) as client:
+            result = await client.transcribe(b"payload-0")
+            return result, client.retries
+
+    result, retries = run(main())
+    assert result["text"] == "ok"
+    assert retries == 1
+    assert len(calls) == 2
+    # Waited at least Retry-After, plus at most the jitter
+    assert 0.2 <= calls[1] - calls[0] < 1.0
+
+
+def test_retries_exhausted_raises_with_retry_after():
+    def handler(request):
+        return httpx.Response(503, headers={"Retry-After": "0"})
+
+    async def main():
+        async with make_client(handler, max_retries=2) as client:
+            await client.transcribe(b"payload-0")
+
+    with pytest.raises(FunASRError) as excinfo:
+        run(main())
+    assert excinfo.value.status_code == 503
+    assert excinfo.value.retry_after == 0
+
+
+def test_client_error_is_not_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(1)
+        return httpx.Response(400, json={"detail": "Could not decode audio"})
+
+    async def main():
+        async with make_client(handler) as client:
+            await client.transcribe(b"payload-0")
+
+    with pytest.raises(FunASRError) as excinfo:
+        run(main())
+    assert excinfo.value.status_code == 400
+    assert len(calls) == 1
+
+
+def test_transcribe_many_keeps_order_and_caps_concurrency():
+    in_flight, peak = 0, 0
+
+    async def handler(request):
+        nonlocal in_flight, peak
+        n = payload_id(request)
+        in_flight += 1
+        peak = max(peak, in_flight)
+        # Later inputs finish first
+        await asyncio.sleep(0.01 * (10 - n))
+        in_flight -= 1
+        if n == 4:
+            return httpx.Response(500, text="boom")
+        return httpx.Response(200, json={"text": f"text-{n}", "duration": 0.0, "audio_duration": 1.0})
+
+    async def main():
+        async with make_client(handler) as client:
+            return await client.transcribe_many([f"payload-{n}".encode() for n in range(10)], concurrency=3)
+
+    results = run(main())
+    assert peak <= 3
+    assert isinstance(results[4], FunASRError) and results[4].status_code == 500
+    assert [r["text"] for i, r in enumerate(results) if i != 4] == [f"text-{n}" for n in range(10) if n != 4]
+
+
+def test_transcribe_many_can_raise():
+    def handler(request):
+        return httpx.Response(500, text="boom")
+
+    async def main():
+        async with make_client(handler) as client:
+            await client.transcribe_many([b"payload-0"], return_exceptions=False)
+
+    with pytest.raises(FunASRError):
+        run(main())
+
+
+def sse(*events) -> bytes:
+    return b"".join(f"data: {json.dumps(e)}\n\n".encode() for e in events)
+
+
+def test_stream_iterates_sse_events():
+    events = [
+        {"type": "progress", "current": 1, "total": 2, "text": "hel"},
+        {"type": "partial", "segment": 1, "text": "hello wo"},
+        {"type": "progress", "current": 2, "total": 2, "text": "hello world"},
+        {"type": "complete", "text": "hello world", "duration": 0.5, "audio_duration": 3.0},
+    ]
+
+    def handler(request):
+        assert request.url.path == "/v1/audio/transcriptions/stream"
+        return httpx.Response(200, content=sse(*events), headers={"Content-Type": "text/event-stream"})
+
+    async def main():
+        async with make_client(handler) as client:
+            return [event async for event in client.stream(b"payload-0")]
+
+    assert run(main()) == events
+
+
+def test_stream_error_event_raises():
+    def handler(request):
+        return httpx.Response(200, content=sse({"type": "error", "message": "decode failed"}))
+
+    async def main():
+        async with make_client(handler) as client:
+            async for _ in client.stream(b"payload-0"):
+                pass
+
+    with pytest.raises(FunASRError, match="decode failed"):
+        run(main())
+
+
+def test_parse_retry_after_forms():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
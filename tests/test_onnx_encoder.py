@@ -0,0 +1,75 @@
+"""
+Parity of the ONNX Runtime encoder with the PyTorch forward_export it replaces
+"""
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+from onnx_encoder import load_encoder, parity_check
+
+FEATURE_DIM = 40
+
+
+class TinyFrontend:
+    def output_size(self):
+        return FEATURE_DIM
+
+
+class TinyEncoder(torch.nn.Module):
+    """Encoder + adaptor stand-in with the same forward_export contract (2x downsampling)"""
+    def __init__(self):
+        super().__init__()
+        self.proj = torch.nn.Linear(FEATURE_DIM, 64)
+        self.conv = torch.nn.Conv1d(64, 64, kernel_size=3, stride=2, padding=1)
+        self.out = torch.nn.Linear(64, 32)
+
+    def forward_export(self, speech, speech_lengths):
+        x = torch.relu(self.proj(speech)).transpose(1, 2)
+        x = torch.relu(self.conv(x)).transpose(1, 2)
+        return self.out(x), (speech_lengths - 1) // 2 + 1
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    return TinyEncoder().eval()
+
+
+@pytest.fixture(scope="module")
+def model_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp("model")
+    (path / "model.pt").write_bytes(b"checkpoint")
+    return str(path)
+
+
+def test_fp32_matches_pytorch(model, model_dir, tmp_path):
+    encoder = load_encoder(model, TinyFrontend(), model_dir, cache_dir=str(tmp_path))
+    report = parity_check(model, TinyFrontend(), encoder, frames=(7, 50, 300, 1000))
+    for frames, r in report.items():
+        assert r["lengths_match"], frames
+        assert r["max_abs_diff"] < 1e-4, (frames, r)
+
+
+def test_int8_within_looser_bound(model, model_dir, tmp_path):
+    encoder = load_encoder(model, TinyFrontend(), model_dir, cache_dir=str(tmp_path), quantize_int8=True)
+    assert encoder.path.endswith(".int8.onnx")
+    speech = torch.randn(1, 200, FEATURE_DIM)
+    speech_lengths = torch.tensor([200], dtype=torch.int32)
+    with torch.no_grad():
+        ref, ref_lens = model.forward_export(speech, speech_lengths)
+    out, lens = encoder(speech, speech_lengths)
+    assert torch.equal(lens.to(ref_lens.dtype), ref_lens)
+    # Dynamic int8 weights: errors well above fp32 rounding, but small next to the activations
+    assert (out - ref).abs().max().item() < 0.1 * ref.abs().max().item()
+
+
+def test_export_is_cached(model, model_dir, tmp_path):
+    first = load_encoder(model, TinyFrontend(), model_dir, cache_dir=str(tmp_path))
+    mtime = os.path.getmtime(first.path)
+    second = load_encoder(model, TinyFrontend(), model_dir, cache_dir=str(tmp_path))
+    assert second.path == first.path
+    assert os.path.getmtime(second.path) == mtime
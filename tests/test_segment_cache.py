@@ -0,0 +1,54 @@
+"""
+Segment cache fingerprints: robust hits, misses on other audio, no silence keys
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from segment_cache import SegmentCache, fingerprint, HOP, SAMPLE_RATE
+
+PARAMS = dict(language="en", hotwords=None, itn=True)
+
+
+def noise(seconds: float, seed: int) -> torch.Tensor:
+    generator = torch.Generator().manual_seed(seed)
+    n = int(seconds * SAMPLE_RATE)
+    t = torch.arange(n) / SAMPLE_RATE
+    envelope = 1 + 0.8 * torch.sin(2 * torch.pi * 3 * t)
+    return 0.1 * envelope * torch.randn(n, generator=generator)
+
+
+def cached(audio: torch.Tensor) -> SegmentCache:
+    cache = SegmentCache(capacity=8)
+    cache.put(SegmentCache.key(fingerprint(audio), **PARAMS), "hello")
+    return cache
+
+
+def test_hit_under_gain_change_and_hop_shift():
+    audio = noise(3.0, seed=0)
+    cache = cached(audio)
+    query = fingerprint(0.25 * audio[HOP:])
+    assert query is not None
+    assert cache.get(SegmentCache.key(query, **PARAMS), 3.0) == "hello"
+    assert cache.stats()["hits"] == 1
+
+
+def test_decode_params_must_match():
+    audio = noise(3.0, seed=0)
+    cache = cached(audio)
+    key = SegmentCache.key(fingerprint(audio), language="zh", hotwords=None, itn=True)
+    assert cache.get(key) is None
+
+
+def test_miss_on_different_audio():
+    cache = cached(noise(3.0, seed=0))
+    assert cache.get(SegmentCache.key(fingerprint(noise(3.0, seed=1)), **PARAMS)) is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_silence_and_stationary_audio_are_uncacheable():
+    n = 3 * SAMPLE_RATE
+    assert fingerprint(torch.zeros(n)) is None
+    assert fingerprint(torch.full((n,), 0.3)) is None
+    assert fingerprint(1e-6 * torch.randn(n)) is None
+    assert fingerprint(noise(0.05, seed=0)) is None
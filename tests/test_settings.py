@@ -0,0 +1,113 @@
+"""
+SettingsRegistry: value precedence, validation, rollback and pending reloads
+"""
+import json
+
+import pytest
+
+from settings import Setting, SettingsRegistry, SettingError
+
+
+ENV = "FUNASR_TEST_WORKERS"
+
+
+def workers(**kwargs) -> Setting:
+    return Setting("workers", int, 2, env=ENV, minimum=1, **kwargs)
+
+
+def test_precedence_default_env_file_update(tmp_path, monkeypatch):
+    monkeypatch.delenv(ENV, raising=False)
+    registry = SettingsRegistry()
+    registry.register(workers())
+    assert registry["workers"] == 2
+    assert registry.snapshot()["workers"]["source"] == "default"
+
+    monkeypatch.setenv(ENV, "4")
+    registry = SettingsRegistry()
+    registry.register(workers())
+    assert registry["workers"] == 4
+    assert registry.snapshot()["workers"]["source"] == "env"
+
+    path = tmp_path / "settings.json"
+    path.write_text(json.dumps({"workers": 6}))
+    registry = SettingsRegistry(str(path))
+    registry.register(workers())
+    assert registry["workers"] == 6
+    assert registry.snapshot()["workers"]["source"] == "file"
+
+    result = registry.update({"workers": 8})
+    assert result == {"applied": {"workers": 8}, "pending_reload": {}, "persisted": True}
+    assert registry["workers"] == 8
+    assert registry.snapshot()["workers"]["source"] == "admin"
+    assert json.loads(path.read_text()) == {"workers": 8}
+
+    # The persisted override still beats the environment after a restart
+    registry = SettingsRegistry(str(path))
+    registry.register(workers())
+    assert registry["workers"] == 8
+
+
+def test_update_without_file_is_not_persisted(monkeypatch):
+    monkeypatch.delenv(ENV, raising=False)
+    registry = SettingsRegistry()
+    registry.register(workers())
+    assert registry.update({"workers": 3})["persisted"] is False
+    assert registry["workers"] == 3
+
+
+def test_rejects_fractional_int_and_bounds(monkeypatch):
+    monkeypatch.delenv(ENV, raising=False)
+    registry = SettingsRegistry()
+    registry.register(workers())
+    with pytest.raises(SettingError):
+        registry.update({"workers": 1.5})
+    with pytest.raises(SettingError):
+        registry.update({"workers": 0})
+    with pytest.raises(SettingError):
+        registry.update({"nope": 1})
+    assert registry["workers"] == 2
+    assert registry.update({"workers": 3.0})["applied"] == {"workers": 3}
+
+
+def test_failed_on_change_rolls_back_whole_update(tmp_path, monkeypatch):
+    monkeypatch.delenv(ENV, raising=False)
+    calls = []
+
+    def broken(value):
+        calls.append(("ratio", value))
+        if value == 0.9:
+            raise RuntimeError("cannot apply")
+
+    path = tmp_path / "settings.json"
+    registry = SettingsRegistry(str(path))
+    registry.register(workers(on_change=lambda v: calls.append(("workers", v))))
+    registry.register(Setting("ratio", float, 0.5, env="FUNASR_TEST_RATIO", on_change=broken))
+
+    with pytest.raises(RuntimeError):
+        registry.update({"workers": 5, "ratio": 0.9})
+
+    assert registry["workers"] == 2
+    assert registry["ratio"] == 0.5
+    assert registry.snapshot()["workers"]["source"] == "default"
+    # Both are restored newest first, including the half-applied failing one
+    assert calls == [("workers", 5), ("ratio", 0.9), ("ratio", 0.5), ("workers", 2)]
+    assert not path.exists()
+
+
+def test_reload_required_values_are_pending(monkeypatch):
+    monkeypatch.delenv("FUNASR_TEST_DTYPE", raising=False)
+    changed = []
+    registry = SettingsRegistry()
+    registry.register(Setting("dtype", str, "fp16", env="FUNASR_TEST_DTYPE", choices=("fp16", "bf16"),
+                              reload_required=True, on_change=changed.append))
+
+    result = registry.update({"dtype": "bf16"})
+    assert result["applied"] == {}
+    assert result["pending_reload"] == {"dtype": "bf16"}
+    assert registry["dtype"] == "fp16"
+    assert registry.snapshot()["dtype"]["pending_value"] == "bf16"
+    assert changed == []
+
+    # Setting it back to the live value clears the pending entry
+    registry.update({"dtype": "fp16"})
+    assert "pending_value" not in registry.snapshot()["dtype"]
@@ -0,0 +1,101 @@
+"""
+Equivalence of splice_speech_embeds with the per-turn loop it replaced
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("funasr")
+pytest.importorskip("transformers")
+
+from model import splice_speech_embeds
+
+
+def loop_splice(inputs_embeds, encoder_out, encoder_out_lens, fbank_beg, fake_token_len):
+    """The former nested batch/turn loop of forward / inference_prepare"""
+    speech_idx = 0
+    for batch_idx in range(inputs_embeds.shape[0]):
+        for turn_id in range(fbank_beg.shape[1]):
+            fbank_beg_idx = fbank_beg[batch_idx, turn_id].item()
+            if fbank_beg_idx > 0:
+                speech_token_len = fake_token_len[batch_idx, turn_id]
+                speech_token = encoder_out[speech_idx, :speech_token_len, :]
+                try:
+                    inputs_embeds[batch_idx, fbank_beg_idx: fbank_beg_idx + speech_token_len, :] = speech_token
+                except Exception:
+                    speech_token_len = encoder_out_lens[speech_idx].item()
+                    speech_token = encoder_out[speech_idx, :speech_token_len, :]
+                    inputs_embeds[batch_idx, fbank_beg_idx: fbank_beg_idx + speech_token_len, :] = speech_token
+                speech_idx += 1
+    return inputs_embeds
+
+
+def run_both(inputs_embeds, encoder_out, encoder_out_lens, fbank_beg, fake_token_len):
+    results = []
+    for splice in (loop_splice, splice_speech_embeds):
+        try:
+            results.append(splice(inputs_embeds.clone(), encoder_out, encoder_out_lens,
+                                  fbank_beg.clone(), fake_token_len.clone()))
+        except RuntimeError:
+            results.append(None)
+    return results
+
+
+def random_case(generator, batch_size, turns, token_num, max_frames, dim=4):
+    """Non-overlapping turns per row (the loop's write order is then irrelevant); late ones may overrun"""
+    def randint(lo, hi):
+        return torch.randint(lo, hi, (1,), generator=generator).item()
+
+    fbank_beg = torch.zeros(batch_size, turns, dtype=torch.long)
+    fake_token_len = torch.zeros(batch_size, turns, dtype=torch.long)
+    for b in range(batch_size):
+        pos = randint(1, 4)
+        for t in range(turns):
+            if randint(0, 10) < 7:
+                fbank_beg[b, t] = pos
+                fake_token_len[b, t] = randint(0, max_frames + 4)
+                pos += max(int(fake_token_len[b, t]), max_frames) + randint(0, 3)
+    num_speech = int((fbank_beg > 0).sum())
+    encoder_out = torch.randn(max(num_speech, 1), max_frames, dim, generator=generator)
+    encoder_out_lens = torch.randint(0, max_frames + 1, (max(num_speech, 1),), generator=generator)
+    inputs_embeds = torch.randn(batch_size, token_num, dim, generator=generator)
+    return inputs_embeds, encoder_out, encoder_out_lens, fbank_beg, fake_token_len
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_matches_loop_on_random_inputs(seed):
+    generator = torch.Generator().manual_seed(seed)
+    case = random_case(generator, batch_size=1 + seed % 4, turns=1 + seed % 3,
+                       token_num=8 + seed % 24, max_frames=2 + seed % 10)
+    expected, actual = run_both(*case)
+    if expected is None:
+        assert actual is None
+    else:
+        assert actual is not None
+        assert torch.equal(expected, actual)
+
+
+def test_zero_length_rows_leave_embeddings_untouched():
+    inputs_embeds = torch.randn(2, 10, 3)
+    encoder_out = torch.randn(2, 5, 3)
+    fbank_beg = torch.tensor([[2], [4]])
+    fake_token_len = torch.tensor([[0], [0]])
+    expected, actual = run_both(inputs_embeds, encoder_out, torch.tensor([5, 5]), fbank_beg, fake_token_len)
+    assert torch.equal(expected, inputs_embeds)
+    assert torch.equal(actual, inputs_embeds)
+
+
+def test_placeholder_longer_than_encoder_output_uses_encoder_lens():
+    inputs_embeds = torch.zeros(1, 20, 2)
+    encoder_out = torch.ones(1, 4, 2)
+    expected, actual = run_both(inputs_embeds, encoder_out, torch.tensor([3]),
+                                torch.tensor([[5]]), torch.tensor([[9]]))
+    assert torch.equal(expected, actual)
+    assert actual[0, 5:8].eq(1).all() and actual[0, 8:].eq(0).all()
+
+
+def test_overrun_raises_like_loop():
+    inputs_embeds = torch.zeros(1, 6, 2)
+    encoder_out = torch.ones(1, 8, 2)
+    expected, actual = run_both(inputs_embeds, encoder_out, torch.tensor([8]),
+                                torch.tensor([[3]]), torch.tensor([[8]]))
+    assert expected is None and actual is None
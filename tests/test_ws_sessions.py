@@ -0,0 +1,149 @@
+"""
+SessionStore / WSSession: expiry, byte and session caps, replay and takeover
+"""
+import asyncio
+
+import pytest
+
+from ws_sessions import SessionStore, SessionBufferFull, SessionLimitExceeded
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def drain(queue: asyncio.Queue) -> list:
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+
+def test_detached_session_expires_after_ttl():
+    expired = []
+
+    async def main():
+        store = SessionStore(ttl=0.05)
+        session = store.create({"language": "en"})
+        session.on_expire = expired.append
+        queue = session.attach()
+        store.append(session, b"\0" * 100)
+        store.release(session, queue)
+        assert store.get(session.id) is session
+        await asyncio.sleep(0.15)
+        return store, session
+
+    store, session = run(main())
+    assert expired == [session]
+    assert store.get(session.id) is None
+    assert store.expired == 1
+    assert store.buffered == 0
+
+
+def test_resumed_session_does_not_expire():
+    async def main():
+        store = SessionStore(ttl=0.05)
+        session = store.create({})
+        store.release(session, session.attach())
+        await asyncio.sleep(0.02)
+        store.resume(session.id)
+        await asyncio.sleep(0.1)
+        return store, session
+
+    store, session = run(main())
+    assert store.get(session.id) is session
+    assert store.expired == 0
+    assert store.resumed == 1
+
+
+def test_per_session_byte_cap():
+    async def main():
+        store = SessionStore(max_bytes=10)
+        session = store.create({})
+        store.append(session, b"x" * 8)
+        with pytest.raises(SessionBufferFull):
+            store.append(session, b"x" * 3)
+        return store, session
+
+    store, session = run(main())
+    assert session.received == 8
+    assert store.buffered == 8
+
+
+def test_total_byte_cap_and_release_on_take_audio():
+    async def main():
+        store = SessionStore(max_bytes=100, max_total_bytes=15)
+        a, b = store.create({}), store.create({})
+        store.append(a, b"a" * 10)
+        with pytest.raises(SessionBufferFull):
+            store.append(b, b"b" * 10)
+        assert store.rejected == 1
+        assert store.take_audio(a) == b"a" * 10
+        store.append(b, b"b" * 10)
+        return store
+
+    store = run(main())
+    assert store.buffered == 10
+
+
+def test_session_limit():
+    async def main():
+        store = SessionStore(max_sessions=2)
+        first = store.create({})
+        store.create({})
+        with pytest.raises(SessionLimitExceeded):
+            store.create({})
+        store.discard(first)
+        store.create({})
+        return store
+
+    store = run(main())
+    assert store.rejected == 1
+    assert store.stats()["sessions"] == 2
+
+
+def test_resume_replays_events_after_last_seq():
+    async def main():
+        store = SessionStore()
+        session = store.create({})
+        queue = session.attach()
+        session.publish({"type": "progress", "current": 1})
+        session.publish({"type": "partial", "text": "he"}, durable=False)
+        session.publish({"type": "progress", "current": 2})
+        session.publish({"type": "final", "text": "hello"})
+        assert [e.get("seq") for e in drain(queue)] == [1, None, 2, 3]
+        store.release(session, queue)
+        resumed, new_queue = store.resume(session.id, last_seq=1)
+        return resumed is session, drain(new_queue)
+
+    same, replayed = run(main())
+    assert same
+    # Partials are live-only; only durable events after seq 1 come back
+    assert [(e["type"], e["seq"]) for e in replayed] == [("progress", 2), ("final", 3)]
+
+
+def test_resume_unknown_session():
+    async def main():
+        return SessionStore().resume("missing")
+
+    assert run(main()) is None
+
+
+def test_takeover_signals_old_connection():
+    async def main():
+        store = SessionStore()
+        session = store.create({})
+        old = session.attach()
+        _, new = store.resume(session.id)
+        assert drain(old) == [None]
+        assert not session.owns(old)
+        assert session.owns(new)
+        # The superseded connection's cleanup must not detach the new one
+        store.release(session, old)
+        assert session.attached
+        session.publish({"type": "final", "text": "x"})
+        return drain(old), drain(new)
+
+    old_events, new_events = run(main())
+    assert old_events == []
+    assert [e["type"] for e in new_events] == ["final"]
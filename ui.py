@@ -0,0 +1,185 @@
+"""
+Fun-ASR Web UI
+Gradio interface, either mounted in the API process (app.py) or run standalone
+as a separate process that talks to the API over HTTP:
+
+    FUNASR_API_URL=http://localhost:8189 python ui.py
+"""
+import os
+import json
+import logging
+from typing import Callable, List, Optional
+
+import gradio as gr
+
+from engine import AdmissionRejected
+
+logger = logging.getLogger(__name__)
+
+LANGUAGES = {
+    "自动检测 / Auto": "auto",
+    "中文 / Chinese": "zh", 
+    "English": "en",
+    "日本語 / Japanese": "ja",
+}
+
+# Runner signature: (audio_path, language, hotwords, itn, progress_callback, partial_callback) -> result dict
+# with "text", "time" (processing seconds) and "duration" (audio seconds)
+Runner = Callable[[str, str, List[str], bool, Optional[Callable], Optional[Callable]], dict]
+
+def http_runner(api_url: str) -> Runner:
+    """Runner that forwards to a Fun-ASR API's SSE endpoint"""
+    import httpx
+
+    def run(audio_path, language, hotwords, itn, progress_callback=None, partial_callback=None) -> dict:
+        data = {"language": language, "hotwords": ",".join(hotwords), "itn": str(itn).lower()}
+        with open(audio_path, "rb") as f:
+            files = {"file": (os.path.basename(audio_path), f)}
+            with httpx.stream("POST", f"{api_url}/v1/audio/transcriptions/stream",
+                              data=data, files=files, timeout=None) as response:
+                if response.status_code == 429:
+                    raise AdmissionRejected("interactive", int(response.headers.get("Retry-After", 1)))
+                if response.status_code == 400:
+                    response.read()
+                    raise ValueError(response.json().get("detail", "Bad request"))
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    event = json.loads(line[6:])
+                    if event["type"] == "progress" and progress_callback:
+                        progress_callback(event["current"], event["total"], event["text"])
+                    elif event["type"] == "partial" and partial_callback:
+                        partial_callback(event["segment"], event["text"])
+                    elif event["type"] == "complete":
+                        return {"text": event["text"], "time": event["duration"], "duration": event.get("audio_duration", 0)}
+                    elif event["type"] == "error":
+                        raise gr.Error(event["message"])
+        raise gr.Error("连接中断 / Connection closed before completion")
+
+    return run
+
+def build_demo(runner: Runner) -> gr.Blocks:
+    """Build the Gradio Blocks UI on top of a transcription runner"""
+
+    def gradio_transcribe(audio, language, hotwords, itn, progress=gr.Progress()):
+        """Gradio interface function with progress bar"""
+        if audio is None:
+            return "请上传或录制音频 / Please upload or record audio", ""
+        
+        hw_list = [w.strip() for w in hotwords.split(",") if w.strip()] if hotwords else []
+        lang_code = LANGUAGES.get(language, "auto")
+        
+        # Progress tracking
+        progress_state = {"current": 0, "total": 1, "text": ""}
+        
+        def progress_callback(current, total, text):
+            progress_state["current"] = current
+            progress_state["total"] = total
+            progress_state["text"] = text
+            if total > 0:
+                progress(current / total, desc=f"处理中 {current}/{total} 段...")
+        
+        def partial_callback(segment, text):
+            # Show the tail of the hypothesis being decoded
+            total = progress_state["total"]
+            tail = text[-40:]
+            progress(segment / total if total > 0 else 0, desc=f"处理中 {segment + 1}/{total} 段... {tail}")
+        
+        progress(0, desc="开始识别...")
+        try:
+            result = runner(audio, lang_code, hw_list, itn, progress_callback, partial_callback)
+        except AdmissionRejected as e:
+            raise gr.Error(f"服务繁忙，请 {e.retry_after} 秒后重试 / Server busy, retry in {e.retry_after}s")
+        except ValueError as e:
+            raise gr.Error(str(e))
+        progress(1, desc="完成!")
+        
+        # Format timer
+        audio_duration = result.get("duration", 0)
+        rtf = result['time'] / audio_duration if audio_duration > 0 else 0
+        if progress_state["total"] > 1:
+            timer_text = f"⏱️ 识别耗时: {result['time']:.2f}s | 音频时长: {audio_duration:.2f}s | RTF: {rtf:.2f}x | VAD分段: {progress_state['total']}段"
+        else:
+            timer_text = f"⏱️ 识别耗时: {result['time']:.2f}s | 音频时长: {audio_duration:.2f}s | RTF: {rtf:.2f}x"
+        
+        return result["text"], timer_text
+
+    with gr.Blocks(title="Fun-ASR 语音识别") as demo:
+        gr.Markdown("""
+        <div style="text-align: center; margin-bottom: 1rem;">
+        <h1>🎙️ Fun-ASR 语音识别</h1>
+        <p>基于 Fun-ASR-Nano-2512 的端到端语音识别服务 | 支持超长音频自动分段</p>
+        </div>
+        """)
+    
+        with gr.Row():
+            with gr.Column(scale=1):
+                audio_input = gr.Audio(
+                    label="🎤 上传或录制音频 (支持任意时长)",
+                    type="filepath",
+                    sources=["upload", "microphone"],
+                )
+            
+                with gr.Accordion("⚙️ 参数设置", open=True):
+                    language = gr.Dropdown(
+                        choices=list(LANGUAGES.keys()),
+                        value="自动检测 / Auto",
+                        label="语言 / Language",
+                    )
+                    hotwords = gr.Textbox(
+                        label="热词 / Hotwords",
+                        placeholder="用逗号分隔，如：人工智能,机器学习",
+                        info="提高特定词汇的识别准确率",
+                    )
+                    itn = gr.Checkbox(
+                        value=True,
+                        label="文本规整 (ITN)",
+                        info="将数字、日期等转换为标准格式",
+                    )
+            
+                submit_btn = gr.Button("🚀 开始识别", variant="primary", size="lg")
+        
+            with gr.Column(scale=1):
+                result_text = gr.Textbox(
+                    label="📝 识别结果",
+                    lines=12,
+                    max_lines=20,
+                )
+                timer_display = gr.Markdown()
+    
+        submit_btn.click(
+            fn=gradio_transcribe,
+            inputs=[audio_input, language, hotwords, itn],
+            outputs=[result_text, timer_display],
+        )
+    
+        gr.Markdown("""
+        ---
+        ### 📡 API 使用
+    
+        **REST API (同步):**
+        ```bash
+        curl -X POST http://localhost:8189/v1/audio/transcriptions \\
+          -F "file=@audio.wav" -F "language=auto"
+        ```
+    
+        **REST API (流式进度):**
+        ```bash
+        curl -X POST http://localhost:8189/v1/audio/transcriptions/stream \\
+          -F "file=@long_audio.mp3" -F "language=zh"
+        ```
+    
+        **WebSocket:** `ws://localhost:8189/ws/transcribe`
+    
+        📖 [API 文档](/docs) | 💡 超过30秒的音频自动使用VAD分段处理
+        """)
+    
+    return demo
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    api_url = os.environ.get("FUNASR_API_URL", "http://localhost:8189").rstrip("/")
+    port = int(os.environ.get("UI_PORT", 7860))
+    logger.info(f"Starting standalone UI on port {port}, API: {api_url}")
+    build_demo(http_runner(api_url)).launch(server_name="0.0.0.0", server_port=port)
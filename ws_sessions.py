@@ -0,0 +1,201 @@
+"""
+Fun-ASR WebSocket sessions
+Server-side state of /ws/transcribe sessions, so a client whose connection
+drops can reconnect, resume its upload from the last byte the server holds
+and receive only the results it has not seen yet.
+
+All methods run on the event loop thread; worker threads hand events over
+with loop.call_soon_threadsafe(session.publish, ...).
+"""
+import time
+import uuid
+import asyncio
+import logging
+from collections import deque
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SessionBufferFull(Exception):
+    """Raised when received audio would exceed the session's or the store's byte limit"""
+
+
+class SessionLimitExceeded(Exception):
+    """Raised when the store cannot take another session"""
+
+
+class WSSession:
+    """
+    One transcription session: received audio, config and a log of result events.
+
+    Result events (progress, final, error) get increasing "seq" numbers and are
+    kept (up to max_events) for replay on resume; partial hypotheses are only
+    sent live since the next progress event supersedes them.
+    """
+    def __init__(self, session_id: str, config: dict, max_bytes: int, max_events: int):
+        self.id = session_id
+        self.config = config
+        self.audio = bytearray()
+        self.received = 0
+        self.max_bytes = max_bytes
+        self.state = "receiving"      # receiving -> transcribing -> done
+        self.events = deque(maxlen=max_events)
+        self.seq = 0
+        self.cancel_token = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.last_seen = time.monotonic()
+        self.on_expire: Optional[Callable[["WSSession"], None]] = None
+
+    def append(self, data: bytes):
+        if self.received + len(data) > self.max_bytes:
+            raise SessionBufferFull(f"Session audio exceeds {self.max_bytes} bytes")
+        self.audio += data
+        self.received += len(data)
+
+    def take_audio(self) -> bytes:
+        """Hand the received audio to the job and free the buffer (received keeps counting)"""
+        audio = bytes(self.audio)
+        self.audio = bytearray()
+        return audio
+
+    def publish(self, event: dict, durable: bool = True):
+        if durable:
+            self.seq += 1
+            event = {**event, "seq": self.seq}
+            self.events.append(event)
+        if self.queue is not None:
+            self.queue.put_nowait(event)
+
+    def attach(self, last_seq: int = 0) -> asyncio.Queue:
+        """
+        Bind a connection; logged events after last_seq are queued for it first.
+
+        A connection that still holds the session (e.g. a half-open socket) is
+        taken over: its queue gets a None sentinel, and it must check
+        owns(queue) before touching the session again.
+        """
+        if self.queue is not None:
+            self.queue.put_nowait(None)
+        self.queue = asyncio.Queue()
+        for event in self.events:
+            if event["seq"] > last_seq:
+                self.queue.put_nowait(event)
+        self.last_seen = time.monotonic()
+        return self.queue
+
+    def owns(self, queue: Optional[asyncio.Queue]) -> bool:
+        """Whether the connection holding queue is still the session's current one"""
+        return queue is not None and self.queue is queue
+
+    def detach(self, queue: Optional[asyncio.Queue]):
+        if queue is not None and self.queue is queue:
+            self.queue = None
+        self.last_seen = time.monotonic()
+
+    @property
+    def attached(self) -> bool:
+        return self.queue is not None
+
+
+class SessionStore:
+    """
+    Sessions by id. A session without a connection is dropped ttl seconds after
+    it was last seen (its on_expire hook cancels a running job); ttl=0 drops it
+    as soon as the connection goes away.
+
+    Besides the per-session max_bytes, audio buffered across all sessions is
+    capped at max_total_bytes and the number of sessions at max_sessions, so
+    detached sessions waiting for a resume cannot exhaust memory.
+    """
+    def __init__(self, ttl: float = 300.0, max_bytes: int = 256 * 1024 * 1024, max_events: int = 1000,
+                 max_total_bytes: int = 2 * 1024 * 1024 * 1024, max_sessions: int = 1000):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_events = max_events
+        self.max_total_bytes = max_total_bytes
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.buffered = 0
+        self.resumed = 0
+        self.expired = 0
+        self.rejected = 0
+
+    def create(self, config: dict) -> WSSession:
+        if len(self.sessions) >= self.max_sessions or self.buffered >= self.max_total_bytes:
+            self.rejected += 1
+            raise SessionLimitExceeded(f"WebSocket session capacity exhausted ({len(self.sessions)} sessions, "
+                                       f"{self.buffered} bytes buffered)")
+        session = WSSession(uuid.uuid4().hex, dict(config), self.max_bytes, self.max_events)
+        self.sessions[session.id] = session
+        return session
+
+    def append(self, session: WSSession, data: bytes):
+        """Buffer received audio within the session and store-wide byte limits"""
+        if self.buffered + len(data) > self.max_total_bytes:
+            self.rejected += 1
+            raise SessionBufferFull(f"Buffered WebSocket audio exceeds {self.max_total_bytes} bytes across sessions")
+        session.append(data)
+        self.buffered += len(data)
+
+    def take_audio(self, session: WSSession) -> bytes:
+        audio = session.take_audio()
+        self.buffered -= len(audio)
+        return audio
+
+    def get(self, session_id: Optional[str]) -> Optional[WSSession]:
+        return self.sessions.get(session_id) if session_id else None
+
+    def resume(self, session_id: Optional[str], last_seq: int = 0):
+        """(session, queue) for a reconnecting client, or None if unknown/expired"""
+        session = self.get(session_id)
+        if session is None:
+            return None
+        self.resumed += 1
+        return session, session.attach(last_seq)
+
+    def release(self, session: WSSession, queue: Optional[asyncio.Queue]):
+        """A connection went away: keep the session for ttl seconds unless someone resumes it"""
+        session.detach(queue)
+        self.schedule(session)
+
+    def schedule(self, session: WSSession):
+        if session.attached or session.id not in self.sessions:
+            return
+        asyncio.get_running_loop().call_later(self.ttl, self._expire, session)
+
+    def _expire(self, session: WSSession):
+        if session.attached or self.sessions.get(session.id) is not session:
+            return
+        idle = time.monotonic() - session.last_seen
+        if idle < self.ttl:
+            # Reattached and released again since this timer was set
+            asyncio.get_running_loop().call_later(self.ttl - idle, self._expire, session)
+            return
+        self.discard(session)
+        self.expired += 1
+        logger.info(f"WebSocket session {session.id} expired ({session.state})")
+        if session.on_expire is not None:
+            session.on_expire(session)
+
+    def discard(self, session: WSSession):
+        if self.sessions.pop(session.id, None) is not None:
+            self.buffered -= len(session.audio)
+            session.audio = bytearray()
+
+    def stats(self) -> dict:
+        states = {}
+        for session in self.sessions.values():
+            states[session.state] = states.get(session.state, 0) + 1
+        return {
+            "sessions": len(self.sessions),
+            "detached": sum(1 for s in self.sessions.values() if not s.attached),
+            "by_state": states,
+            "buffered_bytes": self.buffered,
+            "max_total_bytes": self.max_total_bytes,
+            "max_sessions": self.max_sessions,
+            "resumed": self.resumed,
+            "expired": self.expired,
+            "rejected": self.rejected,
+            "ttl": self.ttl,
+        }